@@ -1,8 +1,9 @@
 """PDF在线处理工具 - Flask主应用"""
-from flask import Flask, request, jsonify, send_file, send_from_directory
+from flask import Flask, Response, request, jsonify, send_file, send_from_directory, stream_with_context
 from flask_cors import CORS
 from apscheduler.schedulers.background import BackgroundScheduler
 import os
+import json
 
 from config import Config
 from task_manager import task_manager
@@ -10,8 +11,19 @@ from services.pdf_service import PDFService
 from tasks import pdf_tasks
 from utils.file_handler import (
     allowed_file, validate_pdf, save_upload_file,
-    get_file_path, delete_file, cleanup_old_files, get_disk_usage
+    get_file_path, delete_file, cleanup_old_files, get_disk_usage,
+    get_result_stream_path, register_upload, collect_result_files
 )
+from utils.preview_cache import preview_cache, analysis_cache
+from utils.document_pool import document_pool
+from utils.upload_index import upload_index
+from utils.result_cache import result_cache
+from utils.upload_sessions import upload_sessions, UploadSessionError
+from services.virtual_document import VirtualDocumentService
+from services.tile_service import TileService
+from services.prewarm_service import prewarm_service
+from services.page_analysis import PageAnalysis
+from utils.zip_stream import ZipStream
 
 # 初始化Flask应用
 app = Flask(__name__, static_folder='../frontend', static_url_path='')
@@ -49,8 +61,13 @@ def health_check():
         'port': Config.PORT,
         'memory_usage_mb': round(process.memory_info().rss / 1024 / 1024, 2),
         'disk_usage': get_disk_usage(),
+        'preview_cache': preview_cache.get_stats(),
+        'analysis_cache': analysis_cache.get_stats(),
+        'document_pool': document_pool.get_stats(),
+        'result_cache': result_cache.get_stats(),
         'config': {
             'max_workers': Config.MAX_WORKERS,
+            'task_backend': settings.get('task_backend'),
             'max_file_size_mb': Config.MAX_CONTENT_LENGTH / 1024 / 1024,
             'ocr_enabled': Config.ENABLE_OCR
         }
@@ -79,46 +96,356 @@ def upload_file():
     try:
         # 保存文件
         file_info = save_upload_file(file)
-        file_id = file_info['file_id']
-        
-        # 获取PDF元数据
-        metadata = PDFService.get_metadata(file_id)
-        file_info.update(metadata)
-        
+        return _upload_response(file_info)
+    except Exception as e:
+        return jsonify({'error': f'上传失败: {str(e)}'}), 500
+
+def _upload_response(file_info):
+    """读取已保存文件的元数据, 生成上传成功响应
+    
+    响应只需页数和加密状态(经文档池读取, 开销很小), 预览/缩略图和
+    逐页探测交给后台预热, 结果可通过/api/prewarm/<file_id>查询。
+    """
+    metadata = PDFService.get_metadata(file_info['file_id'])
+    prewarm_service.enqueue(file_info['file_id'])
+    
+    return jsonify({
+        'status': 'success',
+        'file_id': file_info['file_id'],
+        'filename': file_info['original_filename'],
+        'size': file_info['file_size'],
+        'pages': metadata['page_count'],
+        'is_encrypted': metadata['is_encrypted'],
+        'sha256': file_info['sha256'],
+        'deduplicated': file_info['deduplicated']
+    })
+
+def _upload_session_error(e):
+    body = {'error': str(e)}
+    if e.offset is not None:
+        body['offset'] = e.offset
+    return jsonify(body), e.status
+
+@app.route('/api/uploads', methods=['POST'])
+def create_upload_session():
+    """创建分块上传会话
+    
+    请求: {"filename": "a.pdf", "size": 字节数}
+    之后按顺序PUT /api/uploads/<upload_id>?offset=N 发送分块(请求体为原始数据),
+    中断后GET会话状态取得offset续传, 全部发送后POST .../finalize。
+    """
+    data = request.json or {}
+    try:
+        return jsonify(upload_sessions.create(data.get('filename'), data.get('size'))), 201
+    except UploadSessionError as e:
+        return _upload_session_error(e)
+
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+def get_upload_session(upload_id):
+    """查询分块上传会话状态(已确认偏移量)"""
+    try:
+        return jsonify(upload_sessions.status(upload_id))
+    except UploadSessionError as e:
+        return _upload_session_error(e)
+
+@app.route('/api/uploads/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    """上传一个分块, offset不等于已确认偏移量时返回409及正确的offset"""
+    offset = request.args.get('offset', type=int)
+    if offset is None:
+        return jsonify({'error': '缺少offset参数'}), 400
+    
+    try:
+        new_offset = upload_sessions.write_chunk(
+            upload_id, offset, request.stream, request.content_length
+        )
+        return jsonify({'upload_id': upload_id, 'offset': new_offset})
+    except UploadSessionError as e:
+        return _upload_session_error(e)
+    except Exception as e:
+        return jsonify({'error': f'分块写入失败: {str(e)}'}), 500
+
+@app.route('/api/uploads/<upload_id>/finalize', methods=['POST'])
+def finalize_upload(upload_id):
+    """完成分块上传: 校验PDF并登记文件, 响应与/api/upload一致"""
+    try:
+        file_id, filepath, filename, sha256 = upload_sessions.finalize(upload_id)
+    except UploadSessionError as e:
+        return _upload_session_error(e)
+    
+    with open(filepath, 'rb') as f:
+        if not validate_pdf(f):
+            os.remove(filepath)
+            return jsonify({'error': '无效的PDF文件'}), 422
+    
+    try:
+        file_info = register_upload(file_id, filepath, filename, sha256)
+        return _upload_response(file_info)
+    except Exception as e:
+        return jsonify({'error': f'上传失败: {str(e)}'}), 500
+
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+def abort_upload(upload_id):
+    """取消分块上传"""
+    try:
+        upload_sessions.abort(upload_id)
+        return jsonify({'status': 'success'})
+    except UploadSessionError as e:
+        return _upload_session_error(e)
+
+@app.route('/api/files/<sha256>', methods=['GET', 'HEAD'])
+def check_file(sha256):
+    """按SHA-256查询服务器是否已有该文件
+    
+    只返回是否存在和持有证明挑战, 不返回file_id。客户端按挑战计算
+    SHA-256(nonce + 各字节区间内容)后提交到/claim, 校验通过才能复用已有文件。
+    """
+    if request.method == 'HEAD':
+        exists = upload_index.lookup(sha256.lower(), touch=False) is not None
+        return app.response_class(status=200 if exists else 404)
+    
+    challenge = upload_index.create_challenge(sha256.lower())
+    if challenge is None:
+        return jsonify({'error': '文件不存在'}), 404
+    return jsonify({'status': 'exists', 'challenge': challenge})
+
+@app.route('/api/files/<sha256>/claim', methods=['POST'])
+def claim_file(sha256):
+    """提交持有证明, 通过后返回已有文件的file_id(并刷新其过期时间)"""
+    data = request.json or {}
+    entry = upload_index.verify_challenge(sha256.lower(), str(data.get('nonce', '')), data.get('proof'))
+    if entry is None:
+        return jsonify({'error': '文件校验失败, 请重新上传'}), 403
+    
+    try:
+        metadata = PDFService.get_metadata(entry['file_id'])
         return jsonify({
             'status': 'success',
-            'file_id': file_id,
-            'filename': file_info['original_filename'],
-            'size': file_info['file_size'],
+            'file_id': entry['file_id'],
+            'size': entry['size'],
             'pages': metadata['page_count'],
-            'is_encrypted': metadata['is_encrypted']
+            'is_encrypted': metadata['is_encrypted'],
+            'sha256': entry['sha256']
         })
     except Exception as e:
-        return jsonify({'error': f'上传失败: {str(e)}'}), 500
+        return jsonify({'error': str(e)}), 500
 
 # ==================== 文件预览 ====================
 
 @app.route('/api/preview/<file_id>', methods=['GET'])
 def preview_page(file_id):
-    """预览PDF页面"""
+    """预览PDF页面(带缓存, 支持ETag/Last-Modified协商)"""
     page_num = request.args.get('page', 1, type=int)
     dpi = request.args.get('dpi', Config.PREVIEW_DPI, type=int)
+    fmt = request.args.get('format', 'png').lower()
+    
+    if fmt == 'jpg':
+        fmt = 'jpeg'
+    if fmt not in Config.PREVIEW_FORMATS:
+        return jsonify({'error': f'不支持的预览格式: {fmt}'}), 400
     
+    # 虚拟文档的页面直接渲染其映射到的源页面, 与源文件共用缓存
+    rotation = None
     try:
-        img_bytes = PDFService.render_page_preview(file_id, page_num, dpi)
+        resolved = VirtualDocumentService.resolve_page(file_id, page_num)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if resolved:
+        file_id, page_num, rotation = resolved
+    
+    return _send_cached_render(
+        file_id,
+        preview_cache.make_variant(page_num, dpi, fmt, rotation),
+        Config.PREVIEW_FORMATS[fmt],
+        lambda: PDFService.render_page_preview(file_id, page_num, dpi, fmt, rotation),
+        '预览失败'
+    )
+
+@app.route('/api/prewarm/<file_id>', methods=['GET'])
+def prewarm_status(file_id):
+    """上传后预热的状态, 完成后附带逐页探测结果(是否有文字层、图片数等)
+    
+    status: pending/running/done/failed/none, 未预热过的文件可用?start=1加入队列
+    """
+    if not os.path.exists(get_file_path(file_id)):
+        return jsonify({'error': '文件不存在'}), 404
+    
+    try:
+        if request.args.get('start', type=int) == 1:
+            prewarm_service.enqueue(file_id)
+        return jsonify(prewarm_service.get_status(file_id))
+    except Exception as e:
+        return jsonify({'error': f'读取预热状态失败: {str(e)}'}), 500
+
+def _send_cached_render(file_id, variant, mimetype, render, error_label):
+    """返回渲染结果(带两级缓存, 支持ETag/Last-Modified协商), 缓存未命中时调用render()"""
+    filepath = get_file_path(file_id)
+    if not os.path.exists(filepath):
+        return jsonify({'error': '文件不存在'}), 404
+    
+    source_mtime = os.path.getmtime(filepath)
+    etag = preview_cache.make_etag(file_id, variant, source_mtime)
+    
+    # 浏览器缓存仍有效时直接返回304, 无需渲染
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        response.cache_control.max_age = Config.PREVIEW_CACHE_MAX_AGE
+        return response
+    
+    try:
+        img_bytes = preview_cache.get(file_id, variant, source_mtime)
+        if img_bytes is None:
+            img_bytes = render()
+            preview_cache.put(file_id, variant, source_mtime, img_bytes)
         
         from io import BytesIO
         return send_file(
             BytesIO(img_bytes),
-            mimetype='image/png',
-            as_attachment=False
+            mimetype=mimetype,
+            as_attachment=False,
+            etag=etag,
+            last_modified=source_mtime,
+            max_age=Config.PREVIEW_CACHE_MAX_AGE,
+            conditional=True
         )
     except FileNotFoundError:
         return jsonify({'error': '文件不存在'}), 404
     except ValueError as e:
         return jsonify({'error': str(e)}), 400
     except Exception as e:
-        return jsonify({'error': f'预览失败: {str(e)}'}), 500
+        return jsonify({'error': f'{error_label}: {str(e)}'}), 500
+
+def _sprite_params():
+    width = request.args.get('width', Config.SPRITE_THUMB_WIDTH, type=int)
+    fmt = request.args.get('format', 'jpeg').lower()
+    quality = request.args.get('quality', Config.TILE_DEFAULT_QUALITY, type=int)
+    return width, ('jpeg' if fmt == 'jpg' else fmt), quality
+
+@app.route('/api/thumbnails/<file_id>/sprite', methods=['GET'])
+def thumbnail_sprite(file_id):
+    """全部页面缩略图的雪碧图(一次遍历文档渲染), 位置见/index
+    
+    ?width=缩略图宽度, ?format=jpeg|webp|png, ?quality=1-100
+    """
+    width, fmt, quality = _sprite_params()
+    if fmt not in Config.TILE_FORMATS:
+        return jsonify({'error': f'不支持的图片格式: {fmt}'}), 400
+    
+    return _send_cached_render(
+        file_id,
+        preview_cache.make_sprite_variant(width, fmt, quality),
+        Config.TILE_FORMATS[fmt],
+        lambda: TileService.render_sprite_cached(file_id, width, fmt, quality)[0],
+        '生成缩略图失败'
+    )
+
+@app.route('/api/thumbnails/<file_id>/index', methods=['GET'])
+def thumbnail_sprite_index(file_id):
+    """雪碧图索引: 每页缩略图的位置和大小(参数与/sprite相同)"""
+    width, fmt, quality = _sprite_params()
+    if fmt not in Config.TILE_FORMATS:
+        return jsonify({'error': f'不支持的图片格式: {fmt}'}), 400
+    
+    filepath = get_file_path(file_id)
+    if not os.path.exists(filepath):
+        return jsonify({'error': '文件不存在'}), 404
+    
+    try:
+        variant = preview_cache.make_sprite_variant(width, fmt, quality)
+        source_mtime = os.path.getmtime(filepath)
+        data = preview_cache.get(file_id, f"{variant}.json", source_mtime)
+        if data is None:
+            # 同时缓存雪碧图本身, 随后的/sprite请求直接命中
+            _, index = TileService.render_sprite_cached(file_id, width, fmt, quality)
+        else:
+            index = json.loads(data)
+        index['sprite_url'] = f"/api/thumbnails/{file_id}/sprite?width={width}&format={fmt}&quality={quality}"
+        return jsonify(index)
+    except FileNotFoundError:
+        return jsonify({'error': '文件不存在'}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': f'生成缩略图失败: {str(e)}'}), 500
+
+@app.route('/api/tiles/<file_id>/<int:page_num>/info', methods=['GET'])
+def tile_info(file_id, page_num):
+    """页面瓦片金字塔信息(各级缩放比例、网格行列数)"""
+    try:
+        return jsonify(TileService.get_tile_info(file_id, page_num))
+    except FileNotFoundError:
+        return jsonify({'error': '文件不存在'}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': f'读取页面信息失败: {str(e)}'}), 500
+
+@app.route('/api/tiles/<file_id>/<int:page_num>/<int:level>/<int:x>_<int:y>', methods=['GET'])
+def page_tile(file_id, page_num, level, x, y):
+    """渲染页面的单个瓦片(只光栅化该区域)
+    
+    ?format=jpeg|webp|png, ?quality=1-100(默认TILE_DEFAULT_QUALITY)
+    """
+    fmt = request.args.get('format', 'jpeg').lower()
+    quality = request.args.get('quality', Config.TILE_DEFAULT_QUALITY, type=int)
+    
+    if fmt == 'jpg':
+        fmt = 'jpeg'
+    if fmt not in Config.TILE_FORMATS:
+        return jsonify({'error': f'不支持的瓦片格式: {fmt}'}), 400
+    
+    return _send_cached_render(
+        file_id,
+        preview_cache.make_tile_variant(page_num, level, x, y, fmt, quality),
+        Config.TILE_FORMATS[fmt],
+        lambda: TileService.render_tile(file_id, page_num, level, x, y, fmt, quality),
+        '渲染瓦片失败'
+    )
+
+# ==================== 虚拟文档 ====================
+
+@app.route('/api/virtual-docs', methods=['POST'])
+def create_virtual_doc():
+    """由一个或多个已上传文件创建虚拟文档
+    
+    之后的旋转/删除/追加只记录操作日志, 预览按页面映射渲染源页面,
+    下载或提交任务时才生成实际PDF。返回的vdoc_id可用作file_id。
+    """
+    data = request.json or {}
+    file_ids = data.get('file_ids') or ([data['file_id']] if data.get('file_id') else [])
+    
+    try:
+        return jsonify(VirtualDocumentService.create(file_ids)), 201
+    except FileNotFoundError as e:
+        return jsonify({'error': str(e)}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': f'创建虚拟文档失败: {str(e)}'}), 500
+
+@app.route('/api/virtual-docs/<vdoc_id>', methods=['GET'])
+def get_virtual_doc(vdoc_id):
+    """获取虚拟文档的操作日志和页面映射"""
+    try:
+        return jsonify(VirtualDocumentService.get(vdoc_id))
+    except FileNotFoundError as e:
+        return jsonify({'error': str(e)}), 404
+
+@app.route('/api/virtual-docs/<vdoc_id>/ops', methods=['POST'])
+def apply_virtual_doc_ops(vdoc_id):
+    """追加编辑操作, 请求体为单个操作或{"ops": [...]}"""
+    data = request.json or {}
+    ops = data.get('ops', [data])
+    
+    try:
+        return jsonify(VirtualDocumentService.apply_ops(vdoc_id, ops))
+    except FileNotFoundError as e:
+        return jsonify({'error': str(e)}), 404
+    except (ValueError, KeyError, TypeError) as e:
+        return jsonify({'error': f'无效的操作: {str(e)}'}), 400
+    except Exception as e:
+        return jsonify({'error': f'编辑失败: {str(e)}'}), 500
 
 # ==================== 文字提取 ====================
 
@@ -136,7 +463,8 @@ def extract_text():
         task_id = task_manager.submit_task(
             pdf_tasks.extract_text_task,
             file_id,
-            pages if pages else None
+            pages if pages else None,
+            stream=bool(data.get('stream'))
         )
         
         return jsonify({
@@ -146,6 +474,11 @@ def extract_text():
     except Exception as e:
         return jsonify({'error': str(e)}), 503
 
+def _result_cache_key(file_id, operation, pages, **params):
+    """生成任务结果缓存键(页码去重排序, params为其他影响结果的参数和设置)"""
+    params['pages'] = sorted(set(pages)) if pages else None
+    return result_cache.make_key(file_id, operation, params)
+
 @app.route('/api/extract-text-enhanced', methods=['POST'])
 def extract_text_enhanced():
     """提取PDF文字(增强版-保留排版和表格)"""
@@ -157,10 +490,23 @@ def extract_text_enhanced():
         return jsonify({'error': '缺少file_id参数'}), 400
     
     try:
-        task_id = task_manager.submit_task(
+        backend = PageAnalysis.resolve_backend(data.get('backend'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        force_tables = bool(data.get('force_table_detection'))
+        cache_key = _result_cache_key(file_id, 'extract_text_enhanced', pages,
+                                      ocr=settings.get('enable_ocr'),
+                                      layout=settings.get('enable_layout_preservation'),
+                                      backend=backend, force_tables=force_tables)
+        task_id = task_manager.submit_cached_task(
+            cache_key,
             pdf_tasks.extract_text_enhanced_task,
             file_id,
-            pages if pages else None
+            pages if pages else None,
+            backend=backend,
+            force_table_detection=force_tables
         )
         
         return jsonify({
@@ -181,10 +527,21 @@ def extract_text_clean():
         return jsonify({'error': '缺少file_id参数'}), 400
     
     try:
-        task_id = task_manager.submit_task(
+        backend = PageAnalysis.resolve_backend(data.get('backend'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        stream = bool(data.get('stream'))
+        # 流式结果按task_id写入NDJSON文件, 不做缓存
+        cache_key = None if stream else _result_cache_key(file_id, 'extract_text_clean', pages, backend=backend)
+        task_id = task_manager.submit_cached_task(
+            cache_key,
             pdf_tasks.extract_text_clean_task,
             file_id,
-            pages if pages else None
+            pages if pages else None,
+            stream=stream,
+            backend=backend
         )
         
         return jsonify({
@@ -205,10 +562,24 @@ def extract_tables():
         return jsonify({'error': '缺少file_id参数'}), 400
     
     try:
-        task_id = task_manager.submit_task(
+        backend = PageAnalysis.resolve_backend(data.get('backend'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        stream = bool(data.get('stream'))
+        # 默认先按框线预筛, 跳过的页码在结果的table_skipped_pages中; force_table_detection时每页完整检测
+        force_tables = bool(data.get('force_table_detection'))
+        cache_key = None if stream else _result_cache_key(file_id, 'extract_tables', pages, backend=backend,
+                                                          force_tables=force_tables)
+        task_id = task_manager.submit_cached_task(
+            cache_key,
             pdf_tasks.extract_tables_task,
             file_id,
-            pages if pages else None
+            pages if pages else None,
+            stream=stream,
+            backend=backend,
+            force_table_detection=force_tables
         )
         
         return jsonify({
@@ -237,7 +608,9 @@ def extract_images():
             pdf_tasks.extract_images_task,
             file_id,
             pages if pages else None,
-            export_path
+            export_path,
+            min_dimension=data.get('min_dimension'),
+            min_size=data.get('min_size')
         )
         
         return jsonify({
@@ -263,7 +636,8 @@ def delete_pages():
         task_id = task_manager.submit_task(
             pdf_tasks.delete_pages_task,
             file_id,
-            pages
+            pages,
+            compact=bool(data.get('compact'))
         )
         
         return jsonify({
@@ -290,7 +664,8 @@ def rotate_pages():
         task_id = task_manager.submit_task(
             pdf_tasks.rotate_pages_task,
             file_id,
-            rotations
+            rotations,
+            compact=bool(data.get('compact'))
         )
         
         return jsonify({
@@ -302,17 +677,25 @@ def rotate_pages():
 
 @app.route('/api/merge-pdfs', methods=['POST'])
 def merge_pdfs():
-    """合并多个PDF"""
+    """合并多个PDF
+    
+    请求: {"file_ids": [...]} 合并全部页面, 或
+         {"sources": [{"file_id": ..., "pages": [1, 2]}, ...]} 按文件选择页面(页码从1开始)
+    """
     data = request.json
-    file_ids = data.get('file_ids', [])
+    sources = data.get('sources') or data.get('file_ids', [])
+    
+    if not sources or not all(isinstance(s, str) or (isinstance(s, dict) and s.get('file_id')) for s in sources):
+        return jsonify({'error': '参数错误'}), 400
     
-    if not file_ids or len(file_ids) < 2:
+    # 同一文件选取不同页面时允许只有一个来源
+    if len(sources) < 2 and not data.get('sources'):
         return jsonify({'error': '至少需要2个PDF文件'}), 400
     
     try:
         task_id = task_manager.submit_task(
             pdf_tasks.merge_pdfs_task,
-            file_ids
+            sources
         )
         
         return jsonify({
@@ -388,7 +771,10 @@ def convert_to_word():
         return jsonify({'error': '缺少file_id参数'}), 400
     
     try:
-        task_id = task_manager.submit_task(
+        cache_key = _result_cache_key(file_id, 'convert_to_word', pages,
+                                      export_path=export_path or settings.get('export_path'))
+        task_id = task_manager.submit_cached_task(
+            cache_key,
             pdf_tasks.convert_to_word_task,
             file_id,
             pages if pages else None,
@@ -406,7 +792,21 @@ def convert_to_word():
 
 @app.route('/api/task-status/<task_id>', methods=['GET'])
 def get_task_status(task_id):
-    """查询任务状态"""
+    """查询任务状态
+    
+    支持长轮询: ?wait=30&version=N 在状态版本超过N或超时后返回
+    """
+    wait = min(request.args.get('wait', 0, type=float), Config.TASK_LONG_POLL_MAX_WAIT)
+    version = request.args.get('version', 0, type=int)
+    
+    # 优先使用内存中的状态快照, 无需查询数据库
+    event = task_manager.wait_for_update(task_id, version, max(wait, 0))
+    if event is not None:
+        return app.response_class(
+            task_manager.format_event(task_id, event),
+            mimetype='application/json'
+        )
+    
     status = task_manager.get_task_status(task_id)
     
     if not status:
@@ -414,12 +814,120 @@ def get_task_status(task_id):
     
     return jsonify(status)
 
+@app.route('/api/task-events/<task_id>', methods=['GET'])
+def task_events(task_id):
+    """任务状态推送(Server-Sent Events)"""
+    version = request.headers.get('Last-Event-ID', 0, type=int)
+    
+    if task_manager.wait_for_update(task_id) is None:
+        # 不在内存中的任务(如服务重启前提交的)只推送一次数据库中的状态
+        status = task_manager.get_task_status(task_id)
+        if not status:
+            return jsonify({'error': '任务不存在'}), 404
+        
+        body = f"event: status\ndata: {json.dumps(status, ensure_ascii=False)}\n\n"
+        return Response(body, mimetype='text/event-stream')
+    
+    def generate():
+        last_version = version
+        while True:
+            event = task_manager.wait_for_update(task_id, last_version, Config.TASK_EVENT_HEARTBEAT)
+            if event is None:
+                return
+            
+            if event['version'] == last_version:
+                if event['status'] in ('COMPLETED', 'FAILED'):
+                    return
+                yield ': keep-alive\n\n'
+                continue
+            
+            last_version = event['version']
+            yield f"id: {last_version}\nevent: status\ndata: {task_manager.format_event(task_id, event)}\n\n"
+            
+            if event['status'] in ('COMPLETED', 'FAILED'):
+                return
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/task-stream/<task_id>', methods=['GET'])
+def task_stream(task_id):
+    """流式读取任务结果(NDJSON, 分块传输), 任务运行中即可开始读取"""
+    result_path = get_result_stream_path(task_id)
+    
+    event = task_manager.wait_for_update(task_id)
+    if event is None:
+        # 不在内存中的任务: 仅返回已完成的结果文件
+        if not os.path.exists(result_path):
+            return jsonify({'error': '任务不存在或不是流式任务'}), 404
+        return send_file(result_path, mimetype='application/x-ndjson')
+    if not event.get('stream'):
+        return jsonify({'error': '该任务不是流式任务'}), 400
+    
+    def generate():
+        version = 0
+        pending = b''
+        f = None
+        try:
+            while True:
+                if f is None and os.path.exists(result_path):
+                    f = open(result_path, 'rb')
+                
+                chunk = f.read(64 * 1024) if f else b''
+                if chunk:
+                    # 只输出完整的行, 避免客户端读到半条记录
+                    pending += chunk
+                    end = pending.rfind(b'\n') + 1
+                    if end:
+                        yield pending[:end]
+                        pending = pending[end:]
+                    continue
+                
+                event = task_manager.wait_for_update(task_id, version, 1)
+                if event is None:
+                    return
+                version = event['version']
+                
+                if event['status'] in ('COMPLETED', 'FAILED'):
+                    # 结果文件可能在上次检查之后才创建, 重新打开并读完任务结束前写入的内容
+                    if f is None and os.path.exists(result_path):
+                        f = open(result_path, 'rb')
+                    if f:
+                        for chunk in iter(lambda: f.read(64 * 1024), b''):
+                            pending += chunk
+                    if pending:
+                        yield pending
+                    if event['status'] == 'FAILED':
+                        error = json.dumps({'error': event['error']}, ensure_ascii=False)
+                        yield (error + '\n').encode('utf-8')
+                    return
+        finally:
+            if f:
+                f.close()
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 # ==================== 文件下载 ====================
 
 @app.route('/api/download/<file_id>', methods=['GET'])
 def download_file(file_id):
     """下载处理后的PDF或Word文件"""
     folder = request.args.get('folder', 'processed')
+    
+    # 虚拟文档在下载时才一次性生成
+    try:
+        if VirtualDocumentService.materialize(file_id):
+            folder = 'temp'
+    except Exception as e:
+        return jsonify({'error': f'生成文档失败: {str(e)}'}), 500
+    
     filepath = get_file_path(file_id, folder)
     
     if not filepath or not os.path.exists(filepath):
@@ -470,7 +978,32 @@ def download_file(file_id):
 
 @app.route('/api/images/<filename>', methods=['GET'])
 def serve_image(filename):
-    """服务缩略图或处理后的图片"""
+    """服务缩略图或处理后的图片, 缺失的缩略图在首次请求时生成
+    
+    原图只在服务端已知的目录中查找: ?task= 指定的提取任务结果中的导出目录、
+    设置中的导出目录, 最后是处理目录; 不接受客户端直接传入的目录。
+    """
+    thumb_path = os.path.join(Config.PROCESSED_FOLDER, filename)
+    if filename.startswith('thumb_') and filename == os.path.basename(filename) \
+            and not os.path.exists(thumb_path):
+        source_dirs = []
+        task_id = request.args.get('task')
+        if task_id:
+            status = task_manager.get_task_status(task_id)
+            result = status.get('result') if status else None
+            if isinstance(result, dict) and result.get('export_path'):
+                source_dirs.append(result['export_path'])
+        if settings.get('export_path'):
+            source_dirs.append(settings.get('export_path'))
+        source_dirs.append(Config.PROCESSED_FOLDER)
+        
+        for source_dir in source_dirs:
+            source_path = os.path.join(source_dir, filename[len('thumb_'):])
+            if os.path.isfile(source_path):
+                with open(source_path, 'rb') as f:
+                    PDFService.make_thumbnail(f.read(), thumb_path)
+                break
+    
     return send_from_directory(Config.PROCESSED_FOLDER, filename)
 
 @app.route('/api/download-image', methods=['GET'])
@@ -489,6 +1022,54 @@ def download_image_by_path():
     except Exception as e:
         return jsonify({'error': f'下载失败: {str(e)}'}), 500
 
+@app.route('/api/task-archive/<task_id>', methods=['GET'])
+def download_task_archive(task_id):
+    """以ZIP流下载任务的全部输出(图片、缩略图、转换结果)
+    
+    条目不压缩, 边读文件边输出; 支持Range请求断点续传。
+    ?thumbnails=0 不包含缩略图。
+    """
+    status = task_manager.get_task_status(task_id)
+    if not status:
+        return jsonify({'error': '任务不存在'}), 404
+    if status['status'] != 'COMPLETED':
+        return jsonify({'error': '任务尚未完成'}), 409
+    
+    include_thumbnails = request.args.get('thumbnails', '1') != '0'
+    files = collect_result_files(task_id, status['result'], include_thumbnails)
+    if not files:
+        return jsonify({'error': '任务没有可下载的文件'}), 404
+    
+    try:
+        archive = ZipStream(files)
+    except (OSError, ValueError) as e:
+        return jsonify({'error': f'打包失败: {str(e)}'}), 500
+    
+    start, end, status_code = 0, archive.size, 200
+    # If-Range不匹配时说明归档内容已变化, 返回完整内容
+    if request.range and (not request.if_range or request.if_range.etag == archive.etag):
+        byte_range = request.range.range_for_length(archive.size)
+        if byte_range is None:
+            response = app.response_class(status=416)
+            response.headers['Content-Range'] = f'bytes */{archive.size}'
+            return response
+        start, end = byte_range
+        status_code = 206
+    
+    response = Response(
+        stream_with_context(archive.iter_range(start, end)),
+        status=status_code,
+        mimetype='application/zip',
+        direct_passthrough=True
+    )
+    response.content_length = end - start
+    if status_code == 206:
+        response.headers['Content-Range'] = f'bytes {start}-{end - 1}/{archive.size}'
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.headers['Content-Disposition'] = f'attachment; filename="{task_id}.zip"'
+    response.set_etag(archive.etag)
+    return response
+
 # ==================== 系统管理 ====================
 
 @app.route('/api/cleanup', methods=['POST'])
@@ -511,6 +1092,13 @@ def scheduled_cleanup():
     # 清理旧任务记录
     deleted_tasks = task_manager.cleanup_old_tasks(max_age_hours=3)
     print(f"[定时任务] 清理了{deleted_tasks}条任务记录")
+    
+    # 清理中断后未续传的分块上传
+    expired_uploads = upload_sessions.cleanup_expired()
+    print(f"[定时任务] 清理了{expired_uploads}个过期上传会话")
+    
+    expired_vdocs = VirtualDocumentService.cleanup_expired()
+    print(f"[定时任务] 清理了{expired_vdocs}个过期虚拟文档")
 
 # 启动定时调度器
 scheduler = BackgroundScheduler()
@@ -520,7 +1108,9 @@ scheduler.add_job(
     minutes=Config.CLEANUP_INTERVAL_MINUTES,
     id='cleanup_files'
 )
-scheduler.start()
+# 进程池工作进程(spawn)会以__mp_main__重新导入本模块, 不在其中启动调度器
+if __name__ != '__mp_main__':
+    scheduler.start()
 
 # ==================== 系统设置 ====================
 
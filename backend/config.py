@@ -13,14 +13,28 @@ class Config:
     UPLOAD_FOLDER = os.path.join(BASE_DIR, 'uploads')
     TEMP_FOLDER = os.path.join(UPLOAD_FOLDER, 'temp')
     PROCESSED_FOLDER = os.path.join(UPLOAD_FOLDER, 'processed')
+    UPLOAD_SESSION_FOLDER = os.path.join(UPLOAD_FOLDER, 'sessions')
     DATA_FOLDER = os.path.join(BASE_DIR, 'data')
     DB_PATH = os.path.join(DATA_FOLDER, 'tasks.db')
+    VIRTUAL_DOC_FOLDER = os.path.join(DATA_FOLDER, 'virtual')
     
     # 资源限制(极限优化)
     MAX_WORKERS = 1  # 单worker避免内存溢出
     MAX_CONTENT_LENGTH = 20 * 1024 * 1024  # 20MB文件限制
     MAX_PAGES_PER_TASK = 30  # 最大处理页数
     
+    # 分块上传(大文件, 支持断点续传)
+    UPLOAD_CHUNK_SIZE_MB = 5  # 单个分块上限(需小于MAX_CONTENT_LENGTH)
+    UPLOAD_SESSION_MAX_MB = 200  # 分块上传单文件上限
+    UPLOAD_SESSION_TOTAL_MAX_MB = 1024  # 所有未完成上传会话的总大小上限
+    UPLOAD_SESSION_MAX_AGE_MINUTES = 60  # 会话无新数据超过该时间后删除
+    
+    # 秒传: 按SHA-256复用已有文件前需证明持有文件内容
+    UPLOAD_CHALLENGE_RANGES = 4  # 随机抽查的字节区间数
+    UPLOAD_CHALLENGE_RANGE_SIZE = 4096  # 每个区间的字节数
+    UPLOAD_CHALLENGE_TTL = 120  # 挑战有效期(秒)
+    UPLOAD_CHALLENGE_MAX_PENDING = 1000  # 未使用的挑战数上限, 超出时丢弃最早的
+    
     # 功能开关
     ENABLE_OCR = False  # 禁用OCR节省内存
     ENABLE_LAYOUT_CONVERSION = False  # 禁用排版复刻
@@ -28,9 +42,71 @@ class Config:
     
     # 性能优化
     PREVIEW_DPI = 96  # 预览图质量(降低节省内存)
+    PREVIEW_FORMATS = {'png': 'image/png', 'jpeg': 'image/jpeg'}  # 预览图输出格式
+    PREVIEW_CACHE_MAX_MB = 16  # 预览图内存缓存上限
+    ANALYSIS_CACHE_MAX_MB = 8  # 页面分析结果内存缓存上限(与预览图分开)
+    PREVIEW_CACHE_MAX_AGE = 300  # 浏览器缓存时间(秒), 过期后使用ETag协商
+    DOC_POOL_MAX_MB = 64  # 文档句柄池内存预算(按文件大小估算)
+    TABLE_PRESCREEN = True  # 按框线预筛, 不可能含表格的页面跳过表格检测
+    PLUMBER_CONSTANT_MEMORY_MIN_PAGES = 50  # 达到该页数的文档用pdfplumber逐页读取并释放缓存, 0表示始终启用
+    TILE_SIZE = 256  # 瓦片边长(像素)
+    TILE_MAX_DPI = 600  # 瓦片金字塔最高一级的分辨率
+    TILE_DEFAULT_QUALITY = 80  # JPEG/WebP瓦片默认质量
+    TILE_FORMATS = {'jpeg': 'image/jpeg', 'webp': 'image/webp', 'png': 'image/png'}
+    SPRITE_THUMB_WIDTH = 120  # 雪碧图中每页缩略图宽度(像素)
+    SPRITE_COLUMNS = 10  # 雪碧图每行页数
+    SPRITE_MAX_PAGES = 500  # 超过该页数不生成雪碧图
+    PREWARM_ENABLED = True  # 上传后在后台预先渲染前几页预览和缩略图
+    PREWARM_PREVIEW_PAGES = 3  # 预热渲染的预览页数
+    PREWARM_PROBE_MAX_PAGES = 500  # 逐页探测文字层/图片数的最大页数
+    PREWARM_IDLE_POLL = 0.5  # 有用户任务时预热暂停, 每隔该秒数检查一次
     IMAGE_EXTRACT_QUALITY = 75  # 图片导出质量
+    IMAGE_MIN_DIMENSION = 32  # 宽或高小于该像素数的图片不提取(图标、线条等)
+    IMAGE_MIN_BYTES = 1024  # 小于该字节数的图片不提取
+    IMAGE_WRITE_WORKERS = 2  # 图片写入和缩略图生成线程数
     TASK_TIMEOUT = 120  # 任务超时时间(秒)
     
+    # 任务执行后端
+    TASK_BACKEND = os.environ.get('PDF_TASK_BACKEND', 'thread')  # thread 或 process
+    WORKER_MEMORY_LIMIT_MB = 1024  # 工作进程地址空间上限(RLIMIT_AS), 0表示不限制
+    WORKER_MAX_TASKS = 20  # 每个工作进程处理多少个任务后回收(需Python 3.11+), 0表示不回收
+    
+    # 页面分片并行提取(默认关闭: 每个分片进程都要重新加载fitz/pdfplumber, 小内存环境得不偿失)
+    SHARD_WORKERS = int(os.environ.get('PDF_SHARD_WORKERS', 1))  # 1表示不分片, 多核大内存时可调大用于长文档流式提取
+    SHARD_MIN_PAGES = 20  # 少于该页数时单进程处理(进程启动开销大于收益)
+    SHARD_PER_WORKER = 3  # 每个进程分到的分片数, 越多进度越平滑
+    
+    # OCR
+    OCR_ENGINES = int(os.environ.get('PDF_OCR_ENGINES', 1))  # 进程内OCR引擎数, 每个引擎占用一份模型内存
+    OCR_THREADS = int(os.environ.get('PDF_OCR_THREADS', 2))  # 每个引擎的推理线程数
+    OCR_DPI = 200  # OCR渲染分辨率
+    OCR_BATCH_SIZE = 4  # 每批渲染并识别的页数(同时驻留内存的页面图像数)
+    OCR_CACHE_MAX_MB = 32  # 按页面图像哈希缓存的识别结果上限
+    
+    # 任务队列
+    TASK_QUEUE_MAX_DEPTH = 10  # 最大排队任务数, 超出后返回503
+    TASK_DEFAULT_DURATION = 10  # 无历史数据时的任务耗时估计(秒)
+    TASK_DEFAULT_PRIORITY = 5
+    TASK_PROGRESS_MIN_INTERVAL = 0.25  # 进度写库最小间隔(秒)
+    TASK_PROGRESS_MIN_STEP = 5  # 进度增幅达到该值时立即写库
+    TASK_EVENT_RETENTION = 600  # 已结束任务的状态快照在内存中保留时间(秒)
+    TASK_EVENT_HEARTBEAT = 15  # SSE心跳间隔(秒)
+    TASK_LONG_POLL_MAX_WAIT = 60  # 长轮询最长等待时间(秒)
+    RESULT_CACHE_MAX_MB = 128  # 任务结果磁盘缓存上限, 超出后按LRU淘汰
+    TASK_PRIORITIES = {  # 数值越小越优先, 轻量操作优先于OCR/转Word
+        'rotate_pages_task': 1,
+        'delete_pages_task': 1,
+        'encrypt_pdf_task': 1,
+        'decrypt_pdf_task': 1,
+        'merge_pdfs_task': 3,
+        'extract_text_task': 3,
+        'extract_images_task': 5,
+        'extract_text_clean_task': 5,
+        'extract_tables_task': 5,
+        'extract_text_enhanced_task': 8,
+        'convert_to_word_task': 8
+    }
+    
     # 文件清理
     CLEANUP_INTERVAL_MINUTES = 30  # 清理间隔
     FILE_MAX_AGE_MINUTES = 30  # 文件过期时间(30分钟)
@@ -45,5 +121,6 @@ class Config:
     def init_app():
         """初始化应用目录"""
         for folder in [Config.UPLOAD_FOLDER, Config.TEMP_FOLDER, 
-                      Config.PROCESSED_FOLDER, Config.DATA_FOLDER]:
+                      Config.PROCESSED_FOLDER, Config.UPLOAD_SESSION_FOLDER,
+                      Config.DATA_FOLDER, Config.VIRTUAL_DOC_FOLDER]:
             os.makedirs(folder, exist_ok=True)
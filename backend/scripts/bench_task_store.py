@@ -0,0 +1,138 @@
+"""任务状态存储基准测试
+
+对比旧实现(每次操作新建连接并提交)与TaskManager当前实现的
+进度写入和状态查询吞吐量。使用临时数据库, 不影响data/tasks.db。
+
+用法: python scripts/bench_task_store.py [--tasks 20] [--pages 300] [--readers 8]
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+
+# 必须在导入task_manager之前替换数据库路径(模块导入时会创建全局实例)
+_tmp_dir = tempfile.mkdtemp(prefix='task_store_bench_')
+Config.DB_PATH = os.path.join(_tmp_dir, 'global.db')
+
+from task_manager import TaskManager
+
+
+class LegacyStore:
+    """旧实现: 全局锁 + 每次操作新建连接并提交"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        with sqlite3.connect(db_path) as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS tasks (
+                    task_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    progress INTEGER DEFAULT 0,
+                    result TEXT,
+                    error TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+
+    def _create_task(self, task_id):
+        with self.lock:
+            with sqlite3.connect(self.db_path) as conn:
+                conn.execute(
+                    'INSERT INTO tasks (task_id, status, progress) VALUES (?, ?, ?)',
+                    (task_id, 'PROCESSING', 0)
+                )
+                conn.commit()
+
+    def _update_task(self, task_id, status, progress, result=None, error=None):
+        pass
+
+    def update_progress(self, task_id, progress):
+        with self.lock:
+            with sqlite3.connect(self.db_path) as conn:
+                conn.execute(
+                    'UPDATE tasks SET progress=?, updated_at=CURRENT_TIMESTAMP WHERE task_id=?',
+                    (progress, task_id)
+                )
+                conn.commit()
+
+    def get_task_status(self, task_id):
+        with sqlite3.connect(self.db_path) as conn:
+            row = conn.execute(
+                'SELECT task_id, status, progress, result, error FROM tasks WHERE task_id=?',
+                (task_id,)
+            ).fetchone()
+            return row
+
+
+def bench_store(name, store, tasks, pages, readers, read_seconds):
+    task_ids = [f"{name}-{i}" for i in range(tasks)]
+    for task_id in task_ids:
+        store._create_task(task_id)
+        store._update_task(task_id, 'PROCESSING', 0)
+
+    # 进度写入: 模拟逐页回调
+    start = time.perf_counter()
+    for task_id in task_ids:
+        for page in range(pages):
+            store.update_progress(task_id, int((page + 1) / pages * 100))
+    write_elapsed = time.perf_counter() - start
+    callbacks = tasks * pages
+
+    # 状态查询: 多线程轮询, 同时有一个线程持续写进度
+    stop = threading.Event()
+    counts = [0] * readers
+
+    def reader(idx):
+        n = 0
+        while not stop.is_set():
+            store.get_task_status(task_ids[n % tasks])
+            n += 1
+        counts[idx] = n
+
+    def writer():
+        n = 0
+        while not stop.is_set():
+            store.update_progress(task_ids[n % tasks], n % 100)
+            n += 1
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    threads.append(threading.Thread(target=writer))
+    for t in threads:
+        t.start()
+    time.sleep(read_seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+
+    print(f"[{name}]")
+    print(f"  进度回调: {callbacks}次, 耗时{write_elapsed:.3f}s, "
+          f"{callbacks / write_elapsed:,.0f}次/秒")
+    print(f"  状态查询: {readers}个线程, {sum(counts) / read_seconds:,.0f}次/秒")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='任务状态存储基准测试')
+    parser.add_argument('--tasks', type=int, default=20)
+    parser.add_argument('--pages', type=int, default=300)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=3)
+    args = parser.parse_args()
+
+    legacy = LegacyStore(os.path.join(_tmp_dir, 'legacy.db'))
+    bench_store('legacy', legacy, args.tasks, args.pages, args.readers, args.seconds)
+
+    current = TaskManager(db_path=os.path.join(_tmp_dir, 'current.db'))
+    bench_store('current', current, args.tasks, args.pages, args.readers, args.seconds)
+
+
+if __name__ == '__main__':
+    main()
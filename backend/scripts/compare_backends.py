@@ -0,0 +1,131 @@
+"""增强提取引擎对比
+
+对语料中的每个PDF分别用pdfplumber和PyMuPDF(mupdf)生成页面分析结果,
+报告两者的耗时以及输出一致程度:
+    文字相似度  两者文字(合并空白后)的difflib相似度
+    单词F1      按单词多重集合计算的F1
+    表格数一致  两者检测到的表格数相同的页面比例
+    单元格F1    表格单元格文字多重集合的F1
+不经过文档池和缓存, 每页都重新解析。
+
+用法: python scripts/compare_backends.py <PDF文件或目录> [--pages 30] [--no-tables]
+"""
+import argparse
+import difflib
+import os
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fitz  # PyMuPDF
+import pdfplumber
+from services.page_analysis import PageAnalysis
+
+
+def _collect(path):
+    if os.path.isfile(path):
+        return [path]
+    files = []
+    for root, _, names in os.walk(path):
+        files.extend(os.path.join(root, name) for name in names if name.lower().endswith('.pdf'))
+    return sorted(files)
+
+
+def _f1(a, b):
+    a, b = Counter(a), Counter(b)
+    if not a and not b:
+        return 1.0
+    overlap = sum((a & b).values())
+    if not overlap:
+        return 0.0
+    precision = overlap / sum(b.values())
+    recall = overlap / sum(a.values())
+    return 2 * precision * recall / (precision + recall)
+
+
+def _cells(tables):
+    return [str(cell).strip() for table in tables or [] for row in table for cell in row if cell and str(cell).strip()]
+
+
+def compare_file(path, max_pages, with_tables):
+    """返回该文件的统计: 各引擎耗时和逐页一致程度"""
+    stats = {'pages': 0, 'pdfplumber': 0.0, 'mupdf': 0.0,
+             'text_ratio': 0.0, 'word_f1': 0.0, 'table_count_match': 0, 'cell_f1': 0.0}
+
+    with pdfplumber.open(path) as pdf, fitz.open(path) as doc:
+        for page_num in range(min(len(doc), max_pages)):
+            start = time.perf_counter()
+            page = pdf.pages[page_num]
+            plumber = PageAnalysis.analyze(page, with_tables, 'pdfplumber')
+            PageAnalysis.release_page(page)
+            stats['pdfplumber'] += time.perf_counter() - start
+
+            start = time.perf_counter()
+            mupdf = PageAnalysis.analyze(doc[page_num], with_tables, 'mupdf')
+            stats['mupdf'] += time.perf_counter() - start
+
+            stats['pages'] += 1
+            stats['text_ratio'] += difflib.SequenceMatcher(
+                None, ' '.join(plumber['text'].split()), ' '.join(mupdf['text'].split())
+            ).ratio()
+            stats['word_f1'] += _f1([w[4] for w in plumber['words']], [w[4] for w in mupdf['words']])
+            if with_tables:
+                stats['table_count_match'] += len(plumber['tables']) == len(mupdf['tables'])
+                stats['cell_f1'] += _f1(_cells(plumber['tables']), _cells(mupdf['tables']))
+
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='对比pdfplumber与PyMuPDF提取引擎')
+    parser.add_argument('corpus', help='PDF文件或包含PDF的目录')
+    parser.add_argument('--pages', type=int, default=30, help='每个文件最多对比的页数')
+    parser.add_argument('--no-tables', action='store_true', help='不对比表格检测')
+    args = parser.parse_args()
+
+    files = _collect(args.corpus)
+    if not files:
+        print('未找到PDF文件')
+        return 1
+
+    with_tables = not args.no_tables
+    header = f"{'文件':<40}{'页数':>6}{'plumber(s)':>12}{'mupdf(s)':>10}{'加速':>8}{'文字':>8}{'单词F1':>8}"
+    if with_tables:
+        header += f"{'表格数':>8}{'单元格F1':>10}"
+    print(header)
+
+    totals = Counter()
+    for path in files:
+        try:
+            stats = compare_file(path, args.pages, with_tables)
+        except Exception as e:
+            print(f"{os.path.basename(path)[:38]:<40}失败: {e}")
+            continue
+        if not stats['pages']:
+            continue
+        totals.update(stats)
+
+        pages = stats['pages']
+        line = (f"{os.path.basename(path)[:38]:<40}{pages:>6}{stats['pdfplumber']:>12.2f}{stats['mupdf']:>10.2f}"
+                f"{stats['pdfplumber'] / max(stats['mupdf'], 1e-6):>7.1f}x"
+                f"{stats['text_ratio'] / pages:>8.3f}{stats['word_f1'] / pages:>8.3f}")
+        if with_tables:
+            line += f"{stats['table_count_match'] / pages:>8.0%}{stats['cell_f1'] / pages:>10.3f}"
+        print(line)
+
+    pages = totals['pages']
+    if not pages:
+        return 1
+    print('-' * len(header))
+    print(f"共{pages}页: pdfplumber {totals['pdfplumber']:.2f}s, mupdf {totals['mupdf']:.2f}s, "
+          f"加速{totals['pdfplumber'] / max(totals['mupdf'], 1e-6):.1f}x")
+    print(f"平均文字相似度 {totals['text_ratio'] / pages:.3f}, 单词F1 {totals['word_f1'] / pages:.3f}")
+    if with_tables:
+        print(f"表格数一致 {totals['table_count_match'] / pages:.0%}, 单元格F1 {totals['cell_f1'] / pages:.3f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
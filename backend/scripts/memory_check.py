@@ -0,0 +1,147 @@
+"""pdfplumber恒定内存模式内存测试
+
+生成一个合成的多页PDF(默认1000页, 每页若干段文字, 每5页一个带框线的表格),
+分别以三种方式逐页做页面分析, 每隔一段页数记录进程RSS:
+    default   对照组: pdf.pages[i]直接分析, 不释放
+    release   与线上相同的PageAnalysis.open_document + PageAnalysis.get(含缓存写入),
+              不启用恒定内存模式, 每页处理后page.close()
+    constant  同上, 将PLUMBER_CONSTANT_MEMORY_MIN_PAGES设为0强制启用恒定内存模式
+每种模式在独立子进程中运行, 上传目录和预览缓存指向临时目录。
+恒定内存模式下, 预热页之后RSS增长超过--max-growth(MB)时以非0退出。
+
+用法: python scripts/memory_check.py [--pages 1000] [--tables] [--max-growth 40]
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MODES = ('default', 'release', 'constant')
+WARMUP_PAGES = 100
+SAMPLE_EVERY = 100
+
+
+def build_pdf(path, page_count):
+    """生成合成PDF"""
+    import fitz  # PyMuPDF
+
+    doc = fitz.open()
+    for i in range(page_count):
+        page = doc.new_page()
+        y = 72
+        for para in range(6):
+            text = f"Page {i + 1} paragraph {para + 1}: " + "lorem ipsum dolor sit amet " * 8
+            rect = fitz.Rect(72, y, page.rect.width - 72, y + 60)
+            page.insert_textbox(rect, text, fontsize=10, fontname='helv' if para % 2 else 'tiro')
+            y += 70
+
+        if i % 5 == 0:
+            # 3x4的框线表格
+            top, row_h, col_w = y + 10, 20, 110
+            for r in range(4):
+                page.draw_line((72, top + r * row_h), (72 + 4 * col_w, top + r * row_h))
+            for c in range(5):
+                page.draw_line((72 + c * col_w, top), (72 + c * col_w, top + 3 * row_h))
+            for r in range(3):
+                for c in range(4):
+                    page.insert_text((76 + c * col_w, top + r * row_h + 14), f"r{r}c{c}", fontsize=9)
+    doc.save(path, garbage=3, deflate=True)
+    doc.close()
+
+
+def run_mode(path, mode, with_tables):
+    """在当前进程中逐页分析, 返回[(已处理页数, RSS MB)]"""
+    import psutil
+    from config import Config
+
+    # 须在导入服务(创建预览缓存等全局实例)之前设置
+    Config.TEMP_FOLDER = Config.PROCESSED_FOLDER = os.path.dirname(path)
+    Config.PLUMBER_CONSTANT_MEMORY_MIN_PAGES = 0 if mode == 'constant' else sys.maxsize
+    file_id = os.path.splitext(os.path.basename(path))[0]
+
+    from services.page_analysis import PageAnalysis
+    from utils.plumber_pages import ConstantMemoryPDF
+
+    process = psutil.Process()
+    samples = []
+
+    def sample(done, total):
+        if done % SAMPLE_EVERY == 0 or done == total:
+            samples.append((done, process.memory_info().rss / 1024 / 1024))
+
+    if mode == 'default':
+        import pdfplumber
+        with pdfplumber.open(path) as pdf:
+            total = len(pdf.pages)
+            for i in range(total):
+                PageAnalysis.analyze(pdf.pages[i], with_tables, 'pdfplumber')
+                sample(i + 1, total)
+        return samples
+
+    with PageAnalysis.open_document(file_id, 'pdfplumber') as doc:
+        if isinstance(doc, ConstantMemoryPDF) != (mode == 'constant'):
+            raise RuntimeError(f"{mode}模式借出的文档类型不符: {type(doc).__name__}")
+        total = PageAnalysis.page_count(doc, 'pdfplumber')
+        for i in range(total):
+            PageAnalysis.get(file_id, doc, i, with_tables=with_tables, backend='pdfplumber')
+            sample(i + 1, total)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description='pdfplumber恒定内存模式内存测试')
+    parser.add_argument('--pages', type=int, default=1000, help='合成PDF的页数')
+    parser.add_argument('--tables', action='store_true', help='同时做表格检测(耗时明显增加)')
+    parser.add_argument('--max-growth', type=float, default=40, help='恒定内存模式允许的RSS增长(MB)')
+    parser.add_argument('--mode', choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument('--pdf', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        # 子进程: 输出采样结果
+        for pages, rss in run_mode(args.pdf, args.mode, args.tables):
+            print(f"{pages} {rss:.1f}")
+        return 0
+
+    tmp_dir = tempfile.mkdtemp(prefix='memory_check_')
+    # 按上传文件的命名方式(file_id.pdf)存放, 子进程经文档池打开
+    path = os.path.join(tmp_dir, f"{uuid.uuid4()}.pdf")
+    print(f"生成{args.pages}页合成PDF...")
+    build_pdf(path, args.pages)
+    print(f"文件大小: {os.path.getsize(path) / 1024 / 1024:.1f}MB\n")
+
+    results = {}
+    for mode in MODES:
+        cmd = [sys.executable, os.path.abspath(__file__), '--mode', mode, '--pdf', path]
+        if args.tables:
+            cmd.append('--tables')
+        output = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+        results[mode] = [tuple(float(v) for v in line.split()) for line in output.splitlines()]
+
+    print(f"{'已处理页数':>10}" + ''.join(f"{mode + ' RSS(MB)':>18}" for mode in MODES))
+    for rows in zip(*(results[mode] for mode in MODES)):
+        print(f"{int(rows[0][0]):>10}" + ''.join(f"{rss:>18.1f}" for _, rss in rows))
+
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def growth(samples):
+        after_warmup = [rss for pages, rss in samples if pages >= WARMUP_PAGES]
+        return after_warmup[-1] - after_warmup[0] if after_warmup else 0.0
+
+    print(f"\n预热{WARMUP_PAGES}页后RSS增长: " +
+          ', '.join(f"{mode} {growth(results[mode]):.1f}MB" for mode in MODES))
+    constant_growth = growth(results['constant'])
+    if constant_growth > args.max_growth:
+        print(f"失败: 恒定内存模式增长超过{args.max_growth}MB")
+        return 1
+    print("通过")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
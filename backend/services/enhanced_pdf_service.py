@@ -1,19 +1,24 @@
 """增强的PDF内容提取服务 - 保留排版和表格"""
-import fitz
-import pdfplumber
 import os
+from functools import partial
 from config import Config
 from utils.file_handler import get_file_path
+from services.page_sharding import PageShardExecutor
+from services.ocr_service import ocr_service
+from services.page_analysis import PageAnalysis
+from services.layout_engine import LayoutEngine
 from utils.settings_manager import settings
 
 class EnhancedPDFService:
     """增强版PDF提取服务,支持排版保留和表格识别"""
     
     @staticmethod
-    def extract_structured_content(file_id, pages=None):
+    def extract_structured_content(file_id, pages=None, backend=None, force_table_detection=False):
         """
         提取结构化内容(保留排版、表格、图片位置)
         返回HTML格式的内容
+        backend为提取引擎(pdfplumber/mupdf), 默认使用系统设置
+        force_table_detection为True时不做表格预筛, 每页都完整检测表格
         """
         # 检查功能开关
         if not settings.get('enable_layout_preservation'):
@@ -24,21 +29,13 @@ class EnhancedPDFService:
         if not os.path.exists(filepath):
             raise FileNotFoundError("PDF文件不存在")
         
+        backend = PageAnalysis.resolve_backend(backend)
         try:
             html_output = []
             html_output.append('<div class="pdf-content">')
             
-            # 初始化OCR (如果开启)
-            ocr_engine = None
-            if settings.get('enable_ocr'):
-                try:
-                    from rapidocr_onnxruntime import RapidOCR
-                    ocr_engine = RapidOCR()
-                except ImportError:
-                    print("Warning: rapidocr_onnxruntime not installed")
-            
-            with pdfplumber.open(filepath) as pdf:
-                total_pages = len(pdf.pages)
+            with PageAnalysis.open_document(file_id, backend) as doc:
+                total_pages = PageAnalysis.page_count(doc, backend)
                 
                 # 如果未指定页码,提取所有页
                 if not pages:
@@ -48,76 +45,78 @@ class EnhancedPDFService:
                 if len(pages) > Config.MAX_PAGES_PER_TASK:
                     pages = pages[:Config.MAX_PAGES_PER_TASK]
                 
+                # 先取得各页分析结果, 没有文字层的页面汇总后统一OCR
+                page_contents = []
+                table_skipped_pages = []
                 for page_num in pages:
                     if 0 <= page_num < total_pages:
-                        page = pdf.pages[page_num]
-                        
-                        # 添加分页符(仅CSS样式,不显示文字)
-                        if page_num > 0:
-                            html_output.append('<div class="page-break"></div>')
-                        
-                        html_output.append(f'<div class="page" data-page="{page_num + 1}">')
-                        
-                        # 提取表格
-                        tables = page.extract_tables()
-                        if tables:
-                            for table in tables:
-                                html_output.append('<table class="pdf-table">')
-                                for row_idx, row in enumerate(table):
-                                    if row_idx == 0:
-                                        html_output.append('<thead><tr>')
-                                        for cell in row:
-                                            cell_text = str(cell).strip() if cell else ''
-                                            html_output.append(f'<th>{cell_text}</th>')
-                                        html_output.append('</tr></thead><tbody>')
-                                    else:
-                                        html_output.append('<tr>')
-                                        for cell in row:
-                                            cell_text = str(cell).strip() if cell else ''
-                                            html_output.append(f'<td>{cell_text}</td>')
-                                        html_output.append('</tr>')
-                                html_output.append('</tbody></table>')
-                        
-                        # 提取文字(使用layout模式保留排版)
-                        text = page.extract_text(layout=True)
-                        
-                        # 如果没有提取到文字且开启了OCR，尝试OCR
-                        if (not text or not text.strip()) and ocr_engine:
-                            # 将页面转换为图片
-                            # 注意: pdfplumber的to_image需要pdf2image和poppler支持，或者使用fitz
-                            # 这里我们使用fitz来获取图片，因为fitz更轻量且已安装
-                            doc = fitz.open(filepath)
-                            pix = doc[page_num].get_pixmap(dpi=200)
-                            img_data = pix.tobytes("png")
-                            
-                            ocr_result, _ = ocr_engine(img_data)
-                            if ocr_result:
-                                # RapidOCR返回格式: [[[[x1,y1],[x2,y2],[x3,y3],[x4,y4]], "text", score], ...]
-                                # 简单拼接文字
-                                text = "\n".join([line[1] for line in ocr_result])
-                                html_output.append(f'<div class="ocr-badge">🔍 OCR识别内容</div>')
-                            doc.close()
+                        analysis = PageAnalysis.get(file_id, doc, page_num, with_tables=True, backend=backend,
+                                                    force_tables=force_table_detection)
+                        if analysis.get('tables_skipped'):
+                            table_skipped_pages.append(page_num + 1)
+                        page_contents.append((
+                            page_num,
+                            analysis['tables'],
+                            analysis['layout_text'],  # layout模式保留排版
+                            len(analysis['images'])
+                        ))
+            
+            ocr_texts = {}
+            if settings.get('enable_ocr'):
+                blank_pages = [page_num for page_num, _, text, _ in page_contents
+                               if not text or not text.strip()]
+                for page_num, lines in ocr_service.recognize_pages(file_id, blank_pages).items():
+                    ocr_texts[page_num] = ocr_service.lines_to_text(lines)
+            
+            for page_num, tables, text, image_count in page_contents:
+                # 添加分页符(仅CSS样式,不显示文字)
+                if page_num > 0:
+                    html_output.append('<div class="page-break"></div>')
+                
+                html_output.append(f'<div class="page" data-page="{page_num + 1}">')
+                
+                if tables:
+                    for table in tables:
+                        html_output.append('<table class="pdf-table">')
+                        for row_idx, row in enumerate(table):
+                            if row_idx == 0:
+                                html_output.append('<thead><tr>')
+                                for cell in row:
+                                    cell_text = str(cell).strip() if cell else ''
+                                    html_output.append(f'<th>{cell_text}</th>')
+                                html_output.append('</tr></thead><tbody>')
+                            else:
+                                html_output.append('<tr>')
+                                for cell in row:
+                                    cell_text = str(cell).strip() if cell else ''
+                                    html_output.append(f'<td>{cell_text}</td>')
+                                html_output.append('</tr>')
+                        html_output.append('</tbody></table>')
+                
+                # 没有文字层的页面使用OCR结果
+                if ocr_texts.get(page_num):
+                    text = ocr_texts[page_num]
+                    html_output.append(f'<div class="ocr-badge">🔍 OCR识别内容</div>')
 
-                        if text:
-                            # 分段处理,保留段落结构
-                            paragraphs = text.split('\n\n')
-                            for para in paragraphs:
-                                if para.strip():
-                                    # 清理但保留必要的换行
-                                    # 保留原始空格以维持排版(不要strip)
-                                    lines = para.split('\n')
-                                    # 仅去除空行,但不去除行首尾空格
-                                    cleaned_lines = [line for line in lines if line.strip()]
-                                    if cleaned_lines:
-                                        para_text = '<br>'.join(cleaned_lines)
-                                        html_output.append(f'<p>{para_text}</p>')
-                        
-                        # 标记图片位置(使用小图标)
-                        images = page.images
-                        if images:
-                            html_output.append(f'<div class="image-marker">🖼️ 包含{len(images)}张图片</div>')
-                        
-                        html_output.append('</div>')
+                if text:
+                    # 分段处理,保留段落结构
+                    paragraphs = text.split('\n\n')
+                    for para in paragraphs:
+                        if para.strip():
+                            # 清理但保留必要的换行
+                            # 保留原始空格以维持排版(不要strip)
+                            lines = para.split('\n')
+                            # 仅去除空行,但不去除行首尾空格
+                            cleaned_lines = [line for line in lines if line.strip()]
+                            if cleaned_lines:
+                                para_text = '<br>'.join(cleaned_lines)
+                                html_output.append(f'<p>{para_text}</p>')
+                
+                # 标记图片位置(使用小图标)
+                if image_count:
+                    html_output.append(f'<div class="image-marker">🖼️ 包含{image_count}张图片</div>')
+                
+                html_output.append('</div>')
             
             html_output.append('</div>')
             
@@ -187,14 +186,15 @@ class EnhancedPDFService:
             
             return {
                 'html': css + ''.join(html_output),
-                'extracted_pages': len(pages)
+                'extracted_pages': len(pages),
+                'table_skipped_pages': table_skipped_pages
             }
             
         except Exception as e:
             raise Exception(f"结构化提取失败: {str(e)}")
     
     @staticmethod
-    def extract_text_clean(file_id, pages=None):
+    def extract_text_clean(file_id, pages=None, progress_callback=None, backend=None):
         """
         提取纯净文字(清理换行符和特殊字符)
         """
@@ -203,9 +203,10 @@ class EnhancedPDFService:
         if not os.path.exists(filepath):
             raise FileNotFoundError("PDF文件不存在")
         
+        backend = PageAnalysis.resolve_backend(backend)
         try:
-            with pdfplumber.open(filepath) as pdf:
-                total_pages = len(pdf.pages)
+            with PageAnalysis.open_document(file_id, backend) as doc:
+                total_pages = PageAnalysis.page_count(doc, backend)
                 
                 if not pages:
                     pages = list(range(total_pages))
@@ -214,41 +215,14 @@ class EnhancedPDFService:
                     pages = pages[:Config.MAX_PAGES_PER_TASK]
                 
                 extracted_text = {}
+                valid_pages = [p for p in pages if 0 <= p < total_pages]
                 
-                for page_num in pages:
-                    if 0 <= page_num < total_pages:
-                        page = pdf.pages[page_num]
-                        text = page.extract_text()
-                        
-                        if text:
-                            # 清理文本:合并断行,移除多余空格
-                            lines = text.split('\n')
-                            cleaned_lines = []
-                            
-                            for line in lines:
-                                line = line.strip()
-                                if line:
-                                    cleaned_lines.append(line)
-                            
-                            # 智能合并:如果行末没有标点,与下一行合并
-                            merged_text = []
-                            i = 0
-                            while i < len(cleaned_lines):
-                                current_line = cleaned_lines[i]
-                                
-                                # 如果当前行以标点结尾,或是最后一行,直接添加
-                                if i == len(cleaned_lines) - 1 or current_line.endswith(('。', '!', '?', ';', ':', '、', ',', '.', '！', '?', ';')):
-                                    merged_text.append(current_line)
-                                else:
-                                    # 否则与下一行合并
-                                    if i + 1 < len(cleaned_lines):
-                                        current_line += cleaned_lines[i + 1]
-                                        i += 1
-                                    merged_text.append(current_line)
-                                
-                                i += 1
-                            
-                            extracted_text[str(page_num + 1)] = '\n'.join(merged_text)
+                # 跨页段落合并到其起始页
+                for page_num, paragraphs in LayoutEngine.join_pages(PageShardExecutor.map_pages(
+                        partial(_shard_extract_text_clean, backend=backend), file_id, valid_pages,
+                        lambda p: EnhancedPDFService._clean_page(file_id, doc, p, backend), progress_callback)):
+                    if paragraphs:
+                        extracted_text[str(page_num + 1)] = '\n'.join(paragraphs)
                 
                 return {
                     'total_pages': total_pages,
@@ -260,16 +234,22 @@ class EnhancedPDFService:
             raise Exception(f"文字提取失败: {str(e)}")
     
     @staticmethod
-    def extract_tables_only(file_id, pages=None):
-        """仅提取表格数据"""
+    def extract_tables_only(file_id, pages=None, progress_callback=None, backend=None,
+                            force_table_detection=False):
+        """仅提取表格数据
+        
+        预筛判定不可能含表格的页面不做检测, 页码记录在table_skipped_pages中;
+        force_table_detection为True时每页都完整检测。
+        """
         filepath = get_file_path(file_id)
         
         if not os.path.exists(filepath):
             raise FileNotFoundError("PDF文件不存在")
         
+        backend = PageAnalysis.resolve_backend(backend)
         try:
-            with pdfplumber.open(filepath) as pdf:
-                total_pages = len(pdf.pages)
+            with PageAnalysis.open_document(file_id, backend) as doc:
+                total_pages = PageAnalysis.page_count(doc, backend)
                 
                 if not pages:
                     pages = list(range(total_pages))
@@ -279,35 +259,129 @@ class EnhancedPDFService:
                 
                 all_tables = {}
                 total_table_count = 0
+                table_skipped_pages = []
+                valid_pages = [p for p in pages if 0 <= p < total_pages]
                 
-                for page_num in pages:
-                    if 0 <= page_num < total_pages:
-                        page = pdf.pages[page_num]
-                        tables = page.extract_tables()
-                        
-                        if tables:
-                            page_tables = []
-                            for table in tables:
-                                # 直接保留原始表格结构(二维数组)，不强制转换字典
-                                # 过滤掉全空的行
-                                cleaned_table = [row for row in table if any(cell and str(cell).strip() for cell in row)]
-                                if cleaned_table:
-                                    page_tables.append({
-                                        'data': cleaned_table,
-                                        'row_count': len(cleaned_table),
-                                        'col_count': len(cleaned_table[0]) if cleaned_table else 0
-                                    })
-                            
-                            if page_tables:
-                                all_tables[str(page_num + 1)] = page_tables
-                                total_table_count += len(page_tables)
+                for page_num, (page_tables, skipped) in PageShardExecutor.map_pages(
+                        partial(_shard_extract_tables, backend=backend, force_tables=force_table_detection),
+                        file_id, valid_pages,
+                        lambda p: EnhancedPDFService._table_page(file_id, doc, p, backend, force_table_detection),
+                        progress_callback):
+                    if skipped:
+                        table_skipped_pages.append(page_num + 1)
+                    if page_tables:
+                        all_tables[str(page_num + 1)] = page_tables
+                        total_table_count += len(page_tables)
                 
                 return {
                     'total_pages': total_pages,
                     'extracted_pages': len([p for p in all_tables if all_tables[p]]),
                     'total_tables': total_table_count,
-                    'tables': all_tables
+                    'tables': all_tables,
+                    'table_skipped_pages': table_skipped_pages
                 }
             
         except Exception as e:
             raise Exception(f"表格提取失败: {str(e)}")
+    
+    @staticmethod
+    def _clean_page(file_id, doc, page_num, backend):
+        """由页面分析结果的单词框重建本页段落列表"""
+        analysis = PageAnalysis.get(file_id, doc, page_num, backend=backend)
+        return LayoutEngine.page_paragraphs(analysis['words'])
+    
+    @staticmethod
+    def _page_tables(tables):
+        """整理单页表格, 过滤掉全空的行"""
+        page_tables = []
+        for table in tables or []:
+            # 直接保留原始表格结构(二维数组)，不强制转换字典
+            cleaned_table = [row for row in table if any(cell and str(cell).strip() for cell in row)]
+            if cleaned_table:
+                page_tables.append({
+                    'data': cleaned_table,
+                    'row_count': len(cleaned_table),
+                    'col_count': len(cleaned_table[0]) if cleaned_table else 0
+                })
+        return page_tables
+    
+    @staticmethod
+    def _table_page(file_id, doc, page_num, backend, force_tables=False):
+        """由页面分析结果生成单页表格, 返回(表格列表, 是否被预筛跳过)"""
+        analysis = PageAnalysis.get(file_id, doc, page_num, with_tables=True, backend=backend,
+                                    force_tables=force_tables)
+        return EnhancedPDFService._page_tables(analysis['tables']), analysis.get('tables_skipped', False)
+    
+    @staticmethod
+    def iter_text_clean(file_id, pages=None, progress_callback=None, backend=None):
+        """逐页生成清理后的文字(流式模式, 不限制页数)"""
+        filepath = get_file_path(file_id)
+        
+        if not os.path.exists(filepath):
+            raise FileNotFoundError("PDF文件不存在")
+        
+        backend = PageAnalysis.resolve_backend(backend)
+        with PageAnalysis.open_document(file_id, backend) as doc:
+            total_pages = PageAnalysis.page_count(doc, backend)
+            pages = pages or list(range(total_pages))
+            valid_pages = [p for p in pages if 0 <= p < total_pages]
+            extracted = 0
+            
+            for page_num, paragraphs in LayoutEngine.join_pages(PageShardExecutor.map_pages(
+                    partial(_shard_extract_text_clean, backend=backend), file_id, valid_pages,
+                    lambda p: EnhancedPDFService._clean_page(file_id, doc, p, backend), progress_callback)):
+                if paragraphs:
+                    extracted += 1
+                    yield {'page': page_num + 1, 'text': '\n'.join(paragraphs)}
+            
+            yield {'done': True, 'total_pages': total_pages, 'extracted_pages': extracted}
+    
+    @staticmethod
+    def iter_tables(file_id, pages=None, progress_callback=None, backend=None, force_table_detection=False):
+        """逐页生成表格数据(流式模式, 不限制页数)"""
+        filepath = get_file_path(file_id)
+        
+        if not os.path.exists(filepath):
+            raise FileNotFoundError("PDF文件不存在")
+        
+        backend = PageAnalysis.resolve_backend(backend)
+        with PageAnalysis.open_document(file_id, backend) as doc:
+            total_pages = PageAnalysis.page_count(doc, backend)
+            pages = pages or list(range(total_pages))
+            valid_pages = [p for p in pages if 0 <= p < total_pages]
+            extracted = 0
+            total_table_count = 0
+            table_skipped_pages = []
+            
+            for page_num, (page_tables, skipped) in PageShardExecutor.map_pages(
+                    partial(_shard_extract_tables, backend=backend, force_tables=force_table_detection),
+                    file_id, valid_pages,
+                    lambda p: EnhancedPDFService._table_page(file_id, doc, p, backend, force_table_detection),
+                    progress_callback):
+                if skipped:
+                    table_skipped_pages.append(page_num + 1)
+                if page_tables:
+                    extracted += 1
+                    total_table_count += len(page_tables)
+                    yield {'page': page_num + 1, 'tables': page_tables}
+            
+            yield {
+                'done': True,
+                'total_pages': total_pages,
+                'extracted_pages': extracted,
+                'total_tables': total_table_count,
+                'table_skipped_pages': table_skipped_pages
+            }
+
+
+def _shard_extract_text_clean(file_id, pages, backend='pdfplumber'):
+    """分片工作进程: 提取并清理一组页面的文字"""
+    with PageAnalysis.open_document(file_id, backend) as doc:
+        return {page_num: EnhancedPDFService._clean_page(file_id, doc, page_num, backend) for page_num in pages}
+
+
+def _shard_extract_tables(file_id, pages, backend='pdfplumber', force_tables=False):
+    """分片工作进程: 提取一组页面的表格"""
+    with PageAnalysis.open_document(file_id, backend) as doc:
+        return {page_num: EnhancedPDFService._table_page(file_id, doc, page_num, backend, force_tables)
+                for page_num in pages}
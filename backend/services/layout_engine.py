@@ -0,0 +1,198 @@
+"""版面重建 - 由单词框做分栏、阅读顺序、行聚类和段落合并(NumPy整页向量化)"""
+import re
+import numpy as np
+
+# 句末标点: 段落以此结尾时不与下一页开头合并
+_SENTENCE_END = ('。', '！', '？', '!', '?', '.', '；', ';', '：', ':', '…', '”', '"', '）', ')')
+_CJK = re.compile(r'[\u2e80-\u9fff\uf900-\ufaff\uff00-\uffef]')
+
+
+def _is_cjk(char):
+    return bool(char) and bool(_CJK.match(char))
+
+
+def _join_text(left, right):
+    """拼接相邻的单词/行: 中文之间不加空格, 行末连字符与小写开头的下一行直接相连"""
+    if not left:
+        return right
+    if not right:
+        return left
+    if left.endswith('-') and right[0].islower():
+        return left[:-1] + right
+    if _is_cjk(left[-1]) or _is_cjk(right[0]):
+        return left + right
+    return f"{left} {right}"
+
+
+class LayoutEngine:
+    """基于单词框的版面重建
+
+    输入为页面分析结果中的单词列表[[x0, top, x1, bottom, 文字], ...],
+    整页转为数组后依次完成:
+        1. 行聚类     按单词中心高度排序, 相邻差值超过阈值处分行
+        2. 行片段     行内按x排序, 间距过大处断开(跨栏的同一行被分成两段)
+        3. 分栏       统计各x位置被行片段覆盖的次数, 覆盖极少的纵向空白带即栏间距;
+                      跨越栏间距的片段为通栏(标题等)
+        4. 阅读顺序   通栏片段把页面分成上下若干带, 带内逐栏从上到下
+        5. 段落合并   同一栏内, 行间距过大、首行缩进或上一行提前结束处分段
+    阈值均以页面单词高度的中位数为单位, 不依赖字号。
+    """
+
+    LINE_TOLERANCE = 0.5     # 单词中心高度差小于 行高×该系数 视为同一行
+    WORD_GAP = 2.0           # 行内间距超过 行高×该系数 时断开为两个片段
+    GUTTER_MIN = 1.0         # 栏间空白最小宽度(行高倍数)
+    GUTTER_COVERAGE = 0.1    # 覆盖次数不超过峰值×该系数的位置视为空白(允许少量通栏)
+    COLUMN_MIN_RATIO = 0.15  # 每栏宽度至少占正文宽度的比例
+    MAX_COLUMNS = 4
+    MIN_SEGMENTS = 4         # 片段少于该数时不分栏
+    PARA_GAP = 0.8           # 行间距超过 行高×该系数 时分段
+    INDENT = 1.0             # 行首缩进超过 行高×该系数 时分段
+    SHORT_LINE = 3.0         # 行末距栏右边界超过 行高×该系数 视为段落末行
+
+    @staticmethod
+    def page_paragraphs(words):
+        """由单词框重建一页的段落列表(按阅读顺序)"""
+        if not words:
+            return []
+
+        boxes = np.array([word[:4] for word in words], dtype=float)
+        texts = [word[4] for word in words]
+        x0, top, x1, bottom = boxes.T
+        height = max(float(np.median(bottom - top)), 1.0)
+
+        # 1. 行聚类
+        center = (top + bottom) / 2
+        order = np.argsort(center, kind='stable')
+        line_id = np.empty(len(words), dtype=int)
+        line_id[order] = np.concatenate(([0], np.cumsum(np.diff(center[order]) > height * LayoutEngine.LINE_TOLERANCE)))
+
+        # 2. 行片段
+        order = np.lexsort((x0, line_id))
+        gaps = x0[order][1:] - x1[order][:-1]
+        breaks = (np.diff(line_id[order]) != 0) | (gaps > height * LayoutEngine.WORD_GAP)
+        starts = np.flatnonzero(np.concatenate(([True], breaks)))
+        seg_x0 = np.minimum.reduceat(x0[order], starts)
+        seg_x1 = np.maximum.reduceat(x1[order], starts)
+        seg_top = np.minimum.reduceat(top[order], starts)
+        seg_bottom = np.maximum.reduceat(bottom[order], starts)
+        seg_line = line_id[order][starts]
+
+        ordered_texts = [texts[i] for i in order]
+        bounds = np.append(starts, len(order))
+        seg_texts = []
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            text = ''
+            for word in ordered_texts[start:end]:
+                text = _join_text(text, word)
+            seg_texts.append(text)
+
+        # 3. 分栏
+        gutters = LayoutEngine._find_gutters(seg_x0, seg_x1, height)
+        if len(gutters):
+            spanning = ((seg_x0[:, None] < gutters[None, :, 0]) & (seg_x1[:, None] > gutters[None, :, 1])).any(axis=1)
+            column = np.searchsorted(gutters.mean(axis=1), (seg_x0 + seg_x1) / 2)
+        else:
+            spanning = np.zeros(len(seg_x0), dtype=bool)
+            column = np.zeros(len(seg_x0), dtype=int)
+
+        # 4. 阅读顺序: 通栏片段开启新的一带, 且排在该带最前
+        band = np.searchsorted(np.sort(seg_top[spanning]), seg_top, side='right')
+        column = np.where(spanning, -1, column)
+        order = np.lexsort((seg_x0, seg_line, column, band))
+        group = (band * (LayoutEngine.MAX_COLUMNS + 1) + column + 1)[order]
+
+        # 5. 段落合并
+        x0s, x1s = seg_x0[order], seg_x1[order]
+        tops, bottoms, lines = seg_top[order], seg_bottom[order], seg_line[order]
+
+        group_starts = np.flatnonzero(np.concatenate(([True], np.diff(group) != 0)))
+        counts = np.diff(np.append(group_starts, len(group)))
+        col_left = np.repeat(np.minimum.reduceat(x0s, group_starts), counts)
+        col_right = np.repeat(np.maximum.reduceat(x1s, group_starts), counts)
+
+        same_group = group[1:] == group[:-1]
+        same_line = lines[1:] == lines[:-1]
+        para_break = (
+            (tops[1:] - bottoms[:-1] > height * LayoutEngine.PARA_GAP)
+            | (x0s[1:] > col_left[1:] + height * LayoutEngine.INDENT)
+            | (x1s[:-1] < col_right[:-1] - height * LayoutEngine.SHORT_LINE)
+        )
+        new_para = np.concatenate(([True], ~same_group | (~same_line & para_break)))
+
+        paragraphs = []
+        for index, seg in enumerate(order):
+            if new_para[index]:
+                paragraphs.append(seg_texts[seg])
+            else:
+                paragraphs[-1] = _join_text(paragraphs[-1], seg_texts[seg])
+        return [p for p in paragraphs if p.strip()]
+
+    @staticmethod
+    def _find_gutters(seg_x0, seg_x1, height):
+        """查找栏间距, 返回[[左边界, 右边界], ...](按x排序)"""
+        if len(seg_x0) < LayoutEngine.MIN_SEGMENTS:
+            return np.empty((0, 2))
+
+        left, right = np.floor(seg_x0.min()), np.ceil(seg_x1.max())
+        width = right - left
+        if width <= 0:
+            return np.empty((0, 2))
+
+        # 以1pt为单位统计覆盖次数(差分数组 + 累加)
+        size = int(width) + 1
+        coverage = np.zeros(size + 1)
+        np.add.at(coverage, (seg_x0 - left).astype(int), 1)
+        np.add.at(coverage, np.ceil(seg_x1 - left).astype(int), -1)
+        coverage = np.cumsum(coverage)[:size]
+
+        # 至少容许一个通栏片段跨过栏间距(行数较少的页面)
+        empty = coverage <= max(coverage.max() * LayoutEngine.GUTTER_COVERAGE, 1)
+        edges = np.diff(np.concatenate(([0], empty.astype(int), [0])))
+        run_starts, run_ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+        keep = ((run_ends - run_starts >= height * LayoutEngine.GUTTER_MIN)
+                & (run_starts > 0) & (run_ends < size))
+        gutters = np.stack((run_starts[keep] + left, run_ends[keep] + left), axis=1)
+        if not len(gutters):
+            return gutters
+
+        # 最宽的栏间距优先, 产生过窄的栏时舍弃
+        accepted = []
+        min_width = width * LayoutEngine.COLUMN_MIN_RATIO
+        for g_left, g_right in sorted(gutters.tolist(), key=lambda g: g[0] - g[1]):
+            if len(accepted) >= LayoutEngine.MAX_COLUMNS - 1:
+                break
+            candidate = sorted(accepted + [[g_left, g_right]])
+            bounds = [left] + [x for g in candidate for x in g] + [right]
+            if all(bounds[i + 1] - bounds[i] >= min_width for i in range(0, len(bounds), 2)):
+                accepted = candidate
+        return np.array(accepted).reshape(-1, 2)
+
+    @staticmethod
+    def _continues(previous, following):
+        """上一页末段是否在下一页开头继续"""
+        previous, following = previous.rstrip(), following.lstrip()
+        if len(previous) < 20 or not following or previous.endswith(_SENTENCE_END):
+            return False
+        first = following[0]
+        return first.islower() or _is_cjk(first)
+
+    @staticmethod
+    def join_pages(page_paragraphs):
+        """跨页合并段落
+
+        page_paragraphs为按阅读顺序的(页码, 段落列表), 相邻页之间上一页末段未结束
+        且下一页首段像是其延续时, 将首段并入上一页末段。需要看到下一页才能确定
+        上一页的结果, 因此逐页延后一页输出(页码, 段落列表)。
+        """
+        pending = None
+        for page_num, paragraphs in page_paragraphs:
+            paragraphs = list(paragraphs or [])
+            if pending is not None:
+                prev_num, prev_paragraphs = pending
+                if (page_num == prev_num + 1 and prev_paragraphs and paragraphs
+                        and LayoutEngine._continues(prev_paragraphs[-1], paragraphs[0])):
+                    prev_paragraphs[-1] = _join_text(prev_paragraphs[-1], paragraphs.pop(0))
+                yield pending
+            pending = (page_num, paragraphs)
+        if pending is not None:
+            yield pending
@@ -0,0 +1,130 @@
+"""PDF合并引擎 - 按页选择合并, 跨文件去重相同的流对象"""
+import os
+import hashlib
+from contextlib import ExitStack
+import pikepdf
+from utils.file_handler import get_file_path
+
+# 遍历资源时跳过的反向引用, 避免沿页面树走遍整个文档
+_SKIP_KEYS = {'/Parent', '/P', '/Annots', '/B', '/Dest', '/StructParents'}
+
+
+class MergeEngine:
+    """基于pikepdf(qpdf)的合并引擎
+
+    源文件以惰性方式打开, 复制页面时只复制对象结构, 流数据在保存时
+    才从源文件读取, 因此内存占用取决于单个对象的大小而不是所有源文件之和。
+    页面复制后遍历其/Resources和/Contents, 内容(原始字节+字典)相同的流
+    (字体文件、图片、ICC配置等)改为引用同一个对象, 重复的副本不再写出。
+    """
+
+    @staticmethod
+    def normalize_sources(sources):
+        """统一为[{'file_id': ..., 'pages': [0开始页码] 或 None}]
+
+        sources的元素可以是file_id字符串, 或{'file_id', 'pages'}(pages为1开始页码)。
+        """
+        normalized = []
+        for source in sources:
+            if isinstance(source, str):
+                source = {'file_id': source}
+            pages = source.get('pages')
+            normalized.append({
+                'file_id': source['file_id'],
+                'pages': [int(p) - 1 for p in pages] if pages else None
+            })
+        return normalized
+
+    @staticmethod
+    def merge(sources, output_path, progress_callback=None):
+        """合并并写出, 返回统计信息"""
+        sources = MergeEngine.normalize_sources(sources)
+        stats = {'merged_files': 0, 'total_pages': 0, 'deduplicated_streams': 0, 'deduplicated_bytes': 0}
+        index = {}  # 内容摘要 -> 输出文档中的流对象
+        # 已处理对象: 输出文档中的objgen -> 规范对象; 各页共用的字体/图片等资源只处理一次
+        visited = {}
+
+        with ExitStack() as stack:
+            output = stack.enter_context(pikepdf.new())
+
+            for i, source in enumerate(sources):
+                filepath = get_file_path(source['file_id'])
+                if not os.path.exists(filepath):
+                    raise FileNotFoundError(f"PDF文件不存在: {source['file_id']}")
+
+                # 源文件需保持打开直到保存完成(流数据在写出时读取)
+                src = stack.enter_context(pikepdf.open(filepath))
+                total = len(src.pages)
+                pages = source['pages'] if source['pages'] is not None else range(total)
+
+                for page_num in pages:
+                    if not 0 <= page_num < total:
+                        raise ValueError(f"页码超出范围(1-{total}): {page_num + 1}")
+                    output.pages.append(src.pages[page_num])
+                    page = output.pages[-1].obj
+                    MergeEngine._dedupe_children(page, index, visited, stats, keys=('/Resources', '/Contents'))
+                    stats['total_pages'] += 1
+
+                stats['merged_files'] += 1
+                if progress_callback:
+                    # 写出阶段占最后10%
+                    progress_callback(int((i + 1) / len(sources) * 90))
+
+            output.save(
+                output_path,
+                object_stream_mode=pikepdf.ObjectStreamMode.generate,
+                compress_streams=True
+            )
+
+        if progress_callback:
+            progress_callback(100)
+        return stats
+
+    @staticmethod
+    def _dedupe_children(obj, index, visited, stats, keys=None):
+        """对字典/数组的子对象去重, 重复的流替换为已有对象"""
+        if isinstance(obj, pikepdf.Array):
+            items = list(enumerate(obj))
+        else:
+            items = [(key, obj[key]) for key in (keys or list(obj.keys()))
+                     if key in obj and key not in _SKIP_KEYS]
+
+        for key, child in items:
+            canonical = MergeEngine._dedupe(child, index, visited, stats)
+            if canonical is not None and canonical.objgen != child.objgen:
+                obj[key] = canonical
+
+    @staticmethod
+    def _dedupe(obj, index, visited, stats):
+        """递归处理obj, 若obj是流则返回其规范对象(可能是自身), 否则返回None"""
+        if not isinstance(obj, (pikepdf.Dictionary, pikepdf.Array, pikepdf.Stream)):
+            return None
+
+        objgen = obj.objgen
+        if objgen != (0, 0):
+            if objgen in visited:
+                return visited[objgen]
+            # 先登记, 防止循环引用导致无限递归
+            visited[objgen] = obj if isinstance(obj, pikepdf.Stream) else None
+
+        MergeEngine._dedupe_children(obj, index, visited, stats)
+        if not isinstance(obj, pikepdf.Stream):
+            return None
+
+        raw = obj.read_raw_bytes()
+        digest = hashlib.sha256(raw)
+        # 字典中的子对象已规范化, 相同内容的流其字典序列化结果一致
+        for key in sorted(obj.keys()):
+            if key != '/Length':
+                value = obj[key]
+                digest.update(key.encode('latin-1'))
+                # 整数、布尔等标量会被pikepdf转换为Python对象
+                digest.update(value.unparse() if isinstance(value, pikepdf.Object) else repr(value).encode('latin-1'))
+        digest = digest.hexdigest()
+
+        canonical = index.setdefault(digest, obj)
+        if canonical.objgen != obj.objgen:
+            stats['deduplicated_streams'] += 1
+            stats['deduplicated_bytes'] += len(raw)
+        visited[objgen] = canonical
+        return canonical
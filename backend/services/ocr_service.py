@@ -0,0 +1,154 @@
+"""OCR服务 - 进程内共享的OCR引擎池, 按页面图像缓存识别结果"""
+import os
+import json
+import queue
+import hashlib
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+from utils.document_pool import document_pool
+from utils.result_cache import ResultCache
+
+
+class OCRService:
+    """OCR引擎池
+
+    引擎(加载ONNX模型)在首次识别时才创建, 之后在进程内复用, 最多创建
+    OCR_ENGINES个。识别按批进行: 每批在调用线程中连续渲染OCR_BATCH_SIZE页
+    (整个文档只借出一次), 再交给引擎并行识别, 同时驻留内存的页面图像不超过一批。
+    识别结果以页面图像的SHA-256为键写入磁盘缓存, 相同页面重复提取时不再识别。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._engines = queue.Queue()
+        self._created = 0
+        self._available = None
+        self._executor = None
+        self._version = None
+        self.cache = ResultCache(
+            cache_dir=os.path.join(Config.DATA_FOLDER, 'ocr_cache'),
+            max_bytes=Config.OCR_CACHE_MAX_MB * 1024 * 1024
+        )
+
+    def is_available(self):
+        """OCR依赖是否已安装"""
+        if self._available is None:
+            try:
+                from importlib.metadata import version
+                import rapidocr_onnxruntime  # noqa: F401
+                self._version = version('rapidocr_onnxruntime')
+                self._available = True
+            except ImportError:
+                print("Warning: rapidocr_onnxruntime not installed")
+                self._available = False
+        return self._available
+
+    def _create_engine(self):
+        from rapidocr_onnxruntime import RapidOCR
+        try:
+            return RapidOCR(intra_op_num_threads=Config.OCR_THREADS,
+                            inter_op_num_threads=1)
+        except TypeError:
+            # 旧版本不支持线程数参数
+            return RapidOCR()
+
+    @contextmanager
+    def _borrow_engine(self):
+        """借出一个引擎, 池中无空闲引擎且未达上限时创建新引擎"""
+        engine = None
+        with self.lock:
+            if self._engines.empty() and self._created < Config.OCR_ENGINES:
+                self._created += 1
+                create = True
+            else:
+                create = False
+
+        if create:
+            try:
+                engine = self._create_engine()
+            except Exception:
+                with self.lock:
+                    self._created -= 1
+                raise
+        else:
+            engine = self._engines.get()
+
+        try:
+            yield engine
+        finally:
+            self._engines.put(engine)
+
+    def _get_executor(self):
+        with self.lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=Config.OCR_ENGINES, thread_name_prefix='ocr'
+                )
+            return self._executor
+
+    def _recognize(self, img_bytes):
+        """识别一张页面图像, 返回[{'text', 'score', 'box'}]"""
+        with self._borrow_engine() as engine:
+            ocr_result, _ = engine(img_bytes)
+
+        # RapidOCR返回格式: [[[[x1,y1],[x2,y2],[x3,y3],[x4,y4]], "text", score], ...]
+        return [
+            {
+                'text': text,
+                'score': round(float(score), 4),
+                'box': [[round(float(x), 1), round(float(y), 1)] for x, y in box]
+            }
+            for box, text, score in ocr_result or []
+        ]
+
+    def _cache_key(self, img_bytes):
+        digest = hashlib.sha256(img_bytes)
+        digest.update(f"{self._version}:{Config.OCR_DPI}".encode('utf-8'))
+        return digest.hexdigest()
+
+    def recognize_pages(self, file_id, pages, progress_callback=None):
+        """识别若干页(0开始页码), 返回{页码: 识别出的行列表}"""
+        if not pages or not self.is_available():
+            return {}
+
+        results = {}
+        done = 0
+        executor = self._get_executor()
+        with document_pool.borrow(file_id) as doc:
+            for start in range(0, len(pages), Config.OCR_BATCH_SIZE):
+                batch = pages[start:start + Config.OCR_BATCH_SIZE]
+
+                futures = {}  # 缓存键 -> (识别任务, 页码列表), 同一批内相同页面只识别一次
+                for page_num in batch:
+                    img_bytes = doc[page_num].get_pixmap(dpi=Config.OCR_DPI).tobytes("png")
+                    key = self._cache_key(img_bytes)
+                    if key in futures:
+                        futures[key][1].append(page_num)
+                        continue
+                    cached = self.cache.get(key)
+                    if cached is not None:
+                        results[page_num] = json.loads(cached)
+                    else:
+                        futures[key] = (executor.submit(self._recognize, img_bytes), [page_num])
+
+                for key, (future, page_nums) in futures.items():
+                    lines = future.result()
+                    self.cache.put(key, json.dumps(lines, ensure_ascii=False))
+                    for page_num in page_nums:
+                        results[page_num] = lines
+
+                done += len(batch)
+                if progress_callback:
+                    progress_callback(int(done / len(pages) * 100))
+
+        return results
+
+    @staticmethod
+    def lines_to_text(lines):
+        """识别结果按行拼接为文字"""
+        return "\n".join(line['text'] for line in lines)
+
+# 全局实例
+ocr_service = OCRService()
@@ -0,0 +1,339 @@
+"""页面分析 - 每页只解析一次, 文字/清理文字/表格/HTML提取共用分析结果"""
+import os
+import json
+import zlib
+from contextlib import contextmanager
+from config import Config
+from utils.file_handler import get_file_path
+from utils.document_pool import document_pool
+from utils.plumber_pages import ConstantMemoryPDF
+from utils.preview_cache import analysis_cache
+from utils.settings_manager import settings
+
+# 分析结果结构变化时递增, 使旧缓存失效
+ANALYSIS_VERSION = 3
+
+# 提取引擎 -> 文档池句柄类型
+BACKENDS = {'pdfplumber': 'plumber', 'mupdf': 'fitz'}
+
+# 排版文字的字符网格(与pdfplumber layout模式的默认密度一致)
+_LAYOUT_X_DENSITY = 7.25
+_LAYOUT_Y_DENSITY = 13
+
+# 表格预筛: 先合并共线线段(坐标差不超过_RULE_SNAP、间隙不超过_RULE_JOIN, 与pdfplumber默认的
+# snap/join_tolerance一致), 合并后短于_RULE_MIN_LENGTH的不计入框线; 厚度不超过该值的线段视为水平/竖直线
+_RULE_MIN_LENGTH = 3
+_RULE_MAX_THICKNESS = 3
+_RULE_SNAP = 3
+_RULE_JOIN = 3
+
+
+def _box(obj):
+    return [round(obj['x0'], 2), round(obj['top'], 2), round(obj['x1'], 2), round(obj['bottom'], 2)]
+
+
+def _rect_box(x0, y0, x1, y1):
+    return [round(min(x0, x1), 2), round(min(y0, y1), 2), round(max(x0, x1), 2), round(max(y0, y1), 2)]
+
+
+def _count_rules(segments):
+    """合并共线线段后统计框线数
+
+    segments为[(坐标, 起点, 终点), ...], 水平线的坐标为y, 竖直线为x。坐标相近的线段
+    归为一组, 组内首尾间隙不超过_RULE_JOIN的相连(虚线、点线由此连成一条),
+    合并后长度达到_RULE_MIN_LENGTH的计为一条框线。
+    """
+    groups = []
+    for coord, start, end in sorted(segments):
+        if groups and coord - groups[-1][0] <= _RULE_SNAP:
+            groups[-1][0] = coord
+            groups[-1][1].append((start, end))
+        else:
+            groups.append([coord, [(start, end)]])
+
+    count = 0
+    for _, spans in groups:
+        spans.sort()
+        current_start, current_end = spans[0]
+        for start, end in spans[1:]:
+            if start <= current_end + _RULE_JOIN:
+                current_end = max(current_end, end)
+                continue
+            count += current_end - current_start >= _RULE_MIN_LENGTH
+            current_start, current_end = start, end
+        count += current_end - current_start >= _RULE_MIN_LENGTH
+    return count
+
+
+def _layout_text(words):
+    """按字符网格排布单词, 近似pdfplumber的layout模式(保留缩进和空行)"""
+    rows = {}
+    for x0, top, _, _, text in words:
+        rows.setdefault(round(top / _LAYOUT_Y_DENSITY), []).append((x0, text))
+
+    lines = []
+    prev_row = None
+    for row in sorted(rows):
+        if prev_row is not None:
+            lines.extend([''] * (row - prev_row - 1))
+        line = ''
+        for x0, text in sorted(rows[row]):
+            column = round(x0 / _LAYOUT_X_DENSITY)
+            line += ' ' * max(column - len(line), 1 if line else 0) + text
+        lines.append(line)
+        prev_row = row
+    return '\n'.join(lines)
+
+
+class PageAnalysis:
+    """单页分析结果
+
+    由pdfplumber或PyMuPDF(mupdf)页面一次性生成, 两种引擎输出相同结构, 以紧凑形式(坐标数组 + JSON + zlib)缓存:
+        width/height   页面尺寸
+        fonts          字体名列表, chars中以下标引用
+        chars          [[x0, top, x1, bottom, 文字, 字号, 字体下标], ...]
+        words          [[x0, top, x1, bottom, 文字], ...]
+        lines / rects  [[x0, top, x1, bottom], ...]
+        curves         曲线/四边形路径按顶点拆成的线段 [[x0, top, x1, bottom], ...]
+        images         [[x0, top, x1, bottom, 原始宽, 原始高], ...]
+        text           普通文字
+        layout_text    保留排版的文字(layout模式)
+        tables         检测到的表格(二维数组), 尚未检测时为None
+        tables_skipped 表格预筛判定不可能含表格而未做检测
+
+    表格检测开销远大于其余部分, 只在需要表格的提取模式首次用到时才执行,
+    并先经过预筛(may_contain_table), 结果补充进同一份缓存。缓存存放在独立的分析缓存中(键含源文件修改时间和引擎),
+    随源文件一起失效和过期清理。
+    """
+
+    @staticmethod
+    def resolve_backend(backend=None):
+        """确定提取引擎: 请求指定 > 系统设置 > pdfplumber"""
+        backend = backend or settings.get('extraction_backend') or 'pdfplumber'
+        if backend not in BACKENDS:
+            raise ValueError(f"不支持的提取引擎: {backend}(可选: {', '.join(BACKENDS)})")
+        return backend
+
+    @staticmethod
+    def pool_kind(backend):
+        """引擎对应的文档池句柄类型"""
+        return BACKENDS[backend]
+
+    @staticmethod
+    @contextmanager
+    def open_document(file_id, backend):
+        """从文档池借出对应引擎的文档
+
+        pdfplumber文档达到PLUMBER_CONSTANT_MEMORY_MIN_PAGES页时改用恒定内存模式:
+        按需逐页创建页面, 每页分析完释放页面和pdfminer的缓存。
+        """
+        with document_pool.borrow(file_id, kind=PageAnalysis.pool_kind(backend)) as doc:
+            if backend == 'pdfplumber':
+                wrapped = ConstantMemoryPDF(doc)
+                if len(wrapped.pages) >= Config.PLUMBER_CONSTANT_MEMORY_MIN_PAGES:
+                    yield wrapped
+                    return
+            yield doc
+
+    @staticmethod
+    def page_count(doc, backend):
+        return len(doc.pages) if backend == 'pdfplumber' else len(doc)
+
+    @staticmethod
+    def _variant(page_num, backend):
+        return f"a{page_num}_v{ANALYSIS_VERSION}_{backend}.bin"
+
+    @staticmethod
+    def analyze(page, with_tables=False, backend='pdfplumber'):
+        """分析一个页面(pdfplumber页面或fitz页面, 与backend对应)"""
+        if backend == 'mupdf':
+            return PageAnalysis._analyze_mupdf(page, with_tables)
+        return PageAnalysis._analyze_plumber(page, with_tables)
+
+    @staticmethod
+    def find_tables(page, backend='pdfplumber'):
+        """检测页面表格, 返回二维数组列表"""
+        if backend == 'mupdf':
+            return [table.extract() for table in page.find_tables().tables]
+        return page.extract_tables()
+
+    @staticmethod
+    def _analyze_plumber(page, with_tables):
+        fonts = []
+        font_index = {}
+        chars = []
+        for char in page.chars:
+            fontname = char.get('fontname', '')
+            if fontname not in font_index:
+                font_index[fontname] = len(fonts)
+                fonts.append(fontname)
+            chars.append(_box(char) + [char['text'], round(char.get('size', 0), 2), font_index[fontname]])
+
+        return {
+            'width': float(page.width),
+            'height': float(page.height),
+            'fonts': fonts,
+            'chars': chars,
+            'words': [_box(word) + [word['text']] for word in page.extract_words()],
+            'lines': [_box(line) for line in page.lines],
+            'rects': [_box(rect) for rect in page.rects],
+            'curves': [
+                _rect_box(ax, atop, bx, btop)
+                for curve in page.curves
+                for (ax, atop), (bx, btop) in zip(curve['pts'], curve['pts'][1:])
+            ],
+            'images': [_box(image) + list(image.get('srcsize') or (0, 0)) for image in page.images],
+            'text': page.extract_text() or '',
+            'layout_text': page.extract_text(layout=True) or '',
+            'tables': page.extract_tables() if with_tables else None,
+            'tables_skipped': False
+        }
+
+    @staticmethod
+    def _analyze_mupdf(page, with_tables):
+        """基于get_text("rawdict")/get_drawings()/find_tables()的分析, 速度远快于pdfplumber"""
+        fonts = []
+        font_index = {}
+        chars = []
+        for block in page.get_text("rawdict")['blocks']:
+            if block['type'] != 0:
+                continue
+            for line in block['lines']:
+                for span in line['spans']:
+                    fontname = span.get('font', '')
+                    if fontname not in font_index:
+                        font_index[fontname] = len(fonts)
+                        fonts.append(fontname)
+                    for char in span['chars']:
+                        chars.append(_rect_box(*char['bbox']) + [
+                            char['c'], round(span['size'], 2), font_index[fontname]
+                        ])
+
+        words = [_rect_box(x0, y0, x1, y1) + [text] for x0, y0, x1, y1, text, *_ in page.get_text("words")]
+
+        lines, rects, curves = [], [], []
+        for path in page.get_drawings():
+            for item in path['items']:
+                if item[0] == 'l':
+                    lines.append(_rect_box(item[1].x, item[1].y, item[2].x, item[2].y))
+                elif item[0] == 're':
+                    rects.append(_rect_box(*item[1]))
+                elif item[0] == 'c':
+                    # 贝塞尔曲线按端点连线记录(生成器常用曲线画直线)
+                    curves.append(_rect_box(item[1].x, item[1].y, item[4].x, item[4].y))
+                elif item[0] == 'qu':
+                    quad = item[1]
+                    corners = (quad.ul, quad.ur, quad.lr, quad.ll, quad.ul)
+                    curves.extend(_rect_box(a.x, a.y, b.x, b.y) for a, b in zip(corners, corners[1:]))
+
+        images = [
+            _rect_box(*info['bbox']) + [info.get('width', 0), info.get('height', 0)]
+            for info in page.get_image_info()
+        ]
+
+        return {
+            'width': float(page.rect.width),
+            'height': float(page.rect.height),
+            'fonts': fonts,
+            'chars': chars,
+            'words': words,
+            'lines': lines,
+            'rects': rects,
+            'curves': curves,
+            'images': images,
+            'text': page.get_text("text"),
+            'layout_text': _layout_text(words),
+            'tables': PageAnalysis.find_tables(page, 'mupdf') if with_tables else None,
+            'tables_skipped': False
+        }
+
+    @staticmethod
+    def may_contain_table(analysis):
+        """表格预筛: 由分析结果中的框线判断页面是否可能含有表格
+
+        两种引擎默认的表格检测(lines策略)都由框线围成单元格, 至少需要2条
+        水平线和2条竖直线(矩形的四条边、曲线/四边形路径中水平或竖直的线段同样计入)。
+        不满足时检测结果必然为空, 可以直接跳过; 满足时(包括普通边框等)仍做完整检测。
+        短线段先按共线合并再判断长度(同pdfplumber), 不像pdfplumber那样预先丢弃
+        不足1pt的碎片, 因此只会多检测, 不会漏掉表格。
+        """
+        horizontal, vertical = [], []
+        for x0, top, x1, bottom in analysis['lines'] + analysis['curves']:
+            # 按较长的一边判断方向(短虚线段两边都可能小于厚度阈值), 长宽相等的点两个方向都计入
+            width, height = x1 - x0, bottom - top
+            if height <= _RULE_MAX_THICKNESS and width >= height:
+                horizontal.append(((top + bottom) / 2, x0, x1))
+            if width <= _RULE_MAX_THICKNESS and height >= width:
+                vertical.append(((x0 + x1) / 2, top, bottom))
+
+        for x0, top, x1, bottom in analysis['rects']:
+            # 与pdfplumber一致, 矩形按四条边计入; 细长矩形的两条长边在合并时归为一条
+            horizontal += [(top, x0, x1), (bottom, x0, x1)]
+            vertical += [(x0, top, bottom), (x1, top, bottom)]
+
+        return _count_rules(horizontal) >= 2 and _count_rules(vertical) >= 2
+
+    @staticmethod
+    def _needs_tables(analysis, with_tables, force_tables):
+        if not with_tables:
+            return False
+        return analysis['tables'] is None or (force_tables and analysis.get('tables_skipped', False))
+
+    @staticmethod
+    def _load(file_id, page_num, source_mtime, backend):
+        data = analysis_cache.get(file_id, PageAnalysis._variant(page_num, backend), source_mtime)
+        if data is None:
+            return None
+        try:
+            return json.loads(zlib.decompress(data))
+        except (zlib.error, ValueError):
+            return None
+
+    @staticmethod
+    def _store(file_id, page_num, source_mtime, analysis, backend):
+        raw = json.dumps(analysis, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        analysis_cache.put(file_id, PageAnalysis._variant(page_num, backend), source_mtime, zlib.compress(raw, 6))
+
+    @staticmethod
+    def get(file_id, doc, page_num, with_tables=False, backend='pdfplumber', force_tables=False):
+        """获取页面(0开始页码)的分析结果, 缓存中没有或缺少表格时解析页面
+
+        doc为open_document借出的文档, pdfplumber页面解析后释放其缓存的对象。
+        with_tables时预筛判定不可能含表格的页面不做检测(tables为空,
+        tables_skipped为True), force_tables=True时始终完整检测。
+        """
+        force_tables = force_tables or not Config.TABLE_PRESCREEN
+        source_mtime = os.path.getmtime(get_file_path(file_id))
+        analysis = PageAnalysis._load(file_id, page_num, source_mtime, backend)
+        if analysis is not None and not PageAnalysis._needs_tables(analysis, with_tables, force_tables):
+            return analysis
+
+        page = None
+        try:
+            if analysis is None:
+                page = doc[page_num] if backend == 'mupdf' else doc.pages[page_num]
+                analysis = PageAnalysis.analyze(page, backend=backend)
+
+            if PageAnalysis._needs_tables(analysis, with_tables, force_tables):
+                if force_tables or PageAnalysis.may_contain_table(analysis):
+                    if page is None:
+                        page = doc[page_num] if backend == 'mupdf' else doc.pages[page_num]
+                    analysis['tables'] = PageAnalysis.find_tables(page, backend)
+                    analysis['tables_skipped'] = False
+                else:
+                    analysis['tables'] = []
+                    analysis['tables_skipped'] = True
+        finally:
+            if page is not None and backend == 'pdfplumber':
+                getattr(doc, 'release_page', PageAnalysis.release_page)(page)
+
+        PageAnalysis._store(file_id, page_num, source_mtime, analysis, backend)
+        return analysis
+
+    @staticmethod
+    def release_page(page):
+        """释放pdfplumber页面缓存的解析对象, 使逐页处理时内存保持平稳"""
+        if hasattr(page, 'close'):
+            page.close()
+        else:
+            page.flush_cache()
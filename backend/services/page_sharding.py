@@ -0,0 +1,82 @@
+"""页面分片并行执行 - 将页码范围拆分到多个工作进程处理"""
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from config import Config
+
+
+class PageShardExecutor:
+    """将页码列表切分为连续分片, 在独立进程中并行处理后按页码顺序合并
+
+    worker必须是模块级函数: worker(file_id, pages) -> {page_num: result},
+    每个进程各自打开文档。
+    """
+
+    @staticmethod
+    def should_shard(pages):
+        """页数足够多且允许多进程时才分片(进程启动有固定开销)"""
+        return Config.SHARD_WORKERS > 1 and len(pages) >= Config.SHARD_MIN_PAGES
+
+    @staticmethod
+    def split_pages(pages, shard_count):
+        """按顺序切分为shard_count个连续分片"""
+        size = max(1, -(-len(pages) // shard_count))
+        return [pages[i:i + size] for i in range(0, len(pages), size)]
+
+    @staticmethod
+    def iter_ordered(worker, file_id, pages, progress_callback=None):
+        """并行处理并按页码顺序逐页产出(page_num, result)
+
+        分片数为进程数的SHARD_PER_WORKER倍, 使进度更新更平滑;
+        前面的分片完成后即可产出, 不必等待全部分片。
+        """
+        workers = min(Config.SHARD_WORKERS, len(pages))
+        shards = PageShardExecutor.split_pages(pages, workers * Config.SHARD_PER_WORKER)
+
+        ctx = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as executor:
+            futures = {
+                executor.submit(worker, file_id, shard): index
+                for index, shard in enumerate(shards)
+            }
+
+            finished = {}
+            next_index = 0
+            done_pages = 0
+
+            for future in as_completed(futures):
+                index = futures[future]
+                finished[index] = future.result()
+                done_pages += len(shards[index])
+
+                if progress_callback:
+                    progress_callback(int(done_pages / len(pages) * 100))
+
+                # 依次产出已连续完成的分片
+                while next_index in finished:
+                    shard_result = finished.pop(next_index)
+                    for page_num in shards[next_index]:
+                        if page_num in shard_result:
+                            yield page_num, shard_result[page_num]
+                    next_index += 1
+
+    @staticmethod
+    def map_pages(worker, file_id, pages, local_fn, progress_callback=None):
+        """逐页产出(page_num, result)
+
+        页数达到分片阈值时交给worker在多进程中并行处理,
+        否则在当前线程中对每页调用local_fn(page_num)。
+        """
+        if PageShardExecutor.should_shard(pages):
+            yield from PageShardExecutor.iter_ordered(worker, file_id, pages, progress_callback)
+            return
+
+        for i, page_num in enumerate(pages):
+            result = local_fn(page_num)
+            if progress_callback:
+                progress_callback(int((i + 1) / len(pages) * 100))
+            yield page_num, result
+
+    @staticmethod
+    def run(worker, file_id, pages, progress_callback=None):
+        """并行处理并返回按页码顺序排列的{page_num: result}"""
+        return dict(PageShardExecutor.iter_ordered(worker, file_id, pages, progress_callback))
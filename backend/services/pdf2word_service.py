@@ -1,8 +1,8 @@
 """PDF转Word服务 - 保持原始格式"""
-import fitz
 import os
 from config import Config
 from utils.file_handler import get_file_path
+from utils.document_pool import document_pool
 
 class PDF2WordService:
     """PDF转Word服务,保持完整格式"""
@@ -43,6 +43,15 @@ class PDF2WordService:
                 output_path = os.path.join(Config.PROCESSED_FOLDER, f"{output_id}.docx")
                 saved_to_local = False
             
+            # 借用已解析的文档句柄校验页码, 避免pdf2docx因越界页码失败
+            # (pdf2docx内部会自行打开文件, 无法直接复用句柄)
+            with document_pool.borrow(file_id) as doc:
+                total_pages = len(doc)
+            if pages:
+                pages = [p for p in pages if 0 <= p < total_pages]
+                if not pages:
+                    raise ValueError(f"页码超出范围(共{total_pages}页)")
+            
             # 创建转换器
             cv = Converter(input_path)
             
@@ -1,10 +1,17 @@
 import fitz  # PyMuPDF
 import pikepdf
 import os
+import shutil
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
 from io import BytesIO
 from config import Config
 from utils.file_handler import get_file_path
+from utils.document_pool import document_pool
+from services.page_sharding import PageShardExecutor
+from services.merge_engine import MergeEngine
 
 class PDFService:
     """PDF处理核心服务"""
@@ -18,19 +25,18 @@ class PDFService:
             raise FileNotFoundError("PDF文件不存在")
         
         try:
-            doc = fitz.open(filepath)
-            metadata = {
-                'page_count': len(doc),
-                'is_encrypted': doc.is_encrypted,
-                'title': doc.metadata.get('title', ''),
-                'author': doc.metadata.get('author', ''),
-                'subject': doc.metadata.get('subject', ''),
-                'creator': doc.metadata.get('creator', ''),
-                'producer': doc.metadata.get('producer', ''),
-                'creation_date': doc.metadata.get('creationDate', ''),
-                'modification_date': doc.metadata.get('modDate', '')
-            }
-            doc.close()
+            with document_pool.borrow(file_id) as doc:
+                metadata = {
+                    'page_count': len(doc),
+                    'is_encrypted': doc.is_encrypted,
+                    'title': doc.metadata.get('title', ''),
+                    'author': doc.metadata.get('author', ''),
+                    'subject': doc.metadata.get('subject', ''),
+                    'creator': doc.metadata.get('creator', ''),
+                    'producer': doc.metadata.get('producer', ''),
+                    'creation_date': doc.metadata.get('creationDate', ''),
+                    'modification_date': doc.metadata.get('modDate', '')
+                }
             return metadata
         except Exception as e:
             raise Exception(f"读取PDF元数据失败: {str(e)}")
@@ -44,31 +50,25 @@ class PDFService:
             raise FileNotFoundError("PDF文件不存在")
         
         try:
-            doc = fitz.open(filepath)
-            total_pages = len(doc)
-            
-            # 如果未指定页码,提取所有页
-            if not pages:
-                pages = list(range(total_pages))
-            
-            # 限制页数
-            if len(pages) > Config.MAX_PAGES_PER_TASK:
-                pages = pages[:Config.MAX_PAGES_PER_TASK]
-            
-            extracted_text = {}
-            total_to_process = len(pages)
-            
-            for i, page_num in enumerate(pages):
-                if 0 <= page_num < total_pages:
-                    page = doc[page_num]
-                    text = page.get_text()
+            with document_pool.borrow(file_id) as doc:
+                total_pages = len(doc)
+                
+                # 如果未指定页码,提取所有页
+                if not pages:
+                    pages = list(range(total_pages))
+                
+                # 限制页数
+                if len(pages) > Config.MAX_PAGES_PER_TASK:
+                    pages = pages[:Config.MAX_PAGES_PER_TASK]
+                
+                extracted_text = {}
+                valid_pages = [p for p in pages if 0 <= p < total_pages]
+                
+                for page_num, text in PageShardExecutor.map_pages(
+                        _shard_extract_text, file_id, valid_pages,
+                        lambda p: doc[p].get_text(), progress_callback):
                     extracted_text[str(page_num + 1)] = text  # 1-indexed
                 
-                if progress_callback:
-                    progress_callback(int((i + 1) / total_to_process * 100))
-            
-            doc.close()
-            
             return {
                 'total_pages': total_pages,
                 'extracted_pages': len(extracted_text),
@@ -78,97 +78,149 @@ class PDFService:
             raise Exception(f"提取文字失败: {str(e)}")
     
     @staticmethod
-    def extract_images(file_id, pages=None, export_path=None, progress_callback=None):
-        """提取PDF中的图片"""
+    def iter_text(file_id, pages=None, progress_callback=None):
+        """逐页生成文字内容(流式模式, 不限制页数)"""
         filepath = get_file_path(file_id)
         
         if not os.path.exists(filepath):
             raise FileNotFoundError("PDF文件不存在")
         
-        try:
-            doc = fitz.open(filepath)
+        with document_pool.borrow(file_id) as doc:
             total_pages = len(doc)
+            pages = pages or list(range(total_pages))
+            valid_pages = [p for p in pages if 0 <= p < total_pages]
             
-            if not pages:
-                pages = list(range(total_pages))
-            
-            if len(pages) > Config.MAX_PAGES_PER_TASK:
-                pages = pages[:Config.MAX_PAGES_PER_TASK]
-            
-            images = []
-            image_count = 0
-            saved_to_custom_path = False
-            
-            # 确定保存目录
-            if export_path:
-                if not os.path.exists(export_path):
-                    os.makedirs(export_path)
-                save_dir = export_path
-                saved_to_custom_path = True
-            else:
-                save_dir = Config.PROCESSED_FOLDER
+            for page_num, text in PageShardExecutor.map_pages(
+                    _shard_extract_text, file_id, valid_pages,
+                    lambda p: doc[p].get_text(), progress_callback):
+                yield {'page': page_num + 1, 'text': text}
             
-            total_to_process = len(pages)
-            
-            for i, page_num in enumerate(pages):
-                if 0 <= page_num < total_pages:
-                    page = doc[page_num]
-                    image_list = page.get_images()
+            yield {'done': True, 'total_pages': total_pages, 'extracted_pages': len(valid_pages)}
+    
+    @staticmethod
+    def extract_images(file_id, pages=None, export_path=None, progress_callback=None,
+                       min_dimension=None, min_size=None, task_id=None):
+        """提取PDF中的图片
+        
+        同一图片(相同xref或相同内容)只解码和保存一次, 结果中pages记录其出现的所有页;
+        宽或高小于min_dimension像素、或小于min_size字节的图片(图标、分隔线等)被跳过。
+        文件写入和缩略图生成在有界线程池中进行, 与后续页面的解码重叠。
+        task_id: 保存到自定义目录时写入缩略图URL, 图片接口据此从任务结果中查找原图目录。
+        """
+        filepath = get_file_path(file_id)
+        
+        if not os.path.exists(filepath):
+            raise FileNotFoundError("PDF文件不存在")
+        
+        if min_dimension is None:
+            min_dimension = Config.IMAGE_MIN_DIMENSION
+        if min_size is None:
+            min_size = Config.IMAGE_MIN_BYTES
+        
+        try:
+            with document_pool.borrow(file_id) as doc:
+                total_pages = len(doc)
+                
+                if not pages:
+                    pages = list(range(total_pages))
+                
+                if len(pages) > Config.MAX_PAGES_PER_TASK:
+                    pages = pages[:Config.MAX_PAGES_PER_TASK]
+                
+                images = []
+                by_xref = {}  # xref -> 图片记录(None表示已被过滤)
+                by_hash = {}  # 内容哈希 -> 图片记录
+                skipped = 0
+                duplicates = 0
+                saved_to_custom_path = False
+                
+                # 确定保存目录
+                save_dir = PDFService.image_output_dir(export_path)
+                if export_path:
+                    if not os.path.exists(export_path):
+                        os.makedirs(export_path)
+                    saved_to_custom_path = True
+                # 缩略图缺失时由图片接口按原图重新生成, 自定义目录通过任务ID在服务端查找
+                thumb_query = f"?task={task_id}" if saved_to_custom_path and task_id else ''
+                
+                base_name = os.path.splitext(os.path.basename(filepath))[0]
+                total_to_process = len(pages)
+                
+                # 限制待写入的图片数量, 避免解码速度远快于写入时占用过多内存
+                pending = threading.BoundedSemaphore(Config.IMAGE_WRITE_WORKERS * 2)
+                with ThreadPoolExecutor(max_workers=Config.IMAGE_WRITE_WORKERS) as writer:
+                    futures = []
                     
-                    for img_index, img in enumerate(image_list):
-                        xref = img[0]
-                        base_image = doc.extract_image(xref)
-                        image_bytes = base_image["image"]
-                        image_ext = base_image["ext"]
-                        
-                        # 保存图片
-                        image_filename = f"{os.path.splitext(os.path.basename(filepath))[0]}_p{page_num+1}_{img_index+1}.{image_ext}"
-                        image_path = os.path.join(save_dir, image_filename)
-                        
-                        with open(image_path, "wb") as img_file:
-                            img_file.write(image_bytes)
+                    for i, page_num in enumerate(pages):
+                        if 0 <= page_num < total_pages:
+                            page = doc[page_num]
+                            
+                            for img in page.get_images():
+                                xref, width, height = img[0], img[2], img[3]
+                                
+                                if xref in by_xref:
+                                    record = by_xref[xref]
+                                    if record is not None and page_num + 1 not in record['pages']:
+                                        record['pages'].append(page_num + 1)
+                                    continue
+                                
+                                # 尺寸来自图片字典, 无需解码即可过滤
+                                if width < min_dimension or height < min_dimension:
+                                    by_xref[xref] = None
+                                    skipped += 1
+                                    continue
+                                
+                                base_image = doc.extract_image(xref)
+                                image_bytes = base_image["image"]
+                                if len(image_bytes) < min_size:
+                                    by_xref[xref] = None
+                                    skipped += 1
+                                    continue
+                                
+                                digest = hashlib.sha1(image_bytes).hexdigest()
+                                if digest in by_hash:
+                                    record = by_hash[digest]
+                                    by_xref[xref] = record
+                                    if page_num + 1 not in record['pages']:
+                                        record['pages'].append(page_num + 1)
+                                    duplicates += 1
+                                    continue
+                                
+                                image_ext = base_image["ext"]
+                                image_filename = f"{base_name}_p{page_num+1}_x{xref}.{image_ext}"
+                                record = {
+                                    'filename': image_filename,
+                                    'path': os.path.join(save_dir, image_filename),
+                                    # 缩略图始终保存到处理目录以便Web访问
+                                    'thumbnail': f"thumb_{image_filename}",
+                                    'thumbnail_url': f"/api/images/thumb_{image_filename}{thumb_query}",
+                                    'page': page_num + 1,
+                                    'pages': [page_num + 1],
+                                    'format': image_ext,
+                                    'width': base_image.get('width', width),
+                                    'height': base_image.get('height', height),
+                                    'size': len(image_bytes)
+                                }
+                                by_xref[xref] = record
+                                by_hash[digest] = record
+                                images.append(record)
+                                
+                                pending.acquire()
+                                future = writer.submit(PDFService._save_image, record, image_bytes)
+                                future.add_done_callback(lambda f: pending.release())
+                                futures.append(future)
                         
-                        # 生成缩略图 (始终保存到处理目录以便Web访问)
-                        thumbnail_filename = f"thumb_{image_filename}"
-                        thumbnail_path = os.path.join(Config.PROCESSED_FOLDER, thumbnail_filename)
-                        
-                        try:
-                            with Image.open(BytesIO(image_bytes)) as pil_img:
-                                # 转换为RGB (处理RGBA或CMYK)
-                                if pil_img.mode in ('RGBA', 'LA') or (pil_img.mode == 'P' and 'transparency' in pil_img.info):
-                                    bg = Image.new('RGB', pil_img.size, (255, 255, 255))
-                                    if pil_img.mode == 'P':
-                                        pil_img = pil_img.convert('RGBA')
-                                    bg.paste(pil_img, mask=pil_img.split()[3])
-                                    pil_img = bg
-                                elif pil_img.mode != 'RGB':
-                                    pil_img = pil_img.convert('RGB')
-                                    
-                                # 创建缩略图 (最大200x200)
-                                pil_img.thumbnail((200, 200))
-                                pil_img.save(thumbnail_path, "JPEG", quality=60)
-                        except Exception as e:
-                            print(f"生成缩略图失败: {e}")
-                            thumbnail_filename = None
-
-                        images.append({
-                            'filename': image_filename,
-                            'path': image_path,
-                            'thumbnail': thumbnail_filename,
-                            'page': page_num + 1,
-                            'format': image_ext,
-                            'size': len(image_bytes)
-                        })
-                        image_count += 1
+                        if progress_callback:
+                            progress_callback(int((i + 1) / total_to_process * 100))
+                    
+                    for future in futures:
+                        future.result()
                 
-                if progress_callback:
-                    progress_callback(int((i + 1) / total_to_process * 100))
-            
-            doc.close()
-            
             return {
-                'total_images': image_count,
+                'total_images': len(images),
                 'images': images,
+                'skipped_small': skipped,
+                'duplicates': duplicates,
                 'saved_to_custom_path': saved_to_custom_path,
                 'export_path': save_dir if saved_to_custom_path else None
             }
@@ -176,8 +228,52 @@ class PDFService:
             raise Exception(f"提取图片失败: {str(e)}")
     
     @staticmethod
-    def render_page_preview(file_id, page_num=1, dpi=None):
-        """渲染PDF页面预览图"""
+    def _save_image(record, image_bytes):
+        """写入图片文件并生成缩略图(在写入线程池中执行)"""
+        with open(record['path'], "wb") as img_file:
+            img_file.write(image_bytes)
+        
+        thumbnail_path = os.path.join(Config.PROCESSED_FOLDER, record['thumbnail'])
+        if not PDFService.make_thumbnail(image_bytes, thumbnail_path):
+            record['thumbnail'] = None
+            record['thumbnail_url'] = None
+    
+    @staticmethod
+    def image_output_dir(export_path=None):
+        """提取图片的保存目录: 指定导出路径时为该路径, 否则为处理目录"""
+        return export_path or Config.PROCESSED_FOLDER
+    
+    @staticmethod
+    def make_thumbnail(image_bytes, thumbnail_path):
+        """生成JPEG缩略图(最大200x200), 成功返回True"""
+        try:
+            with Image.open(BytesIO(image_bytes)) as pil_img:
+                # draft让JPEG解码器直接按缩小的尺寸解码
+                pil_img.draft(None, (400, 400))
+                
+                # 转换为RGB (处理RGBA或CMYK)
+                if pil_img.mode in ('RGBA', 'LA') or (pil_img.mode == 'P' and 'transparency' in pil_img.info):
+                    bg = Image.new('RGB', pil_img.size, (255, 255, 255))
+                    if pil_img.mode == 'P':
+                        pil_img = pil_img.convert('RGBA')
+                    bg.paste(pil_img, mask=pil_img.split()[-1])
+                    pil_img = bg
+                elif pil_img.mode != 'RGB':
+                    pil_img = pil_img.convert('RGB')
+                
+                pil_img.thumbnail((200, 200))
+                pil_img.save(thumbnail_path, "JPEG", quality=60)
+            return True
+        except Exception as e:
+            print(f"生成缩略图失败: {e}")
+            return False
+    
+    @staticmethod
+    def render_page_preview(file_id, page_num=1, dpi=None, fmt='png', rotation=None):
+        """渲染PDF页面预览图
+        
+        rotation不为None时按该角度显示(覆盖页面自身的旋转), 用于虚拟文档预览。
+        """
         filepath = get_file_path(file_id)
         
         if not os.path.exists(filepath):
@@ -187,64 +283,62 @@ class PDFService:
             dpi = Config.PREVIEW_DPI
         
         try:
-            doc = fitz.open(filepath)
-            
-            if page_num < 1 or page_num > len(doc):
-                raise ValueError(f"页码超出范围(1-{len(doc)})")
-            
-            page = doc[page_num - 1]  # 0-indexed
-            
-            # 渲染为图片
-            zoom = dpi / 72  # 72 DPI是默认值
-            mat = fitz.Matrix(zoom, zoom)
-            pix = page.get_pixmap(matrix=mat)
-            
-            # 转换为PNG字节
-            img_bytes = pix.tobytes("png")
-            
-            doc.close()
-            
+            with document_pool.borrow(file_id) as doc:
+                if page_num < 1 or page_num > len(doc):
+                    raise ValueError(f"页码超出范围(1-{len(doc)})")
+                
+                page = doc[page_num - 1]  # 0-indexed
+                
+                # 渲染为图片
+                zoom = dpi / 72  # 72 DPI是默认值
+                mat = fitz.Matrix(zoom, zoom)
+                if rotation is not None:
+                    mat.prerotate((rotation - page.rotation) % 360)
+                pix = page.get_pixmap(matrix=mat)
+                
+                # 转换为图片字节
+                if fmt == 'jpeg':
+                    img_bytes = pix.tobytes("jpeg", jpg_quality=Config.IMAGE_EXTRACT_QUALITY)
+                else:
+                    img_bytes = pix.tobytes("png")
+                
             return img_bytes
         except Exception as e:
             raise Exception(f"渲染预览失败: {str(e)}")
     
     @staticmethod
-    def delete_pages(file_id, pages_to_delete, progress_callback=None):
+    def delete_pages(file_id, pages_to_delete, progress_callback=None, compact=False):
         """删除指定页面"""
         filepath = get_file_path(file_id)
         
         if not os.path.exists(filepath):
             raise FileNotFoundError("PDF文件不存在")
         
-        try:
-            doc = fitz.open(filepath)
-            
+        def edit(doc):
             # 转换为0-indexed并排序(从后往前删除)
-            pages_to_delete = sorted([p-1 for p in pages_to_delete], reverse=True)
-            total = len(pages_to_delete)
+            pages = sorted([p-1 for p in pages_to_delete], reverse=True)
+            total = len(pages)
             
-            for i, page_num in enumerate(pages_to_delete):
+            for i, page_num in enumerate(pages):
                 if 0 <= page_num < len(doc):
                     doc.delete_page(page_num)
                 if progress_callback:
                     progress_callback(int((i + 1) / total * 100))
-            
-            # 保存为新文件
+        
+        try:
             output_id = f"{file_id}_deleted"
-            output_path = get_file_path(output_id, 'processed')
-            doc.save(output_path)
-            doc.close()
+            remaining_pages = PDFService._save_edited(file_id, output_id, edit, compact)
             
             return {
                 'output_file_id': output_id,
                 'deleted_pages': len(pages_to_delete),
-                'remaining_pages': fitz.open(output_path).page_count
+                'remaining_pages': remaining_pages
             }
         except Exception as e:
             raise Exception(f"删除页面失败: {str(e)}")
     
     @staticmethod
-    def rotate_pages(file_id, rotations, progress_callback=None):
+    def rotate_pages(file_id, rotations, progress_callback=None, compact=False):
         """旋转页面
         rotations: {page_num: angle} 例如 {1: 90, 3: 180}
         """
@@ -253,8 +347,7 @@ class PDFService:
         if not os.path.exists(filepath):
             raise FileNotFoundError("PDF文件不存在")
         
-        try:
-            doc = fitz.open(filepath)
+        def edit(doc):
             total = len(rotations)
             
             for i, (page_num, angle) in enumerate(rotations.items()):
@@ -263,11 +356,10 @@ class PDFService:
                     page.set_rotation(angle)
                 if progress_callback:
                     progress_callback(int((i + 1) / total * 100))
-            
+        
+        try:
             output_id = f"{file_id}_rotated"
-            output_path = get_file_path(output_id, 'processed')
-            doc.save(output_path)
-            doc.close()
+            PDFService._save_edited(file_id, output_id, edit, compact)
             
             return {
                 'output_file_id': output_id,
@@ -277,31 +369,50 @@ class PDFService:
             raise Exception(f"旋转页面失败: {str(e)}")
     
     @staticmethod
-    def merge_pdfs(file_ids, progress_callback=None):
-        """合并多个PDF"""
+    def _save_edited(file_id, output_id, edit, compact=False):
+        """对文档应用edit(doc)并保存为processed下的output_id, 返回保存后的页数
+        
+        默认使用增量更新: 原文件只复制一次, 修改过的对象追加到文件末尾,
+        耗时与修改量而非文件大小相关。compact=True时完整重写并回收
+        无用对象, 输出更小(被删除页面的数据不再保留在文件中)。
+        """
+        output_path = get_file_path(output_id, 'processed')
+        
+        if compact:
+            with document_pool.borrow(file_id, writable=True) as doc:
+                edit(doc)
+                doc.save(output_path, garbage=3, deflate=True)
+                return len(doc)
+        
+        shutil.copyfile(get_file_path(file_id), output_path)
+        tmp_path = f"{output_path}.tmp"
+        with document_pool.borrow(output_id, folder='processed', writable=True) as doc:
+            edit(doc)
+            page_count = len(doc)
+            if doc.can_save_incrementally():
+                doc.save(output_path, incremental=True, encryption=fitz.PDF_ENCRYPT_KEEP)
+                return page_count
+            # 文档打开时经过修复等情况下无法增量保存, 改为完整保存
+            doc.save(tmp_path)
+        
+        os.replace(tmp_path, output_path)
+        return page_count
+    
+    @staticmethod
+    def merge_pdfs(sources, progress_callback=None):
+        """合并多个PDF
+        
+        sources: file_id列表, 或[{'file_id': ..., 'pages': [1, 3]}](pages为1开始页码, 省略表示全部)
+        """
         try:
-            result_doc = fitz.open()
-            total = len(file_ids)
-            
-            for i, file_id in enumerate(file_ids):
-                filepath = get_file_path(file_id)
-                if os.path.exists(filepath):
-                    src_doc = fitz.open(filepath)
-                    result_doc.insert_pdf(src_doc)
-                    src_doc.close()
-                if progress_callback:
-                    progress_callback(int((i + 1) / total * 100))
-            
-            output_id = f"merged_{file_ids[0]}"
+            sources = MergeEngine.normalize_sources(sources)
+            output_id = f"merged_{sources[0]['file_id']}"
             output_path = get_file_path(output_id, 'processed')
-            result_doc.save(output_path)
-            total_pages = len(result_doc)
-            result_doc.close()
+            stats = MergeEngine.merge(sources, output_path, progress_callback)
             
             return {
                 'output_file_id': output_id,
-                'merged_files': len(file_ids),
-                'total_pages': total_pages
+                **stats
             }
         except Exception as e:
             raise Exception(f"合并PDF失败: {str(e)}")
@@ -354,3 +465,8 @@ class PDFService:
             raise Exception("密码错误")
         except Exception as e:
             raise Exception(f"解密PDF失败: {str(e)}")
+
+def _shard_extract_text(file_id, pages):
+    """分片工作进程: 提取一组页面的文字"""
+    with document_pool.borrow(file_id) as doc:
+        return {page_num: doc[page_num].get_text() for page_num in pages}
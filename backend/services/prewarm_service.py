@@ -0,0 +1,146 @@
+"""上传后预热 - 空闲时预先渲染预览/缩略图并探测各页文字层"""
+import os
+import json
+import time
+import queue
+import threading
+from config import Config
+from task_manager import task_manager
+from utils.file_handler import get_file_path
+from utils.document_pool import document_pool
+from utils.preview_cache import preview_cache
+from services.pdf_service import PDFService
+from services.tile_service import TileService
+
+PROBE_VARIANT = 'probe.json'
+
+
+class PrewarmService:
+    """低优先级预热队列
+
+    上传完成后文件进入队列, 由单个后台线程依次处理:
+        1. 逐页探测(文字层、字符数、图片数)并与元数据一起存为probe.json
+        2. 按默认参数渲染前PREWARM_PREVIEW_PAGES页预览
+        3. 生成默认参数的缩略图雪碧图
+    结果写入预览缓存, 与按需渲染的结果共用同一缓存键, 前端随后的请求直接命中。
+    每处理一页前检查任务管理器, 有执行中或排队的任务时暂停, 不与用户任务争抢CPU。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._status = {}  # file_id -> pending/running/done/failed
+        self._thread = None
+
+    def enqueue(self, file_id):
+        """加入预热队列(已预热或已在队列中时忽略)"""
+        if not Config.PREWARM_ENABLED:
+            return False
+        if self.get_probe(file_id) is not None:
+            return False
+
+        with self.lock:
+            if self._status.get(file_id) in ('pending', 'running'):
+                return False
+            self._status[file_id] = 'pending'
+            # 首次使用时才启动线程, 进程池工作进程导入本模块时不会启动
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='prewarm', daemon=True)
+                self._thread.start()
+        self._queue.put(file_id)
+        return True
+
+    def get_status(self, file_id):
+        """预热状态和探测结果"""
+        probe = self.get_probe(file_id)
+        if probe is not None:
+            return {'status': 'done', 'probe': probe}
+        with self.lock:
+            status = self._status.get(file_id)
+        return {'status': status or 'none', 'probe': None}
+
+    def get_probe(self, file_id):
+        """读取已缓存的探测结果, 不存在或已过时返回None"""
+        filepath = get_file_path(file_id)
+        if not os.path.exists(filepath):
+            return None
+        data = preview_cache.get(file_id, PROBE_VARIANT, os.path.getmtime(filepath))
+        return json.loads(data) if data is not None else None
+
+    def _wait_idle(self):
+        """有用户任务执行或排队时等待"""
+        while task_manager.is_busy():
+            time.sleep(Config.PREWARM_IDLE_POLL)
+
+    def _run(self):
+        while True:
+            file_id = self._queue.get()
+            with self.lock:
+                self._status[file_id] = 'running'
+            try:
+                self._prewarm(file_id)
+                status = 'done'
+            except Exception as e:
+                # 预热失败不影响按需渲染
+                print(f"预热失败 {file_id}: {e}")
+                status = 'failed'
+            with self.lock:
+                # 完成后以缓存中的probe.json为准, 不再保留状态
+                if status == 'done':
+                    self._status.pop(file_id, None)
+                else:
+                    self._status[file_id] = status
+            self._queue.task_done()
+
+    def _prewarm(self, file_id):
+        filepath = get_file_path(file_id)
+        if not os.path.exists(filepath):
+            return
+        source_mtime = os.path.getmtime(filepath)
+
+        self._wait_idle()
+        metadata = PDFService.get_metadata(file_id)
+        page_count = metadata['page_count']
+
+        pages = []
+        for page_index in range(min(page_count, Config.PREWARM_PROBE_MAX_PAGES)):
+            self._wait_idle()
+            with document_pool.borrow(file_id) as doc:
+                page = doc[page_index]
+                text = page.get_text().strip()
+                pages.append({
+                    'page': page_index + 1,
+                    'has_text': bool(text),
+                    'char_count': len(text),
+                    'image_count': len(page.get_images()),
+                    'width': page.rect.width,
+                    'height': page.rect.height,
+                    'rotation': page.rotation
+                })
+
+        for page_num in range(1, min(page_count, Config.PREWARM_PREVIEW_PAGES) + 1):
+            variant = preview_cache.make_variant(page_num, Config.PREVIEW_DPI, 'png')
+            if preview_cache.get(file_id, variant, source_mtime) is None:
+                self._wait_idle()
+                img_bytes = PDFService.render_page_preview(file_id, page_num, Config.PREVIEW_DPI, 'png')
+                preview_cache.put(file_id, variant, source_mtime, img_bytes)
+
+        if page_count <= Config.SPRITE_MAX_PAGES:
+            quality = Config.TILE_DEFAULT_QUALITY
+            variant = preview_cache.make_sprite_variant(Config.SPRITE_THUMB_WIDTH, 'jpeg', quality)
+            if preview_cache.get(file_id, variant, source_mtime) is None:
+                self._wait_idle()
+                TileService.render_sprite_cached(file_id, Config.SPRITE_THUMB_WIDTH, 'jpeg', quality)
+
+        probe = {
+            'metadata': metadata,
+            'probed_pages': len(pages),
+            'text_pages': sum(1 for p in pages if p['has_text']),
+            'image_count': sum(p['image_count'] for p in pages),
+            'pages': pages
+        }
+        # 探测结果最后写入, 存在即表示预热已完成
+        preview_cache.put(file_id, PROBE_VARIANT, source_mtime, json.dumps(probe).encode('utf-8'))
+
+# 全局实例
+prewarm_service = PrewarmService()
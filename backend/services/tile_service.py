@@ -0,0 +1,190 @@
+"""页面瓦片渲染 - 多分辨率金字塔, 只渲染可见区域"""
+import json
+import math
+import os
+from io import BytesIO
+import fitz  # PyMuPDF
+from PIL import Image
+from config import Config
+from utils.file_handler import get_file_path
+from utils.document_pool import document_pool
+from utils.preview_cache import preview_cache
+
+
+class TileService:
+    """深度缩放瓦片服务
+
+    第0级整页缩放到一个瓦片内, 之后每级分辨率翻倍, 直到不低于TILE_MAX_DPI。
+    第L级的整页图像大小为 ceil(页宽*scale) x ceil(页高*scale),
+    scale = base_scale * 2^L, 按TILE_SIZE切分为瓦片, (x, y)为列号和行号。
+    各级共用同一套坐标, 查看器放大时只请求视口内的瓦片。
+    """
+
+    @staticmethod
+    def _levels(width, height):
+        """计算金字塔各级的缩放比例和网格大小"""
+        tile = Config.TILE_SIZE
+        base_scale = tile / max(width, height)
+        max_scale = Config.TILE_MAX_DPI / 72
+        count = max(1, math.ceil(math.log2(max(max_scale / base_scale, 1))) + 1)
+
+        levels = []
+        for level in range(count):
+            scale = base_scale * (2 ** level)
+            level_width = math.ceil(width * scale)
+            level_height = math.ceil(height * scale)
+            levels.append({
+                'level': level,
+                'scale': scale,
+                'dpi': round(scale * 72, 1),
+                'width': level_width,
+                'height': level_height,
+                'cols': math.ceil(level_width / tile),
+                'rows': math.ceil(level_height / tile)
+            })
+        return levels
+
+    @staticmethod
+    def get_tile_info(file_id, page_num):
+        """页面尺寸和金字塔信息"""
+        if not os.path.exists(get_file_path(file_id)):
+            raise FileNotFoundError("PDF文件不存在")
+
+        with document_pool.borrow(file_id) as doc:
+            if page_num < 1 or page_num > len(doc):
+                raise ValueError(f"页码超出范围(1-{len(doc)})")
+            rect = doc[page_num - 1].rect
+
+        return {
+            'page': page_num,
+            'width': rect.width,
+            'height': rect.height,
+            'tile_size': Config.TILE_SIZE,
+            'formats': list(Config.TILE_FORMATS),
+            'levels': TileService._levels(rect.width, rect.height)
+        }
+
+    @staticmethod
+    def render_tile(file_id, page_num, level, x, y, fmt='jpeg', quality=None):
+        """渲染单个瓦片, 返回编码后的图片字节"""
+        if fmt not in Config.TILE_FORMATS:
+            raise ValueError(f"不支持的瓦片格式: {fmt}")
+        if quality is None:
+            quality = Config.TILE_DEFAULT_QUALITY
+        if not 1 <= quality <= 100:
+            raise ValueError("quality必须在1-100之间")
+        if not os.path.exists(get_file_path(file_id)):
+            raise FileNotFoundError("PDF文件不存在")
+
+        tile = Config.TILE_SIZE
+        with document_pool.borrow(file_id) as doc:
+            if page_num < 1 or page_num > len(doc):
+                raise ValueError(f"页码超出范围(1-{len(doc)})")
+            page = doc[page_num - 1]
+            rect = page.rect
+
+            levels = TileService._levels(rect.width, rect.height)
+            if not 0 <= level < len(levels):
+                raise ValueError(f"缩放级别超出范围(0-{len(levels) - 1})")
+            info = levels[level]
+            if not (0 <= x < info['cols'] and 0 <= y < info['rows']):
+                raise ValueError("瓦片坐标超出范围")
+
+            # 瓦片像素区域换算回页面坐标, 只光栅化该区域
+            scale = info['scale']
+            clip = fitz.Rect(
+                rect.x0 + x * tile / scale,
+                rect.y0 + y * tile / scale,
+                rect.x0 + min((x + 1) * tile, info['width']) / scale,
+                rect.y0 + min((y + 1) * tile, info['height']) / scale
+            )
+            pix = page.get_pixmap(matrix=fitz.Matrix(scale, scale), clip=clip, alpha=False)
+
+            if fmt == 'jpeg':
+                return pix.tobytes("jpeg", jpg_quality=quality)
+            if fmt == 'png':
+                return pix.tobytes("png")
+
+            img = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+            buffer = BytesIO()
+            img.save(buffer, "WEBP", quality=quality, method=4)
+            return buffer.getvalue()
+
+    @staticmethod
+    def render_sprite(file_id, thumb_width=None, fmt='jpeg', quality=None):
+        """一次遍历文档, 将所有页面缩略图拼成一张雪碧图
+
+        每页按thumb_width等比缩放, 按SPRITE_COLUMNS列排布, 行高取该行最高的缩略图。
+        先由页面尺寸算出布局, 再逐页渲染并立即贴入画布, 内存只占用一张画布。
+        返回(图片字节, 索引), 索引记录每页在雪碧图中的位置。
+        """
+        if fmt not in Config.TILE_FORMATS:
+            raise ValueError(f"不支持的图片格式: {fmt}")
+        thumb_width = thumb_width or Config.SPRITE_THUMB_WIDTH
+        if not 16 <= thumb_width <= 512:
+            raise ValueError("缩略图宽度必须在16-512之间")
+        if quality is None:
+            quality = Config.TILE_DEFAULT_QUALITY
+        if not os.path.exists(get_file_path(file_id)):
+            raise FileNotFoundError("PDF文件不存在")
+
+        columns = Config.SPRITE_COLUMNS
+        with document_pool.borrow(file_id) as doc:
+            if len(doc) > Config.SPRITE_MAX_PAGES:
+                raise ValueError(f"页数超过{Config.SPRITE_MAX_PAGES}页, 请使用单页预览")
+
+            # 布局只需页面尺寸, 不渲染
+            pages = []
+            row_top, row_height = 0, 0
+            for i, page in enumerate(doc):
+                if i and i % columns == 0:
+                    row_top += row_height
+                    row_height = 0
+                scale = thumb_width / page.rect.width
+                height = math.ceil(page.rect.height * scale)
+                pages.append({
+                    'page': i + 1,
+                    'x': (i % columns) * thumb_width,
+                    'y': row_top,
+                    'width': thumb_width,
+                    'height': height,
+                    'scale': scale
+                })
+                row_height = max(row_height, height)
+
+            canvas = Image.new('RGB', (min(len(doc), columns) * thumb_width, row_top + row_height), 'white')
+            for entry, page in zip(pages, doc):
+                scale = entry.pop('scale')
+                pix = page.get_pixmap(matrix=fitz.Matrix(scale, scale), alpha=False)
+                canvas.paste(Image.frombytes("RGB", (pix.width, pix.height), pix.samples),
+                             (entry['x'], entry['y']))
+                entry['height'] = pix.height
+
+        buffer = BytesIO()
+        if fmt == 'jpeg':
+            canvas.save(buffer, "JPEG", quality=quality, optimize=True)
+        elif fmt == 'webp':
+            canvas.save(buffer, "WEBP", quality=quality, method=4)
+        else:
+            canvas.save(buffer, "PNG", optimize=True)
+
+        index = {
+            'page_count': len(pages),
+            'thumb_width': thumb_width,
+            'columns': columns,
+            'sprite_width': canvas.width,
+            'sprite_height': canvas.height,
+            'format': fmt,
+            'pages': pages
+        }
+        return buffer.getvalue(), index
+
+    @staticmethod
+    def render_sprite_cached(file_id, thumb_width, fmt, quality):
+        """渲染雪碧图并将图片和索引写入预览缓存, 返回(图片字节, 索引)"""
+        img_bytes, index = TileService.render_sprite(file_id, thumb_width, fmt, quality)
+        source_mtime = os.path.getmtime(get_file_path(file_id))
+        variant = preview_cache.make_sprite_variant(thumb_width, fmt, quality)
+        preview_cache.put(file_id, variant, source_mtime, img_bytes)
+        preview_cache.put(file_id, f"{variant}.json", source_mtime, json.dumps(index).encode('utf-8'))
+        return img_bytes, index
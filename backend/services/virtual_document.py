@@ -0,0 +1,287 @@
+"""虚拟文档 - 以操作日志组合旋转/删除/合并, 需要时才生成实际PDF"""
+import os
+import json
+import time
+import uuid
+import threading
+import fitz  # PyMuPDF
+from config import Config
+from utils.file_handler import get_file_path
+from utils.document_pool import document_pool
+from utils.preview_cache import preview_cache, analysis_cache
+from utils.upload_index import upload_index
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def _vdoc_lock(vdoc_id):
+    """获取虚拟文档的锁, 不是已存在的虚拟文档时返回None(不为任意ID创建锁)"""
+    try:
+        valid = str(uuid.UUID(vdoc_id)) == vdoc_id
+    except (ValueError, TypeError, AttributeError):
+        valid = False
+    if not valid:
+        return None
+
+    with _locks_guard:
+        lock = _locks.get(vdoc_id)
+        if lock is None:
+            if not os.path.exists(VirtualDocumentService._doc_path(vdoc_id)):
+                return None
+            lock = _locks[vdoc_id] = threading.Lock()
+        return lock
+
+
+class VirtualDocumentService:
+    """虚拟文档服务
+
+    虚拟文档只记录针对源文件(已上传的file_id)的操作日志, 由日志重放出
+    页面映射: 每页为[源file_id, 源页码(0开始), 旋转角度或None]。
+    预览直接渲染映射到的源页面; 下载或提交任务时才一次性生成PDF,
+    生成结果写入临时目录的{vdoc_id}.pdf, 因此虚拟文档ID可以像普通
+    file_id一样用于各类处理任务。
+
+    支持的操作(页码均为虚拟文档当前的1开始页码):
+        {"op": "rotate", "rotations": {"1": 90}}
+        {"op": "delete", "pages": [2, 3]}
+        {"op": "append", "file_id": "...", "pages": [1, 2]}  # pages可省略
+    """
+
+    @staticmethod
+    def _doc_path(vdoc_id):
+        return os.path.join(Config.VIRTUAL_DOC_FOLDER, f"{vdoc_id}.json")
+
+    @staticmethod
+    def _load(vdoc_id):
+        try:
+            uuid.UUID(vdoc_id)
+        except (ValueError, TypeError):
+            return None
+        try:
+            with open(VirtualDocumentService._doc_path(vdoc_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _save(vdoc):
+        os.makedirs(Config.VIRTUAL_DOC_FOLDER, exist_ok=True)
+        path = VirtualDocumentService._doc_path(vdoc['vdoc_id'])
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(vdoc, f)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def is_virtual(file_id):
+        """是否为虚拟文档ID"""
+        return VirtualDocumentService._load(file_id) is not None
+
+    @staticmethod
+    def _source_pages(file_id, pages=None):
+        """源文件的页面映射条目, pages为1开始的页码(None表示全部)"""
+        if not os.path.exists(get_file_path(file_id)):
+            raise FileNotFoundError(f"PDF文件不存在: {file_id}")
+        # 操作源文件时顺带延长其过期时间
+        upload_index.touch(file_id)
+
+        with document_pool.borrow(file_id) as doc:
+            total = len(doc)
+        if pages is None:
+            return [[file_id, i, None] for i in range(total)]
+
+        entries = []
+        for page_num in pages:
+            if not 1 <= page_num <= total:
+                raise ValueError(f"页码超出范围(1-{total}): {page_num}")
+            entries.append([file_id, page_num - 1, None])
+        return entries
+
+    @staticmethod
+    def _apply(page_map, op):
+        """对页面映射应用一条操作, 返回新的页面映射"""
+        kind = op.get('op')
+
+        if kind == 'rotate':
+            page_map = [list(entry) for entry in page_map]
+            for page_num, angle in op['rotations'].items():
+                page_num, angle = int(page_num), int(angle)
+                if angle % 90:
+                    raise ValueError("旋转角度必须是90的倍数")
+                if not 1 <= page_num <= len(page_map):
+                    raise ValueError(f"页码超出范围(1-{len(page_map)}): {page_num}")
+                page_map[page_num - 1][2] = angle % 360
+            return page_map
+
+        if kind == 'delete':
+            to_delete = {int(p) - 1 for p in op['pages']}
+            remaining = [entry for i, entry in enumerate(page_map) if i not in to_delete]
+            if not remaining:
+                raise ValueError("不能删除全部页面")
+            return remaining
+
+        if kind == 'append':
+            return page_map + VirtualDocumentService._source_pages(op['file_id'], op.get('pages'))
+
+        raise ValueError(f"不支持的操作: {kind}")
+
+    @staticmethod
+    def create(file_ids):
+        """由一个或多个源文件创建虚拟文档"""
+        if not file_ids:
+            raise ValueError("缺少源文件")
+
+        page_map = []
+        for file_id in file_ids:
+            page_map += VirtualDocumentService._source_pages(file_id)
+
+        vdoc = {
+            'vdoc_id': str(uuid.uuid4()),
+            'sources': list(file_ids),
+            'ops': [],
+            'page_map': page_map,
+            'materialized_version': None
+        }
+        VirtualDocumentService._save(vdoc)
+        return VirtualDocumentService.describe(vdoc)
+
+    @staticmethod
+    def apply_ops(vdoc_id, ops):
+        """追加操作, 任一操作无效时整体不生效"""
+        lock = _vdoc_lock(vdoc_id)
+        if lock is None:
+            raise FileNotFoundError("虚拟文档不存在")
+        with lock:
+            vdoc = VirtualDocumentService._load(vdoc_id)
+            if vdoc is None:
+                raise FileNotFoundError("虚拟文档不存在")
+
+            page_map = vdoc['page_map']
+            for op in ops:
+                page_map = VirtualDocumentService._apply(page_map, op)
+
+            vdoc['ops'].extend(ops)
+            vdoc['page_map'] = page_map
+            VirtualDocumentService._save(vdoc)
+            VirtualDocumentService._discard_materialized(vdoc_id)
+            for source_id in {entry[0] for entry in page_map}:
+                upload_index.touch(source_id)
+            return VirtualDocumentService.describe(vdoc)
+
+    @staticmethod
+    def get(vdoc_id):
+        """获取虚拟文档的操作日志和页面映射"""
+        vdoc = VirtualDocumentService._load(vdoc_id)
+        if vdoc is None:
+            raise FileNotFoundError("虚拟文档不存在")
+        return VirtualDocumentService.describe(vdoc)
+
+    @staticmethod
+    def describe(vdoc):
+        return {
+            'vdoc_id': vdoc['vdoc_id'],
+            'page_count': len(vdoc['page_map']),
+            'version': len(vdoc['ops']),
+            'ops': vdoc['ops'],
+            'pages': [
+                {'file_id': file_id, 'page': page + 1, 'rotation': rotation}
+                for file_id, page, rotation in vdoc['page_map']
+            ]
+        }
+
+    @staticmethod
+    def resolve_page(vdoc_id, page_num):
+        """虚拟页码 -> (源file_id, 源页码(1开始), 旋转角度或None)
+
+        不是虚拟文档时返回None。
+        """
+        vdoc = VirtualDocumentService._load(vdoc_id)
+        if vdoc is None:
+            return None
+        page_map = vdoc['page_map']
+        if not 1 <= page_num <= len(page_map):
+            raise ValueError(f"页码超出范围(1-{len(page_map)})")
+        file_id, page, rotation = page_map[page_num - 1]
+        return file_id, page + 1, rotation
+
+    @staticmethod
+    def materialize(vdoc_id):
+        """按页面映射一次性生成PDF(写入临时目录的{vdoc_id}.pdf)
+
+        日志未变化时复用已生成的文件。不是虚拟文档时直接返回False。
+        """
+        lock = _vdoc_lock(vdoc_id)
+        if lock is None:
+            return False
+        with lock:
+            vdoc = VirtualDocumentService._load(vdoc_id)
+            if vdoc is None:
+                return False
+
+            output_path = get_file_path(vdoc_id)
+            version = len(vdoc['ops'])
+            if vdoc['materialized_version'] == version and os.path.exists(output_path):
+                return True
+
+            result_doc = fitz.open()
+            try:
+                page_map = vdoc['page_map']
+                start = 0
+                while start < len(page_map):
+                    # 同一源文件的连续页面合并为一次插入
+                    file_id, first_page, _ = page_map[start]
+                    end = start
+                    while (end + 1 < len(page_map) and page_map[end + 1][0] == file_id
+                           and page_map[end + 1][1] == page_map[end][1] + 1):
+                        end += 1
+
+                    with document_pool.borrow(file_id) as src_doc:
+                        result_doc.insert_pdf(src_doc, from_page=first_page,
+                                              to_page=page_map[end][1])
+                    start = end + 1
+
+                for i, (_, _, rotation) in enumerate(page_map):
+                    if rotation is not None:
+                        result_doc[i].set_rotation(rotation)
+
+                tmp_path = f"{output_path}.tmp"
+                result_doc.save(tmp_path)
+            finally:
+                result_doc.close()
+
+            document_pool.invalidate(vdoc_id, 'temp')
+            os.replace(tmp_path, output_path)
+            vdoc['materialized_version'] = version
+            VirtualDocumentService._save(vdoc)
+            return True
+
+    @staticmethod
+    def _discard_materialized(vdoc_id):
+        """日志变化后删除过时的生成结果"""
+        output_path = get_file_path(vdoc_id)
+        document_pool.invalidate(vdoc_id, 'temp')
+        preview_cache.invalidate(vdoc_id)
+        analysis_cache.invalidate(vdoc_id)
+        if os.path.exists(output_path):
+            os.remove(output_path)
+
+    @staticmethod
+    def cleanup_expired(max_age_minutes=None):
+        """删除长时间未修改的虚拟文档, 返回删除数量"""
+        if max_age_minutes is None:
+            max_age_minutes = Config.FILE_MAX_AGE_MINUTES
+        folder = Config.VIRTUAL_DOC_FOLDER
+        if not os.path.exists(folder):
+            return 0
+
+        cutoff = time.time() - max_age_minutes * 60
+        removed = 0
+        for filename in os.listdir(folder):
+            path = os.path.join(folder, filename)
+            if filename.endswith('.json') and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                with _locks_guard:
+                    _locks.pop(filename[:-len('.json')], None)
+                removed += 1
+        return removed
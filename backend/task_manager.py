@@ -1,25 +1,97 @@
+import sys
 import sqlite3
 import threading
 import uuid
 import json
-from concurrent.futures import ThreadPoolExecutor
-from datetime import datetime
+import time
+import heapq
+import itertools
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
 from config import Config
+from utils.settings_manager import settings
+from utils.result_cache import result_cache
+
+# 进程池工作进程中的进度队列(主进程中为None)
+_worker_progress_queue = None
+
+def _init_worker(progress_queue, memory_limit_mb):
+    """进程池工作进程初始化: 设置进度回传队列和内存上限"""
+    global _worker_progress_queue
+    _worker_progress_queue = progress_queue
+    
+    if memory_limit_mb:
+        try:
+            import resource
+            limit = memory_limit_mb * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        except (ImportError, ValueError, OSError) as e:
+            # Windows等平台不支持RLIMIT_AS
+            print(f"设置工作进程内存上限失败: {e}")
 
 class TaskManager:
-    """轻量级任务管理器 - 使用ThreadPool替代Celery"""
+    """轻量级任务管理器 - 使用ThreadPool替代Celery
+    
+    可选进程池后端(task_backend='process'): 任务在独立进程中执行,
+    进度通过队列回传主进程, 进程崩溃或超出内存上限时任务记为FAILED。
+    
+    工作线程/进程全部占用时, 任务进入有界优先级队列(状态QUEUED),
+    仅当队列已满时才拒绝提交。
+    
+    通过submit_cached_task提交的任务会查询结果缓存: 命中时直接完成,
+    不占用worker; 相同任务正在执行时复用其task_id。
+    """
     
-    def __init__(self, max_workers=None):
+    def __init__(self, max_workers=None, queue_depth=None, db_path=None):
         self.max_workers = max_workers or Config.MAX_WORKERS
+        self.queue_depth = queue_depth if queue_depth is not None else Config.TASK_QUEUE_MAX_DEPTH
         self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
-        self.db_path = Config.DB_PATH
+        self.db_path = db_path or Config.DB_PATH
         self.lock = threading.Lock()
         self.active_tasks = 0
+        
+        # 每个线程持有一个长连接(WAL模式下读写互不阻塞)
+        self._local = threading.local()
+        # 进度节流状态: task_id -> [最新进度, 已写入进度, 上次写入时间]
+        self._progress_cache = {}
+        
+        # 任务状态通知: task_id -> 最新状态快照, 供SSE/长轮询直接读取, 无需查库
+        self._events = {}
+        self._events_cond = threading.Condition()
+        
+        # 等待队列: (优先级, 序号, task_id, func, args, kwargs)
+        self._queue = []
+        self._seq = itertools.count()
+        # 运行中任务: task_id -> (任务名, 开始时间)
+        self._running = {}
+        # 各类任务的平均耗时(秒), 用于估算排队等待时间
+        self._durations = {}
+        # 执行中的可缓存任务: cache_key -> task_id, task_id -> cache_key
+        self._inflight = {}
+        self._inflight_keys = {}
+        
+        # 进程池后端(按需创建)
+        self._process_pool = None
+        self._progress_queue = None
+        
         self._init_db()
     
+    def _get_conn(self):
+        """获取当前线程的持久连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+    
     def _init_db(self):
         """初始化SQLite数据库"""
-        with sqlite3.connect(self.db_path) as conn:
+        conn = self._get_conn()
+        with conn:
             conn.execute('''
                 CREATE TABLE IF NOT EXISTS tasks (
                     task_id TEXT PRIMARY KEY,
@@ -31,18 +103,92 @@ class TaskManager:
                     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
             ''')
-            conn.commit()
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_tasks_updated_at ON tasks(updated_at)')
     
     def submit_task(self, func, *args, **kwargs):
         """提交异步任务"""
-        # 检查是否超过并发限制
+        return self._enqueue(func, args, kwargs)
+    
+    def submit_cached_task(self, cache_key, func, *args, **kwargs):
+        """提交可缓存的任务
+        
+        cache_key由result_cache.make_key生成(为None时等同submit_task)。
+        缓存命中时任务直接记为COMPLETED; 相同cache_key的任务正在排队或执行时
+        返回该任务的task_id, 不重复执行。
+        """
+        if cache_key is None:
+            return self.submit_task(func, *args, **kwargs)
+        
+        with self.lock:
+            task_id = self._inflight.get(cache_key)
+        if task_id:
+            return task_id
+        
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            task_id = str(uuid.uuid4())
+            self._create_task(task_id)
+            self._update_task(task_id, 'COMPLETED', 100, result=cached)
+            return task_id
+        
+        return self._enqueue(func, args, kwargs, cache_key=cache_key)
+    
+    def _enqueue(self, func, args, kwargs, cache_key=None):
+        """创建任务记录并加入等待队列"""
         with self.lock:
-            if self.active_tasks >= self.max_workers:
+            # 仅当没有空闲worker且队列已满时拒绝
+            if self.active_tasks >= self.max_workers and len(self._queue) >= self.queue_depth:
                 raise Exception("服务繁忙,请稍后再试")
-            self.active_tasks += 1
+            
+            if cache_key is not None:
+                # 检查与登记之间可能已有相同任务提交
+                existing = self._inflight.get(cache_key)
+                if existing:
+                    return existing
+                task_id = str(uuid.uuid4())
+                self._inflight[cache_key] = task_id
+                self._inflight_keys[task_id] = cache_key
+            else:
+                task_id = str(uuid.uuid4())
+        
+        self._create_task(task_id, stream=bool(kwargs.get('stream')))
         
-        task_id = str(uuid.uuid4())
-        self._create_task(task_id)
+        priority = Config.TASK_PRIORITIES.get(func.__name__, Config.TASK_DEFAULT_PRIORITY)
+        with self.lock:
+            heapq.heappush(self._queue, (priority, next(self._seq), task_id, func, args, kwargs))
+        
+        self._dispatch_next()
+        return task_id
+    
+    def _dispatch_next(self):
+        """有空闲worker时按优先级取出排队任务执行"""
+        while True:
+            with self.lock:
+                if self.active_tasks >= self.max_workers or not self._queue:
+                    return
+                _, _, task_id, func, args, kwargs = heapq.heappop(self._queue)
+                self.active_tasks += 1
+                self._running[task_id] = (func.__name__, time.time())
+            
+            self._start_task(task_id, func, args, kwargs)
+    
+    def _on_task_finished(self, task_id):
+        """任务结束: 记录耗时, 释放worker并调度下一个任务"""
+        with self.lock:
+            self.active_tasks -= 1
+            name, started = self._running.pop(task_id, (None, None))
+            if name:
+                elapsed = time.time() - started
+                previous = self._durations.get(name)
+                self._durations[name] = elapsed if previous is None else previous * 0.7 + elapsed * 0.3
+        
+        self._dispatch_next()
+    
+    def _start_task(self, task_id, func, args, kwargs):
+        """在当前后端上执行任务"""
+        if self._get_backend() == 'process':
+            self._submit_to_process(task_id, func, args, kwargs)
+            return
         
         def wrapper():
             try:
@@ -54,79 +200,304 @@ class TaskManager:
                 self._update_task(task_id, 'FAILED', 0, error=str(e))
                 raise
             finally:
-                with self.lock:
-                    self.active_tasks -= 1
+                self._on_task_finished(task_id)
         
         self.executor.submit(wrapper)
-        return task_id
     
-    def _create_task(self, task_id):
-        """创建任务记录"""
+    def _get_backend(self):
+        """当前执行后端: thread 或 process"""
+        return settings.get('task_backend') or Config.TASK_BACKEND
+    
+    def _submit_to_process(self, task_id, func, args, kwargs):
+        """提交任务到进程池"""
+        self._update_task(task_id, 'PROCESSING', 0)
+        
+        try:
+            pool = self._get_process_pool()
+            future = pool.submit(func, task_id, *args, **kwargs)
+        except Exception as e:
+            self._update_task(task_id, 'FAILED', 0, error=f"任务提交失败: {str(e)}")
+            self._on_task_finished(task_id)
+            return
+        
+        future.add_done_callback(
+            lambda f: self._on_process_done(task_id, pool, f)
+        )
+    
+    def _on_process_done(self, task_id, pool, future):
+        """进程池任务结束回调"""
+        try:
+            result = future.result()
+            self._update_task(task_id, 'COMPLETED', 100, result=json.dumps(result))
+        except BrokenProcessPool:
+            self._discard_process_pool(pool)
+            self._update_task(task_id, 'FAILED', 0, error="任务进程异常退出(可能超出内存限制)")
+        except MemoryError:
+            self._update_task(task_id, 'FAILED', 0, error="任务超出内存限制")
+        except Exception as e:
+            self._update_task(task_id, 'FAILED', 0, error=str(e))
+        finally:
+            self._on_task_finished(task_id)
+    
+    def _get_process_pool(self):
+        """获取进程池, 每个工作进程处理WORKER_MAX_TASKS个任务后单独替换(Python 3.11+)"""
         with self.lock:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.execute(
-                    'INSERT INTO tasks (task_id, status, progress) VALUES (?, ?, ?)',
-                    (task_id, 'PENDING', 0)
+            if self._process_pool is None:
+                ctx = multiprocessing.get_context('spawn')
+                if self._progress_queue is None:
+                    self._progress_queue = ctx.Queue()
+                    threading.Thread(target=self._drain_progress_queue, daemon=True).start()
+                
+                options = {}
+                if sys.version_info >= (3, 11) and Config.WORKER_MAX_TASKS:
+                    options['max_tasks_per_child'] = Config.WORKER_MAX_TASKS
+                
+                self._process_pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=ctx,
+                    initializer=_init_worker,
+                    initargs=(self._progress_queue, Config.WORKER_MEMORY_LIMIT_MB),
+                    **options
                 )
-                conn.commit()
+            
+            return self._process_pool
+    
+    def _discard_process_pool(self, pool):
+        """进程池损坏后丢弃, 下次提交时重建"""
+        with self.lock:
+            if self._process_pool is pool:
+                self._process_pool = None
+        pool.shutdown(wait=False)
+    
+    def _drain_progress_queue(self):
+        """接收工作进程回传的进度"""
+        while True:
+            try:
+                task_id, progress = self._progress_queue.get()
+                self.update_progress(task_id, progress)
+            except Exception as e:
+                print(f"处理任务进度失败: {e}")
+    
+    def _create_task(self, task_id, stream=False):
+        """创建任务记录(stream表示结果按task_id写入NDJSON文件)"""
+        conn = self._get_conn()
+        with conn:
+            conn.execute(
+                'INSERT INTO tasks (task_id, status, progress) VALUES (?, ?, ?)',
+                (task_id, 'QUEUED', 0)
+            )
+        self._publish(task_id, 'QUEUED', 0)
+        with self._events_cond:
+            self._events[task_id]['stream'] = stream
     
     def _update_task(self, task_id, status, progress, result=None, error=None):
         """更新任务状态"""
         with self.lock:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.execute('''
-                    UPDATE tasks 
-                    SET status=?, progress=?, result=?, error=?, updated_at=CURRENT_TIMESTAMP 
-                    WHERE task_id=?
-                ''', (status, progress, result, error, task_id))
-                conn.commit()
+            if status == 'PROCESSING':
+                self._progress_cache[task_id] = [progress, progress, time.monotonic()]
+            else:
+                self._progress_cache.pop(task_id, None)
+            
+            cache_key = None
+            if status in ('COMPLETED', 'FAILED'):
+                cache_key = self._inflight_keys.pop(task_id, None)
+        
+        if cache_key is not None and status == 'COMPLETED' and result is not None:
+            result_cache.put(cache_key, result)
+        
+        conn = self._get_conn()
+        with conn:
+            conn.execute('''
+                UPDATE tasks 
+                SET status=?, progress=?, result=?, error=?, updated_at=CURRENT_TIMESTAMP 
+                WHERE task_id=?
+            ''', (status, progress, result, error, task_id))
+        self._publish(task_id, status, progress, result=result, error=error)
+        
+        if cache_key is not None:
+            # 写入结果后再解除登记, 之后的相同提交可直接命中缓存
+            with self.lock:
+                self._inflight.pop(cache_key, None)
     
     def update_progress(self, task_id, progress):
-        """更新任务进度"""
+        """更新任务进度
+        
+        写库经过节流: 距上次写入不足TASK_PROGRESS_MIN_INTERVAL秒且增幅小于
+        TASK_PROGRESS_MIN_STEP时只更新内存, 查询状态时会合并内存中的最新进度。
+        """
+        # 在进程池工作进程中, 进度交由主进程写入
+        if _worker_progress_queue is not None:
+            _worker_progress_queue.put((task_id, progress))
+            return
+        
+        self._publish(task_id, progress=progress)
+        
+        now = time.monotonic()
         with self.lock:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.execute(
-                    'UPDATE tasks SET progress=?, updated_at=CURRENT_TIMESTAMP WHERE task_id=?',
-                    (progress, task_id)
-                )
-                conn.commit()
+            # 任务已结束(进程池的进度可能晚于结束回调到达)时不再记录
+            state = self._progress_cache.get(task_id)
+            if state is None:
+                return
+            state[0] = progress
+            if (progress < 100
+                    and progress - state[1] < Config.TASK_PROGRESS_MIN_STEP
+                    and now - state[2] < Config.TASK_PROGRESS_MIN_INTERVAL):
+                return
+            state[1] = progress
+            state[2] = now
+        
+        conn = self._get_conn()
+        with conn:
+            conn.execute(
+                "UPDATE tasks SET progress=?, updated_at=CURRENT_TIMESTAMP WHERE task_id=? AND status='PROCESSING'",
+                (progress, task_id)
+            )
     
     def get_task_status(self, task_id):
         """获取任务状态"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute(
-                'SELECT task_id, status, progress, result, error FROM tasks WHERE task_id=?',
-                (task_id,)
-            )
-            row = cursor.fetchone()
+        conn = self._get_conn()
+        cursor = conn.execute(
+            'SELECT task_id, status, progress, result, error FROM tasks WHERE task_id=?',
+            (task_id,)
+        )
+        row = cursor.fetchone()
+        
+        if row:
+            result_data = None
+            if row[3]:
+                try:
+                    result_data = json.loads(row[3])
+                except:
+                    result_data = row[3]
             
-            if row:
-                result_data = None
-                if row[3]:
-                    try:
-                        result_data = json.loads(row[3])
-                    except:
-                        result_data = row[3]
-                
-                return {
-                    'task_id': row[0],
-                    'status': row[1],
-                    'progress': row[2],
-                    'result': result_data,
-                    'error': row[4]
-                }
-            return None
+            progress = row[2]
+            if row[1] == 'PROCESSING':
+                with self.lock:
+                    state = self._progress_cache.get(task_id)
+                    if state:
+                        progress = max(progress, state[0])
+            
+            status = {
+                'task_id': row[0],
+                'status': row[1],
+                'progress': progress,
+                'result': result_data,
+                'error': row[4]
+            }
+            if row[1] == 'QUEUED':
+                status.update(self.get_queue_info(task_id))
+            return status
+        return None
+    
+    def _publish(self, task_id, status=None, progress=0, result=None, error=None):
+        """更新内存中的状态快照并唤醒等待者
+        
+        status为None时只更新进度。result保存原始JSON文本, 推送时不再解析。
+        """
+        with self._events_cond:
+            event = self._events.get(task_id)
+            if event is None:
+                if status is None:
+                    return
+                event = self._events[task_id] = {'version': 0}
+            elif event['status'] in ('COMPLETED', 'FAILED'):
+                return
+            
+            if status is None:
+                event['progress'] = progress
+            else:
+                event.update(
+                    status=status, progress=progress, result=result,
+                    error=error, updated=time.monotonic()
+                )
+            event['version'] += 1
+            self._events_cond.notify_all()
+    
+    def wait_for_update(self, task_id, since_version=0, timeout=0):
+        """等待任务状态版本超过since_version, 超时则返回当前快照
+        
+        任务已结束时立即返回; 快照不存在(如服务重启前的任务)时返回None。
+        """
+        deadline = time.monotonic() + timeout
+        with self._events_cond:
+            while True:
+                event = self._events.get(task_id)
+                if event is None:
+                    return None
+                if event['version'] > since_version or event['status'] in ('COMPLETED', 'FAILED'):
+                    return dict(event)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return dict(event)
+                self._events_cond.wait(remaining)
+    
+    def format_event(self, task_id, event):
+        """将状态快照序列化为与get_task_status一致的JSON文本"""
+        payload = {
+            'task_id': task_id,
+            'status': event['status'],
+            'progress': event['progress'],
+            'error': event['error'],
+            'version': event['version']
+        }
+        if event['status'] == 'QUEUED':
+            payload.update(self.get_queue_info(task_id))
+        
+        text = json.dumps(payload, ensure_ascii=False)
+        # 结果已是JSON文本, 直接拼接避免重复解析
+        return f'{text[:-1]}, "result": {event["result"] or "null"}}}'
+    
+    def is_busy(self):
+        """是否有正在执行或排队的任务(后台预热等低优先级工作据此让路)"""
+        with self.lock:
+            return self.active_tasks > 0 or bool(self._queue)
+    
+    def get_queue_info(self, task_id):
+        """排队位置及预计开始时间"""
+        default_duration = Config.TASK_DEFAULT_DURATION
+        now = time.time()
+        
+        with self.lock:
+            ordered = sorted(self._queue)
+            # 每个worker预计空闲的时刻(相对现在的秒数)
+            slots = [
+                max(0, self._durations.get(name, default_duration) - (now - started))
+                for name, started in self._running.values()
+            ]
+            slots += [0] * max(0, self.max_workers - len(slots))
+            
+            for position, (_, _, queued_id, func, _, _) in enumerate(ordered, 1):
+                heapq.heapify(slots)
+                start_in = heapq.heappop(slots)
+                if queued_id == task_id:
+                    return {
+                        'queue_position': position,
+                        'queue_length': len(ordered),
+                        'estimated_wait_seconds': round(start_in, 1),
+                        'estimated_start': (datetime.now() + timedelta(seconds=start_in)).isoformat(timespec='seconds')
+                    }
+                heapq.heappush(slots, start_in + self._durations.get(func.__name__, default_duration))
+        
+        return {}
     
     def cleanup_old_tasks(self, max_age_hours=3):
-        """清理旧任务记录"""
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute('''
-                DELETE FROM tasks 
-                WHERE updated_at < datetime('now', '-{} hours')
-            '''.format(max_age_hours))
-            deleted = conn.total_changes
-            conn.commit()
-        return deleted
+        """清理旧任务记录(updated_at有索引, 不再全表扫描)"""
+        # 已结束任务的内存快照保留TASK_EVENT_RETENTION秒
+        expire_before = time.monotonic() - Config.TASK_EVENT_RETENTION
+        with self._events_cond:
+            for task_id in [
+                tid for tid, event in self._events.items()
+                if event['status'] in ('COMPLETED', 'FAILED') and event['updated'] < expire_before
+            ]:
+                del self._events[task_id]
+        
+        conn = self._get_conn()
+        with conn:
+            cursor = conn.execute(
+                "DELETE FROM tasks WHERE updated_at < datetime('now', ?)",
+                (f'-{int(max_age_hours)} hours',)
+            )
+        return cursor.rowcount
 
 # 全局实例
 task_manager = TaskManager()
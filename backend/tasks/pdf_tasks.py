@@ -1,7 +1,10 @@
 """PDF处理异步任务"""
+import json
 from services.pdf_service import PDFService
 from services.enhanced_pdf_service import EnhancedPDFService
 from task_manager import task_manager
+from utils.file_handler import get_result_stream_path
+from services.virtual_document import VirtualDocumentService
 
 def _get_progress_callback(task_id):
     """生成进度回调函数"""
@@ -9,58 +12,93 @@ def _get_progress_callback(task_id):
         task_manager.update_progress(task_id, progress)
     return progress_callback
 
-def extract_text_task(task_id, file_id, pages=None):
+def _ensure_real_file(*file_ids):
+    """任务需要实际文件: 虚拟文档在此时才生成PDF"""
+    for file_id in file_ids:
+        VirtualDocumentService.materialize(file_id)
+
+def _stream_to_ndjson(task_id, records):
+    """将逐页结果写入NDJSON文件, 每条记录写入后立即刷新, 客户端可边处理边读取"""
+    count = 0
+    with open(get_result_stream_path(task_id), 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            f.flush()
+            count += 1
+    
+    return {
+        'stream': True,
+        'stream_url': f'/api/task-stream/{task_id}',
+        'records': count
+    }
+
+def extract_text_task(task_id, file_id, pages=None, stream=False):
     """文字提取任务(基础版)"""
+    _ensure_real_file(file_id)
+    if stream:
+        return _stream_to_ndjson(task_id, PDFService.iter_text(
+            file_id, pages, progress_callback=_get_progress_callback(task_id)))
     result = PDFService.extract_text(file_id, pages, progress_callback=_get_progress_callback(task_id))
     return result
 
-def extract_text_enhanced_task(task_id, file_id, pages=None):
+def extract_text_enhanced_task(task_id, file_id, pages=None, backend=None, force_table_detection=False):
     """文字提取任务(增强版-保留排版)"""
+    _ensure_real_file(file_id)
     # 增强版暂不支持细粒度进度，先模拟
     cb = _get_progress_callback(task_id)
     cb(10)
-    result = EnhancedPDFService.extract_structured_content(file_id, pages)
+    result = EnhancedPDFService.extract_structured_content(file_id, pages, backend=backend,
+                                                           force_table_detection=force_table_detection)
     cb(90)
     return result
 
-def extract_text_clean_task(task_id, file_id, pages=None):
+def extract_text_clean_task(task_id, file_id, pages=None, stream=False, backend=None):
     """文字提取任务(清理版-移除多余换行)"""
+    _ensure_real_file(file_id)
     cb = _get_progress_callback(task_id)
-    cb(10)
-    result = EnhancedPDFService.extract_text_clean(file_id, pages)
-    cb(90)
-    return result
+    if stream:
+        return _stream_to_ndjson(task_id, EnhancedPDFService.iter_text_clean(file_id, pages, progress_callback=cb,
+                                                                             backend=backend))
+    return EnhancedPDFService.extract_text_clean(file_id, pages, progress_callback=cb, backend=backend)
 
-def extract_tables_task(task_id, file_id, pages=None):
+def extract_tables_task(task_id, file_id, pages=None, stream=False, backend=None, force_table_detection=False):
     """表格提取任务"""
+    _ensure_real_file(file_id)
     cb = _get_progress_callback(task_id)
-    cb(10)
-    result = EnhancedPDFService.extract_tables_only(file_id, pages)
-    cb(90)
-    return result
+    if stream:
+        return _stream_to_ndjson(task_id, EnhancedPDFService.iter_tables(
+            file_id, pages, progress_callback=cb, backend=backend, force_table_detection=force_table_detection))
+    return EnhancedPDFService.extract_tables_only(file_id, pages, progress_callback=cb, backend=backend,
+                                                  force_table_detection=force_table_detection)
 
-def extract_images_task(task_id, file_id, pages=None, export_path=None):
+def extract_images_task(task_id, file_id, pages=None, export_path=None, min_dimension=None, min_size=None):
     """图片提取任务"""
-    result = PDFService.extract_images(file_id, pages, export_path, progress_callback=_get_progress_callback(task_id))
+    _ensure_real_file(file_id)
+    result = PDFService.extract_images(file_id, pages, export_path, progress_callback=_get_progress_callback(task_id),
+                                       min_dimension=min_dimension, min_size=min_size, task_id=task_id)
     return result
 
-def delete_pages_task(task_id, file_id, pages_to_delete):
+def delete_pages_task(task_id, file_id, pages_to_delete, compact=False):
     """删除页面任务"""
-    result = PDFService.delete_pages(file_id, pages_to_delete, progress_callback=_get_progress_callback(task_id))
+    _ensure_real_file(file_id)
+    result = PDFService.delete_pages(file_id, pages_to_delete, progress_callback=_get_progress_callback(task_id), compact=compact)
     return result
 
-def rotate_pages_task(task_id, file_id, rotations):
+def rotate_pages_task(task_id, file_id, rotations, compact=False):
     """旋转页面任务"""
-    result = PDFService.rotate_pages(file_id, rotations, progress_callback=_get_progress_callback(task_id))
+    _ensure_real_file(file_id)
+    result = PDFService.rotate_pages(file_id, rotations, progress_callback=_get_progress_callback(task_id), compact=compact)
     return result
 
-def merge_pdfs_task(task_id, file_ids):
+def merge_pdfs_task(task_id, sources):
     """合并PDF任务"""
-    result = PDFService.merge_pdfs(file_ids, progress_callback=_get_progress_callback(task_id))
+    _ensure_real_file(*[s if isinstance(s, str) else s['file_id'] for s in sources])
+    result = PDFService.merge_pdfs(sources, progress_callback=_get_progress_callback(task_id))
     return result
 
 def encrypt_pdf_task(task_id, file_id, user_password, owner_password=None):
     """加密PDF任务"""
+    _ensure_real_file(file_id)
     # 加密通常很快，简单处理
     cb = _get_progress_callback(task_id)
     cb(50)
@@ -69,6 +107,7 @@ def encrypt_pdf_task(task_id, file_id, user_password, owner_password=None):
 
 def decrypt_pdf_task(task_id, file_id, password):
     """解密PDF任务"""
+    _ensure_real_file(file_id)
     cb = _get_progress_callback(task_id)
     cb(50)
     result = PDFService.decrypt_pdf(file_id, password)
@@ -76,6 +115,7 @@ def decrypt_pdf_task(task_id, file_id, password):
 
 def convert_to_word_task(task_id, file_id, pages=None, export_path=None):
     """PDF转Word任务"""
+    _ensure_real_file(file_id)
     from services.pdf2word_service import PDF2WordService
     result = PDF2WordService.convert_to_word(file_id, pages, export_path, progress_callback=_get_progress_callback(task_id))
     return result
@@ -0,0 +1,204 @@
+"""PDF文档句柄池 - 复用已解析的fitz/pdfplumber文档"""
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from config import Config
+from utils.file_handler import get_file_path
+from utils.plumber_pages import clear_parser_caches
+
+# 按文件大小估算内存占用的系数(pdfplumber会缓存页面对象, 占用明显更高)
+_MEMORY_FACTORS = {
+    'fitz': 1.5,
+    'plumber': 4.0
+}
+
+
+def _open_document(kind, filepath):
+    if kind == 'fitz':
+        import fitz
+        return fitz.open(filepath)
+    if kind == 'plumber':
+        import pdfplumber
+        return pdfplumber.open(filepath)
+    raise ValueError(f"未知的文档类型: {kind}")
+
+
+def _trim_document(kind, doc):
+    """归还时释放pdfplumber已缓存的页面对象和pdfminer的解析缓存"""
+    if kind != 'plumber':
+        return
+    for page in getattr(doc, '_pages', None) or []:
+        try:
+            page.flush_cache()
+            if hasattr(page, 'get_textmap'):
+                page.get_textmap.cache_clear()
+        except Exception:
+            pass
+    clear_parser_caches(doc)
+
+
+class _PooledDocument:
+    """池中的单个文档句柄"""
+
+    def __init__(self, key, doc, size):
+        self.key = key
+        self.doc = doc
+        self.size = size
+        self.refs = 0
+        self.owner = None
+        self.stale = False
+
+
+class DocumentPool:
+    """文档句柄池
+
+    以(类型, file_id, 目录, 文件修改时间)为键缓存已打开的文档。
+    同一句柄同一时刻只被一个线程持有(同线程可重入, 引用计数),
+    其他线程借用时会打开新的句柄。空闲句柄按LRU在内存预算内淘汰。
+    """
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes or Config.DOC_POOL_MAX_MB * 1024 * 1024
+        self.lock = threading.Lock()
+        self._entries = OrderedDict()  # _PooledDocument -> None, 按最近使用排序
+        self._current_bytes = 0
+        self.stats = {'hits': 0, 'opens': 0, 'evictions': 0}
+
+    @contextmanager
+    def borrow(self, file_id, folder='temp', kind='fitz', writable=False):
+        """借用文档句柄
+
+        writable=True时调用方可以修改文档, 句柄归还后直接关闭, 不再复用。
+        """
+        filepath = get_file_path(file_id, folder)
+        try:
+            mtime = os.path.getmtime(filepath)
+        except (OSError, TypeError):
+            raise FileNotFoundError("PDF文件不存在")
+
+        entry = self._acquire((kind, file_id, folder, mtime), filepath, writable)
+        try:
+            yield entry.doc
+        finally:
+            self._release(entry, discard=writable)
+
+    def _acquire(self, key, filepath, writable):
+        tid = threading.get_ident()
+
+        with self.lock:
+            candidate = None
+            for entry in self._entries:
+                if entry.key[:3] == key[:3] and entry.key != key:
+                    # 文件已被替换, 旧句柄作废
+                    entry.stale = True
+                    continue
+                if entry.key != key or entry.stale:
+                    continue
+                if entry.owner == tid and not writable:
+                    candidate = entry
+                    break
+                if entry.refs == 0 and candidate is None:
+                    candidate = entry
+
+            if candidate is not None:
+                candidate.refs += 1
+                candidate.owner = tid
+                self.stats['hits'] += 1
+                if writable:
+                    self._detach(candidate)
+                else:
+                    self._entries.move_to_end(candidate)
+                return candidate
+
+        doc = _open_document(key[0], filepath)
+        size = int(os.path.getsize(filepath) * _MEMORY_FACTORS.get(key[0], 1))
+        entry = _PooledDocument(key, doc, size)
+        entry.refs = 1
+        entry.owner = tid
+
+        with self.lock:
+            self.stats['opens'] += 1
+            if not writable:
+                self._entries[entry] = None
+                self._current_bytes += size
+        return entry
+
+    def _release(self, entry, discard=False):
+        to_close = []
+        with self.lock:
+            entry.refs -= 1
+            if entry.refs > 0:
+                return
+            entry.owner = None
+
+            if discard or entry.stale or entry not in self._entries:
+                self._detach(entry)
+                to_close.append(entry)
+            else:
+                _trim_document(entry.key[0], entry.doc)
+
+            to_close.extend(self._evict())
+
+        for item in to_close:
+            self._close(item)
+
+    def _detach(self, entry):
+        """从池中移除(需持有锁)"""
+        if entry in self._entries:
+            del self._entries[entry]
+            self._current_bytes -= entry.size
+
+    def _evict(self):
+        """淘汰超出预算的空闲句柄(需持有锁), 返回待关闭的句柄"""
+        evicted = []
+        for entry in list(self._entries):
+            if entry.refs == 0 and entry.stale:
+                self._detach(entry)
+                evicted.append(entry)
+
+        for entry in list(self._entries):
+            if self._current_bytes <= self.max_bytes:
+                break
+            if entry.refs == 0:
+                self._detach(entry)
+                evicted.append(entry)
+                self.stats['evictions'] += 1
+        return evicted
+
+    @staticmethod
+    def _close(entry):
+        try:
+            entry.doc.close()
+        except Exception:
+            pass
+
+    def invalidate(self, file_id, folder=None):
+        """文件被删除或替换时调用, 关闭其空闲句柄"""
+        to_close = []
+        with self.lock:
+            for entry in list(self._entries):
+                if entry.key[1] != file_id or (folder and entry.key[2] != folder):
+                    continue
+                if entry.refs == 0:
+                    self._detach(entry)
+                    to_close.append(entry)
+                else:
+                    entry.stale = True
+
+        for entry in to_close:
+            self._close(entry)
+        return len(to_close)
+
+    def get_stats(self):
+        """句柄池统计信息"""
+        with self.lock:
+            return {
+                **self.stats,
+                'open_documents': len(self._entries),
+                'in_use': sum(1 for e in self._entries if e.refs > 0),
+                'estimated_mb': round(self._current_bytes / 1024 / 1024, 2)
+            }
+
+# 全局实例
+document_pool = DocumentPool()
@@ -1,9 +1,14 @@
 import os
 import uuid
+import hashlib
 import magic
 from datetime import datetime, timedelta
 from werkzeug.utils import secure_filename
 from config import Config
+from utils.preview_cache import preview_cache, analysis_cache
+from utils.upload_index import upload_index
+
+UPLOAD_CHUNK_SIZE = 64 * 1024
 
 def allowed_file(filename):
     """检查文件类型是否允许"""
@@ -25,20 +30,47 @@ def validate_pdf(file_stream):
         return False
 
 def save_upload_file(file, file_id=None):
-    """保存上传的PDF文件"""
+    """保存上传的PDF文件
+    
+    写盘的同时计算SHA-256, 内容与已有文件相同时删除本次副本,
+    直接复用已有的file_id(deduplicated=True)。
+    """
     if not file_id:
         file_id = str(uuid.uuid4())
     
     filename = secure_filename(file.filename)
     filepath = os.path.join(Config.TEMP_FOLDER, f"{file_id}.pdf")
     
-    file.save(filepath)
+    sha256 = hashlib.sha256()
+    with open(filepath, 'wb') as f:
+        while True:
+            chunk = file.stream.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            sha256.update(chunk)
+            f.write(chunk)
+    
+    return register_upload(file_id, filepath, filename, sha256.hexdigest())
+
+def register_upload(file_id, filepath, filename, sha256):
+    """登记已写入临时目录的上传文件, 内容重复时改用已有文件"""
+    existing = upload_index.lookup(sha256)
+    if existing and existing['file_id'] != file_id:
+        os.remove(filepath)
+        file_id = existing['file_id']
+        filepath = get_file_path(file_id)
+        deduplicated = True
+    else:
+        upload_index.register(sha256, file_id, os.path.getsize(filepath))
+        deduplicated = False
     
     return {
         'file_id': file_id,
         'original_filename': filename,
         'storage_path': filepath,
         'file_size': os.path.getsize(filepath),
+        'sha256': sha256,
+        'deduplicated': deduplicated,
         'upload_time': datetime.now().isoformat()
     }
 
@@ -50,11 +82,42 @@ def get_file_path(file_id, folder='temp'):
         return os.path.join(Config.PROCESSED_FOLDER, f"{file_id}.pdf")
     return None
 
+def get_result_stream_path(task_id):
+    """获取流式任务结果(NDJSON)文件路径"""
+    return os.path.join(Config.PROCESSED_FOLDER, f"{task_id}.ndjson")
+
+def collect_result_files(task_id, result, include_thumbnails=True):
+    """收集任务结果引用的输出文件, 返回[(归档内文件名, 磁盘路径)]"""
+    files = []
+    if not isinstance(result, dict):
+        return files
+    
+    for image in result.get('images') or []:
+        files.append((f"images/{image['filename']}", image['path']))
+        if include_thumbnails and image.get('thumbnail'):
+            files.append((f"thumbnails/{image['thumbnail']}",
+                          os.path.join(Config.PROCESSED_FOLDER, image['thumbnail'])))
+    
+    if result.get('saved_path'):
+        files.append((os.path.basename(result['saved_path']), result['saved_path']))
+    elif result.get('output_file_id'):
+        filename = result.get('output_filename') or f"{result['output_file_id']}.pdf"
+        files.append((filename, os.path.join(Config.PROCESSED_FOLDER, filename)))
+    
+    if result.get('stream'):
+        files.append(('results.ndjson', get_result_stream_path(task_id)))
+    
+    return [(arcname, path) for arcname, path in files if os.path.isfile(path)]
+
 def delete_file(file_id, folder='temp'):
     """删除文件"""
     filepath = get_file_path(file_id, folder)
     if filepath and os.path.exists(filepath):
+        from utils.document_pool import document_pool
+        document_pool.invalidate(file_id, folder)
         os.remove(filepath)
+        if folder == 'temp':
+            upload_index.forget(file_id)
         return True
     return False
 
@@ -77,13 +140,25 @@ def cleanup_old_files(max_age_minutes=None):
             if not os.path.isfile(filepath):
                 continue
             
-            # 检查文件修改时间
-            file_mtime = datetime.fromtimestamp(os.path.getmtime(filepath))
+            # 检查文件修改时间(重复上传的源PDF以最近一次上传时间为准)
+            last_used = os.path.getmtime(filepath)
+            if folder == Config.TEMP_FOLDER and filename.endswith('.pdf'):
+                last_used = max(last_used, upload_index.last_seen(os.path.splitext(filename)[0]))
+            file_mtime = datetime.fromtimestamp(last_used)
             if now - file_mtime > timedelta(minutes=max_age_minutes):
                 file_size = os.path.getsize(filepath)
                 os.remove(filepath)
                 deleted_count += 1
                 freed_space += file_size
+                
+                # 源PDF过期时同步清除其预览缓存和已打开的文档句柄
+                if folder == Config.TEMP_FOLDER and filename.endswith('.pdf'):
+                    from utils.document_pool import document_pool
+                    file_id = os.path.splitext(filename)[0]
+                    preview_cache.invalidate(file_id)
+                    analysis_cache.invalidate(file_id)
+                    document_pool.invalidate(file_id)
+                    upload_index.forget(file_id)
     
     return {
         'deleted_count': deleted_count,
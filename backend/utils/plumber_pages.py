@@ -0,0 +1,80 @@
+"""pdfplumber恒定内存模式 - 按需逐页创建页面, 处理完即释放解析缓存"""
+
+
+def clear_parser_caches(pdf):
+    """清空pdfminer在文档级别缓存的对象和字体
+
+    PDFDocument按对象号缓存已解析的对象(包括对象流), PDFResourceManager
+    缓存已加载的字体, 两者都会随处理的页数增长且不会自动释放。
+    清空后再次用到时重新解析, 结果不变。
+    """
+    doc = getattr(pdf, 'doc', None)
+    for name in ('_cached_objs', '_parsed_objs'):
+        cache = getattr(doc, name, None)
+        if cache is not None:
+            cache.clear()
+
+    fonts = getattr(getattr(pdf, 'rsrcmgr', None), '_cached_fonts', None)
+    if fonts is not None:
+        fonts.clear()
+
+
+class LazyPages:
+    """按需创建的pdfplumber页面序列
+
+    pdf.pages首次访问时会为全部页面创建Page对象并一直持有, 每个被处理过的
+    Page又缓存着自己的解析结果。这里沿页面树顺序遍历, 只为请求的页码创建
+    Page, 不保留引用; 页码递增访问时整个文档只遍历一次页面树。
+    """
+
+    def __init__(self, pdf):
+        self.pdf = pdf
+        self._page_objs = None
+        self._next_index = 0
+        self._count = None
+
+    def __len__(self):
+        if self._count is None:
+            from pdfminer.pdftypes import resolve1
+            try:
+                self._count = int(resolve1(self.pdf.doc.catalog['Pages'])['Count'])
+            except (KeyError, TypeError, ValueError):
+                self._count = len(self.pdf.pages)
+        return self._count
+
+    def __getitem__(self, index):
+        from pdfminer.pdfpage import PDFPage
+        from pdfplumber.page import Page
+
+        if index < 0:
+            index += len(self)
+        if self._page_objs is None or index < self._next_index:
+            # 向前访问时从头重新遍历
+            self._page_objs = PDFPage.create_pages(self.pdf.doc)
+            self._next_index = 0
+
+        for page_obj in self._page_objs:
+            current = self._next_index
+            self._next_index += 1
+            if current == index:
+                return Page(self.pdf, page_obj, page_number=index + 1)
+        raise IndexError(f"页码超出范围: {index + 1}")
+
+
+class ConstantMemoryPDF:
+    """恒定内存模式的pdfplumber文档包装
+
+    pages为LazyPages; 每页处理完调用release_page, 同时释放页面和文档级别的
+    解析缓存, 内存占用取决于单页而不是已处理的页数。
+    """
+
+    def __init__(self, pdf):
+        self.pdf = pdf
+        self.pages = LazyPages(pdf)
+
+    def release_page(self, page):
+        if hasattr(page, 'close'):
+            page.close()
+        else:
+            page.flush_cache()
+        clear_parser_caches(self.pdf)
@@ -0,0 +1,144 @@
+"""预览图缓存 - 内存LRU + 磁盘两级缓存"""
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from config import Config
+
+
+class PreviewCache:
+    """渲染结果两级缓存
+
+    内存层为按字节数限制的LRU, 磁盘层存放在处理目录下(以prefix为文件名前缀),
+    过期由cleanup_old_files统一处理。
+    缓存键包含源文件修改时间, 源文件变化后旧条目自然失效。
+    """
+
+    def __init__(self, max_bytes=None, disk_dir=None, prefix='preview'):
+        self.max_bytes = max_bytes or Config.PREVIEW_CACHE_MAX_MB * 1024 * 1024
+        self.disk_dir = disk_dir or Config.PROCESSED_FOLDER
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._current_bytes = 0
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0}
+
+    @staticmethod
+    def make_variant(page_num, dpi, fmt, rotation=None):
+        """生成页面预览的缓存变体名(rotation为覆盖页面自身旋转的角度)"""
+        if rotation is not None:
+            return f"p{page_num}_{dpi}_r{rotation}.{fmt}"
+        return f"p{page_num}_{dpi}.{fmt}"
+
+    @staticmethod
+    def make_tile_variant(page_num, level, x, y, fmt, quality):
+        """生成瓦片的缓存变体名"""
+        return f"t{page_num}_{level}_{x}_{y}_q{quality}.{fmt}"
+    
+    @staticmethod
+    def make_sprite_variant(thumb_width, fmt, quality):
+        """生成缩略图雪碧图的缓存变体名, 索引使用同名.json变体"""
+        return f"sprite_{thumb_width}_q{quality}.{fmt}"
+    
+    @staticmethod
+    def make_etag(file_id, variant, source_mtime):
+        """根据文件、变体和源文件修改时间生成ETag"""
+        raw = f"{file_id}:{variant}:{source_mtime}".encode('utf-8')
+        return hashlib.sha1(raw).hexdigest()
+
+    def _disk_path(self, file_id, variant):
+        return os.path.join(self.disk_dir, f"{self.prefix}_{file_id}_{variant}")
+
+    def get(self, file_id, variant, source_mtime):
+        """读取缓存, 未命中返回None"""
+        key = (file_id, variant, source_mtime)
+        with self.lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self.stats['memory_hits'] += 1
+                return data
+
+        disk_path = self._disk_path(file_id, variant)
+        try:
+            # 磁盘条目早于源文件说明已过时
+            if os.path.getmtime(disk_path) >= source_mtime:
+                with open(disk_path, 'rb') as f:
+                    data = f.read()
+                self._remember(key, data)
+                with self.lock:
+                    self.stats['disk_hits'] += 1
+                return data
+        except OSError:
+            pass
+
+        with self.lock:
+            self.stats['misses'] += 1
+        return None
+
+    def put(self, file_id, variant, source_mtime, data):
+        """写入缓存(内存和磁盘)"""
+        self._remember((file_id, variant, source_mtime), data)
+
+        disk_path = self._disk_path(file_id, variant)
+        tmp_path = f"{disk_path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, disk_path)
+        except OSError as e:
+            print(f"写入预览缓存失败: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _remember(self, key, data):
+        size = len(data)
+        if size > self.max_bytes:
+            return
+
+        with self.lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._current_bytes -= len(old)
+
+            self._entries[key] = data
+            self._current_bytes += size
+
+            while self._current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._current_bytes -= len(evicted)
+
+    def invalidate(self, file_id):
+        """删除某文件的全部缓存条目"""
+        with self.lock:
+            for key in [k for k in self._entries if k[0] == file_id]:
+                self._current_bytes -= len(self._entries.pop(key))
+
+        prefix = f"{self.prefix}_{file_id}_"
+        removed = 0
+        if os.path.exists(self.disk_dir):
+            for filename in os.listdir(self.disk_dir):
+                if filename.startswith(prefix):
+                    try:
+                        os.remove(os.path.join(self.disk_dir, filename))
+                        removed += 1
+                    except OSError:
+                        pass
+        return removed
+
+    def get_stats(self):
+        """缓存统计信息"""
+        with self.lock:
+            hits = self.stats['memory_hits'] + self.stats['disk_hits']
+            total = hits + self.stats['misses']
+            return {
+                **self.stats,
+                'hit_rate': round(hits / total, 3) if total else 0,
+                'memory_entries': len(self._entries),
+                'memory_mb': round(self._current_bytes / 1024 / 1024, 2)
+            }
+
+# 全局实例
+preview_cache = PreviewCache()
+# 页面分析结果单独缓存, 长文档的分析不会把预览图和瓦片挤出内存
+analysis_cache = PreviewCache(max_bytes=Config.ANALYSIS_CACHE_MAX_MB * 1024 * 1024, prefix='analysis')
@@ -0,0 +1,248 @@
+"""任务结果缓存 - 相同文档、相同参数的提取/转换结果直接复用"""
+import os
+import json
+import hashlib
+import threading
+from config import Config
+from utils.file_handler import get_file_path
+from utils.upload_index import upload_index
+
+# 结果格式变化时递增, 使旧缓存全部失效
+CACHE_FORMAT_VERSION = 2
+
+# 影响结果的第三方库
+_VERSIONED_PACKAGES = ('PyMuPDF', 'pdfplumber', 'pdf2docx', 'rapidocr_onnxruntime')
+
+
+def _library_versions():
+    from importlib.metadata import version, PackageNotFoundError
+    versions = {}
+    for package in _VERSIONED_PACKAGES:
+        try:
+            versions[package] = version(package)
+        except PackageNotFoundError:
+            versions[package] = None
+    return versions
+
+
+def _referenced_files(result):
+    """结果中引用的输出文件(命中时需校验仍然存在且未被覆盖)"""
+    if not isinstance(result, dict):
+        return []
+    if result.get('saved_path'):
+        return [result['saved_path']]
+    if result.get('output_file_id') and result.get('output_filename'):
+        return [os.path.join(Config.PROCESSED_FOLDER, result['output_filename'])]
+    return []
+
+
+class ResultCache:
+    """磁盘结果缓存, 按总大小做LRU淘汰
+
+    缓存键 = sha256(文档内容哈希, 操作名, 规范化参数, 库版本)。
+    每个条目一个JSON文件, 以文件修改时间作为最近使用时间。
+    结果引用的输出文件会记录大小和修改时间, 文件被清理或覆盖后条目失效。
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=None):
+        self.cache_dir = cache_dir or os.path.join(Config.DATA_FOLDER, 'result_cache')
+        self.max_bytes = max_bytes or Config.RESULT_CACHE_MAX_MB * 1024 * 1024
+        self.lock = threading.Lock()
+        self._versions = None
+        self._content_hashes = {}  # (file_id, mtime) -> sha256, 未登记上传索引的文件
+        self._current_bytes = None
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def content_hash(self, file_id):
+        """文档内容的SHA-256, 优先使用上传时计算的值"""
+        sha256 = upload_index.get_hash(file_id)
+        if sha256:
+            return sha256
+
+        filepath = get_file_path(file_id)
+        try:
+            key = (file_id, os.path.getmtime(filepath))
+        except (OSError, TypeError):
+            raise FileNotFoundError("PDF文件不存在")
+
+        with self.lock:
+            if key in self._content_hashes:
+                return self._content_hashes[key]
+
+        digest = hashlib.sha256()
+        with open(filepath, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+
+        with self.lock:
+            self._content_hashes[key] = digest.hexdigest()
+            return self._content_hashes[key]
+
+    def make_key(self, file_id, operation, params=None):
+        """生成缓存键, 文件不存在时返回None(交给任务本身报错)"""
+        try:
+            content_hash = self.content_hash(file_id)
+        except FileNotFoundError:
+            return None
+
+        if self._versions is None:
+            self._versions = _library_versions()
+
+        raw = json.dumps({
+            'format': CACHE_FORMAT_VERSION,
+            'content': content_hash,
+            'operation': operation,
+            'params': params or {},
+            'versions': self._versions
+        }, sort_keys=True, ensure_ascii=True)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key):
+        """读取缓存结果(JSON字符串), 未命中或已失效返回None"""
+        path = self._entry_path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            with self.lock:
+                self.stats['misses'] += 1
+            return None
+
+        for filepath, (size, mtime) in entry.get('files', {}).items():
+            try:
+                stat = os.stat(filepath)
+                valid = stat.st_size == size and stat.st_mtime == mtime
+            except OSError:
+                valid = False
+            if not valid:
+                self._remove(path)
+                with self.lock:
+                    self.stats['misses'] += 1
+                return None
+
+        if entry.get('files'):
+            # 输出文件按修改时间过期, 命中时一并续期
+            touched = self._touch_files(entry['files'])
+            if touched is None:
+                # 校验后被清理任务删除
+                self._remove(path)
+                with self.lock:
+                    self.stats['misses'] += 1
+                return None
+            entry['files'] = touched
+            self._write(path, entry)
+        else:
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+
+        with self.lock:
+            self.stats['hits'] += 1
+        return entry['result']
+
+    def put(self, key, result_json):
+        """写入缓存结果(JSON字符串)"""
+        files = {}
+        for filepath in _referenced_files(json.loads(result_json)):
+            try:
+                stat = os.stat(filepath)
+                files[filepath] = (stat.st_size, stat.st_mtime)
+            except OSError:
+                return
+
+        self._write(self._entry_path(key), {'result': result_json, 'files': files})
+        self._evict()
+
+    @staticmethod
+    def _touch_files(files):
+        """刷新输出文件的修改时间, 任一文件已不存在时返回None"""
+        touched = {}
+        for filepath in files:
+            try:
+                os.utime(filepath)
+                stat = os.stat(filepath)
+            except OSError:
+                return None
+            touched[filepath] = (stat.st_size, stat.st_mtime)
+        return touched
+
+    def _write(self, path, entry):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            old_size = os.path.getsize(path) if os.path.exists(path) else 0
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, path)
+            with self.lock:
+                if self._current_bytes is not None:
+                    self._current_bytes += os.path.getsize(path) - old_size
+        except OSError as e:
+            print(f"写入结果缓存失败: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _remove(self, path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        with self.lock:
+            if self._current_bytes is not None:
+                self._current_bytes -= size
+
+    def _list_entries(self):
+        """[(最近使用时间, 大小, 路径)], 按最近使用时间升序"""
+        entries = []
+        if os.path.exists(self.cache_dir):
+            for filename in os.listdir(self.cache_dir):
+                if not filename.endswith('.json'):
+                    continue
+                path = os.path.join(self.cache_dir, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        return entries
+
+    def _evict(self):
+        """总大小超出上限时淘汰最久未使用的条目"""
+        with self.lock:
+            if self._current_bytes is not None and self._current_bytes <= self.max_bytes:
+                return
+
+        entries = self._list_entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                with self.lock:
+                    self.stats['evictions'] += 1
+            except OSError:
+                pass
+
+        with self.lock:
+            self._current_bytes = total
+
+    def get_stats(self):
+        """缓存统计信息"""
+        entries = self._list_entries()
+        with self.lock:
+            return {
+                **self.stats,
+                'entries': len(entries),
+                'size_mb': round(sum(size for _, size, _ in entries) / 1024 / 1024, 2)
+            }
+
+# 全局实例
+result_cache = ResultCache()
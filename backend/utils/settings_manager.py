@@ -6,11 +6,13 @@ class SettingsManager:
     _instance = None
     _settings_file = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'settings.json')
     
-    # 默认设置
+    # 默认设置(与此前随仓库提供的settings.json一致)
     _default_settings = {
-        "enable_ocr": False,
-        "enable_layout_preservation": False,  # 排版复刻(增强提取)
-        "max_workers": 1
+        "enable_ocr": True,
+        "enable_layout_preservation": True,  # 排版复刻(增强提取)
+        "extraction_backend": "pdfplumber",  # 增强提取引擎: pdfplumber 或 mupdf(更快)
+        "max_workers": 1,
+        "task_backend": Config.TASK_BACKEND  # thread 或 process
     }
 
     def __new__(cls):
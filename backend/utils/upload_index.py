@@ -0,0 +1,162 @@
+"""上传内容索引 - 按SHA-256去重已上传的PDF"""
+import os
+import hmac
+import json
+import time
+import hashlib
+import secrets
+import threading
+from config import Config
+
+
+class UploadIndex:
+    """SHA-256 -> file_id 索引
+
+    相同内容的文件只保存一份, 重复上传直接复用已有file_id。
+    索引记录最近一次上传/查询的时间(last_seen), 清理时以
+    max(文件修改时间, last_seen)判断是否过期, 不修改源文件的mtime,
+    以免已有的预览缓存和文档句柄失效。
+
+    仅知道哈希不能取得file_id: 客户端需先领取挑战(随机nonce和若干字节区间),
+    再提交SHA-256(nonce + 各区间内容)证明持有该文件。
+    """
+
+    def __init__(self, index_path=None):
+        self.index_path = index_path or os.path.join(Config.DATA_FOLDER, 'upload_index.json')
+        self.lock = threading.Lock()
+        self._entries = self._load()  # sha256 -> {'file_id', 'size', 'last_seen'}
+        self._by_file_id = {e['file_id']: h for h, e in self._entries.items()}
+        self._challenges = {}  # nonce -> {'sha256', 'ranges', 'expires'}, 按创建顺序
+
+    def _load(self):
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self):
+        """写入索引文件(需持有锁)"""
+        tmp_path = f"{self.index_path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._entries, f)
+            os.replace(tmp_path, self.index_path)
+        except OSError as e:
+            print(f"保存上传索引失败: {e}")
+
+    def lookup(self, sha256, touch=True):
+        """查找内容相同的已有文件, 文件已不存在时返回None
+
+        touch=True时刷新其过期时间。
+        """
+        with self.lock:
+            entry = self._entries.get(sha256)
+            if entry is None:
+                return None
+
+            filepath = os.path.join(Config.TEMP_FOLDER, f"{entry['file_id']}.pdf")
+            if not os.path.exists(filepath):
+                self._remove(sha256)
+                self._save()
+                return None
+
+            if touch:
+                entry['last_seen'] = time.time()
+                self._save()
+            return dict(entry, sha256=sha256)
+
+    def create_challenge(self, sha256):
+        """为已有文件生成持有证明挑战, 文件不存在时返回None"""
+        entry = self.lookup(sha256, touch=False)
+        if entry is None:
+            return None
+
+        size = entry['size']
+        length = min(Config.UPLOAD_CHALLENGE_RANGE_SIZE, size)
+        starts = sorted(secrets.randbelow(size - length + 1) for _ in range(Config.UPLOAD_CHALLENGE_RANGES))
+        ranges = [[start, start + length] for start in starts]
+        nonce = secrets.token_hex(16)
+
+        now = time.monotonic()
+        with self.lock:
+            for key in [k for k, c in self._challenges.items() if c['expires'] < now]:
+                del self._challenges[key]
+            while len(self._challenges) >= Config.UPLOAD_CHALLENGE_MAX_PENDING:
+                del self._challenges[next(iter(self._challenges))]
+            self._challenges[nonce] = {
+                'sha256': sha256,
+                'ranges': ranges,
+                'expires': now + Config.UPLOAD_CHALLENGE_TTL
+            }
+        return {'nonce': nonce, 'ranges': ranges, 'expires_in': Config.UPLOAD_CHALLENGE_TTL}
+
+    def verify_challenge(self, sha256, nonce, proof):
+        """校验持有证明(每个挑战只能使用一次), 通过时返回索引条目并刷新过期时间, 否则返回None"""
+        with self.lock:
+            challenge = self._challenges.pop(nonce, None)
+        if (challenge is None or challenge['sha256'] != sha256
+                or challenge['expires'] < time.monotonic() or not isinstance(proof, str)):
+            return None
+
+        entry = self.lookup(sha256)
+        if entry is None:
+            return None
+
+        digest = hashlib.sha256(nonce.encode('ascii'))
+        try:
+            with open(os.path.join(Config.TEMP_FOLDER, f"{entry['file_id']}.pdf"), 'rb') as f:
+                for start, end in challenge['ranges']:
+                    f.seek(start)
+                    digest.update(f.read(end - start))
+        except OSError:
+            return None
+
+        if not hmac.compare_digest(digest.hexdigest(), proof.lower()):
+            return None
+        return entry
+
+    def register(self, sha256, file_id, size):
+        """登记新上传的文件"""
+        with self.lock:
+            if sha256 in self._entries:
+                self._remove(sha256)
+            self._entries[sha256] = {'file_id': file_id, 'size': size, 'last_seen': time.time()}
+            self._by_file_id[file_id] = sha256
+            self._save()
+
+    def last_seen(self, file_id):
+        """文件最近一次被上传或查询的时间戳, 未登记返回0"""
+        with self.lock:
+            sha256 = self._by_file_id.get(file_id)
+            return self._entries[sha256]['last_seen'] if sha256 else 0
+
+    def touch(self, file_id):
+        """刷新文件的过期时间(未登记的文件忽略)"""
+        with self.lock:
+            sha256 = self._by_file_id.get(file_id)
+            if sha256:
+                self._entries[sha256]['last_seen'] = time.time()
+                self._save()
+    
+    def get_hash(self, file_id):
+        """获取文件的SHA-256, 未登记返回None"""
+        with self.lock:
+            return self._by_file_id.get(file_id)
+
+    def forget(self, file_id):
+        """文件被删除时移除索引条目"""
+        with self.lock:
+            sha256 = self._by_file_id.get(file_id)
+            if sha256:
+                self._remove(sha256)
+                self._save()
+
+    def _remove(self, sha256):
+        """移除条目(需持有锁)"""
+        entry = self._entries.pop(sha256, None)
+        if entry:
+            self._by_file_id.pop(entry['file_id'], None)
+
+# 全局实例
+upload_index = UploadIndex()
@@ -0,0 +1,270 @@
+"""分块上传会话 - 支持断点续传的大文件上传"""
+import os
+import json
+import time
+import uuid
+import hashlib
+import threading
+from werkzeug.utils import secure_filename
+from config import Config
+
+STREAM_BUFFER_SIZE = 64 * 1024
+PDF_MAGIC = b'%PDF-'
+
+
+class UploadSessionError(Exception):
+    """分块上传请求无效, status为对应的HTTP状态码"""
+
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+class UploadSessionManager:
+    """分块上传会话管理
+
+    每个会话在会话目录下对应两个文件: {upload_id}.part(已接收的数据)和
+    {upload_id}.json(文件名、声明大小等元信息)。已确认的偏移量即.part文件
+    的实际大小, 客户端断线后查询该偏移量即可续传。
+    SHA-256在接收数据时增量计算; 服务重启后首次写入时从.part文件重建。
+    """
+
+    def __init__(self, session_dir=None):
+        self.session_dir = session_dir or Config.UPLOAD_SESSION_FOLDER
+        self.lock = threading.Lock()
+        self._locks = {}    # upload_id -> 会话锁(同一会话的分块串行写入)
+        self._hashers = {}  # upload_id -> (sha256对象, 已计算字节数)
+
+    def _paths(self, upload_id):
+        base = os.path.join(self.session_dir, upload_id)
+        return f"{base}.part", f"{base}.json"
+
+    @staticmethod
+    def _check_id(upload_id):
+        # upload_id来自URL, 只接受本类生成的UUID格式
+        try:
+            valid = str(uuid.UUID(upload_id)) == upload_id
+        except (ValueError, TypeError):
+            valid = False
+        if not valid:
+            raise UploadSessionError("上传会话不存在", 404)
+
+    def _session_lock(self, upload_id):
+        """获取会话锁, 会话不存在时抛出404(不为任意ID创建锁)"""
+        self._check_id(upload_id)
+        _, meta_path = self._paths(upload_id)
+        with self.lock:
+            lock = self._locks.get(upload_id)
+            if lock is None:
+                if not os.path.exists(meta_path):
+                    raise UploadSessionError("上传会话不存在或已过期", 404)
+                lock = self._locks[upload_id] = threading.Lock()
+            return lock
+
+    def _load(self, upload_id):
+        self._check_id(upload_id)
+        part_path, meta_path = self._paths(upload_id)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                session = json.load(f)
+            session['offset'] = os.path.getsize(part_path)
+        except (OSError, ValueError):
+            raise UploadSessionError("上传会话不存在或已过期", 404)
+        return session
+
+    def _active_bytes(self):
+        """未完成会话声明的总大小"""
+        total = 0
+        if os.path.exists(self.session_dir):
+            for filename in os.listdir(self.session_dir):
+                if not filename.endswith('.json'):
+                    continue
+                try:
+                    with open(os.path.join(self.session_dir, filename), 'r', encoding='utf-8') as f:
+                        total += json.load(f).get('size', 0)
+                except (OSError, ValueError):
+                    continue
+        return total
+
+    def create(self, filename, size):
+        """创建上传会话"""
+        if not filename or not filename.lower().endswith('.pdf'):
+            raise UploadSessionError("仅支持PDF文件")
+        if not isinstance(size, int) or size <= 0:
+            raise UploadSessionError("文件大小无效")
+        if size > Config.UPLOAD_SESSION_MAX_MB * 1024 * 1024:
+            raise UploadSessionError(f"文件超过{Config.UPLOAD_SESSION_MAX_MB}MB限制", 413)
+
+        os.makedirs(self.session_dir, exist_ok=True)
+        with self.lock:
+            if self._active_bytes() + size > Config.UPLOAD_SESSION_TOTAL_MAX_MB * 1024 * 1024:
+                raise UploadSessionError("上传任务过多,请稍后再试", 503)
+
+            upload_id = str(uuid.uuid4())
+            part_path, meta_path = self._paths(upload_id)
+            session = {
+                'upload_id': upload_id,
+                'filename': secure_filename(filename) or 'upload.pdf',
+                'size': size,
+                'created_at': time.time()
+            }
+            open(part_path, 'wb').close()
+            with open(meta_path, 'w', encoding='utf-8') as f:
+                json.dump(session, f)
+
+        return self.status(upload_id)
+
+    def status(self, upload_id):
+        """查询会话状态(已确认偏移量)"""
+        session = self._load(upload_id)
+        part_path, _ = self._paths(upload_id)
+        return {
+            'upload_id': upload_id,
+            'filename': session['filename'],
+            'size': session['size'],
+            'offset': session['offset'],
+            'chunk_size': Config.UPLOAD_CHUNK_SIZE_MB * 1024 * 1024,
+            'expires_at': os.path.getmtime(part_path) + Config.UPLOAD_SESSION_MAX_AGE_MINUTES * 60
+        }
+
+    def _hasher(self, upload_id, offset):
+        """获取与已接收数据一致的增量哈希(需持有会话锁)"""
+        hasher, hashed = self._hashers.get(upload_id, (None, 0))
+        if hasher is None or hashed != offset:
+            part_path, _ = self._paths(upload_id)
+            hasher = hashlib.sha256()
+            with open(part_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    hasher.update(chunk)
+        return hasher
+
+    def write_chunk(self, upload_id, offset, stream, length):
+        """在offset处追加一个分块, 返回新的偏移量
+
+        offset必须等于已确认的偏移量, 否则抛出409并附带当前偏移量。
+        """
+        if length is None or length <= 0:
+            raise UploadSessionError("缺少分块数据(Content-Length)")
+        if length > Config.UPLOAD_CHUNK_SIZE_MB * 1024 * 1024:
+            raise UploadSessionError(f"分块超过{Config.UPLOAD_CHUNK_SIZE_MB}MB限制", 413)
+
+        with self._session_lock(upload_id):
+            session = self._load(upload_id)
+            current = session['offset']
+            if offset != current:
+                raise UploadSessionError("偏移量不匹配", 409, offset=current)
+            if current + length > session['size']:
+                raise UploadSessionError("数据超出声明的文件大小", 413, offset=current)
+
+            hasher = self._hasher(upload_id, current)
+            part_path, _ = self._paths(upload_id)
+            written = 0
+            try:
+                with open(part_path, 'ab') as f:
+                    if current == 0:
+                        header = self._read_header(stream, length)
+                        if len(header) < min(len(PDF_MAGIC), length):
+                            # 文件头未收全连接就已中断, 不写入, 客户端从0重传
+                            return current
+                        if not header.startswith(PDF_MAGIC):
+                            raise UploadSessionError("无效的PDF文件", 422, offset=0)
+                        f.write(header)
+                        hasher.update(header)
+                        written = len(header)
+                    
+                    while written < length:
+                        chunk = stream.read(min(STREAM_BUFFER_SIZE, length - written))
+                        if not chunk:
+                            break
+                        f.write(chunk)
+                        hasher.update(chunk)
+                        written += len(chunk)
+            finally:
+                # 连接中断时已写入的部分同样计入偏移量, 客户端从该处续传
+                self._hashers[upload_id] = (hasher, current + written)
+
+            return current + written
+
+    @staticmethod
+    def _read_header(stream, length):
+        """读取首个分块开头的文件头(单次read可能不足5字节)"""
+        size = min(len(PDF_MAGIC), length)
+        header = b''
+        while len(header) < size:
+            chunk = stream.read(size - len(header))
+            if not chunk:
+                break
+            header += chunk
+        return header
+
+    def finalize(self, upload_id):
+        """完成上传: 校验完整性后移入临时目录, 返回(临时路径, 文件名, sha256)"""
+        with self._session_lock(upload_id):
+            session = self._load(upload_id)
+            if session['offset'] != session['size']:
+                raise UploadSessionError(
+                    f"上传未完成({session['offset']}/{session['size']})", 409, offset=session['offset']
+                )
+
+            hasher = self._hasher(upload_id, session['offset'])
+            part_path, meta_path = self._paths(upload_id)
+            file_id = str(uuid.uuid4())
+            filepath = os.path.join(Config.TEMP_FOLDER, f"{file_id}.pdf")
+            os.replace(part_path, filepath)
+            self._discard(upload_id, meta_path)
+
+        return file_id, filepath, session['filename'], hasher.hexdigest()
+
+    def abort(self, upload_id):
+        """取消上传并删除已接收的数据"""
+        with self._session_lock(upload_id):
+            self._load(upload_id)
+            part_path, meta_path = self._paths(upload_id)
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            self._discard(upload_id, meta_path)
+
+    def _discard(self, upload_id, meta_path):
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+        with self.lock:
+            self._locks.pop(upload_id, None)
+            self._hashers.pop(upload_id, None)
+
+    def cleanup_expired(self, max_age_minutes=None):
+        """删除长时间无新数据的会话, 返回删除的会话数"""
+        if max_age_minutes is None:
+            max_age_minutes = Config.UPLOAD_SESSION_MAX_AGE_MINUTES
+        if not os.path.exists(self.session_dir):
+            return 0
+
+        cutoff = time.time() - max_age_minutes * 60
+        removed = 0
+        for filename in os.listdir(self.session_dir):
+            if not filename.endswith('.json'):
+                continue
+            upload_id = filename[:-len('.json')]
+            part_path, meta_path = self._paths(upload_id)
+            try:
+                last_active = os.path.getmtime(part_path if os.path.exists(part_path) else meta_path)
+            except OSError:
+                continue
+            if last_active >= cutoff:
+                continue
+
+            try:
+                lock = self._session_lock(upload_id)
+            except UploadSessionError:
+                # 同时已完成或取消
+                continue
+            with lock:
+                for path in (part_path, meta_path):
+                    if os.path.exists(path):
+                        os.remove(path)
+                self._discard(upload_id, meta_path)
+            removed += 1
+        return removed
+
+# 全局实例
+upload_sessions = UploadSessionManager()
@@ -0,0 +1,142 @@
+"""流式ZIP打包 - 边读文件边输出, 支持HTTP Range续传"""
+import os
+import struct
+import zlib
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+READ_CHUNK_SIZE = 64 * 1024
+_ZIP32_LIMIT = 0xFFFFFFFF
+
+# CRC缓存: (路径, 大小, 修改时间) -> crc32, 同一批文件重复下载/续传时无需重新计算
+_crc_cache = OrderedDict()
+_crc_cache_lock = threading.Lock()
+_CRC_CACHE_MAX_ENTRIES = 4096
+
+
+def _file_crc32(path, size, mtime):
+    key = (path, size, mtime)
+    with _crc_cache_lock:
+        if key in _crc_cache:
+            _crc_cache.move_to_end(key)
+            return _crc_cache[key]
+
+    crc = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(READ_CHUNK_SIZE), b''):
+            crc = zlib.crc32(chunk, crc)
+
+    with _crc_cache_lock:
+        _crc_cache[key] = crc
+        while len(_crc_cache) > _CRC_CACHE_MAX_ENTRIES:
+            _crc_cache.popitem(last=False)
+    return crc
+
+
+def _dos_datetime(mtime):
+    dt = datetime.fromtimestamp(mtime)
+    if dt.year < 1980:
+        dt = datetime(1980, 1, 1)
+    dos_time = (dt.hour << 11) | (dt.minute << 5) | (dt.second // 2)
+    dos_date = ((dt.year - 1980) << 9) | (dt.month << 4) | dt.day
+    return dos_time, dos_date
+
+
+class ZipStream:
+    """仅存储(STORED)模式的ZIP流
+
+    图片、PDF、docx本身已经压缩, 不再重复压缩。由于不压缩, 每个条目的
+    大小和CRC在输出前即可确定, 整个归档的字节布局固定: 总长度可作为
+    Content-Length, 任意区间[start, end)都能直接定位到对应的头部或文件
+    片段输出, 从而支持Range请求, 不需要在内存或磁盘中先生成归档。
+    """
+
+    def __init__(self, entries):
+        """entries: [(归档内文件名, 磁盘路径)]"""
+        self._segments = []  # (起始偏移, 长度, bytes 或 文件路径)
+        central = []
+        offset = 0
+        seen = set()
+
+        for arcname, path in entries:
+            if arcname in seen or not os.path.isfile(path):
+                continue
+            seen.add(arcname)
+
+            stat = os.stat(path)
+            size = stat.st_size
+            crc = _file_crc32(path, size, stat.st_mtime)
+            dos_time, dos_date = _dos_datetime(stat.st_mtime)
+            name = arcname.replace(os.sep, '/').encode('utf-8')
+
+            if offset + size > _ZIP32_LIMIT:
+                raise ValueError("打包文件总大小超过4GB")
+
+            # 通用标志位11: 文件名使用UTF-8
+            local_header = struct.pack(
+                '<IHHHHHIIIHH', 0x04034b50, 20, 0x0800, 0, dos_time, dos_date,
+                crc, size, size, len(name), 0
+            ) + name
+            self._add(offset, local_header)
+            local_offset = offset
+            offset += len(local_header)
+
+            self._segments.append((offset, size, path))
+            offset += size
+
+            central.append(struct.pack(
+                '<IHHHHHHIIIHHHHHII', 0x02014b50, 20, 20, 0x0800, 0, dos_time, dos_date,
+                crc, size, size, len(name), 0, 0, 0, 0, 0, local_offset
+            ) + name)
+
+        central_offset = offset
+        for record in central:
+            self._add(offset, record)
+            offset += len(record)
+
+        end_record = struct.pack(
+            '<IHHHHIIH', 0x06054b50, 0, 0, len(central), len(central),
+            offset - central_offset, central_offset, 0
+        )
+        self._add(offset, end_record)
+        self.size = offset + len(end_record)
+        self.entry_count = len(central)
+
+        digest = hashlib.sha1()
+        for record in central:
+            digest.update(record)
+        self.etag = digest.hexdigest()
+
+    def _add(self, offset, data):
+        self._segments.append((offset, len(data), data))
+
+    def iter_range(self, start=0, end=None):
+        """按顺序输出区间[start, end)内的字节"""
+        if end is None or end > self.size:
+            end = self.size
+
+        for seg_start, length, payload in self._segments:
+            seg_end = seg_start + length
+            if seg_end <= start or length == 0:
+                continue
+            if seg_start >= end:
+                break
+
+            lo = max(start, seg_start) - seg_start
+            hi = min(end, seg_end) - seg_start
+
+            if isinstance(payload, bytes):
+                yield payload[lo:hi]
+                continue
+
+            with open(payload, 'rb') as f:
+                f.seek(lo)
+                remaining = hi - lo
+                while remaining > 0:
+                    chunk = f.read(min(READ_CHUNK_SIZE, remaining))
+                    if not chunk:
+                        raise IOError(f"文件在打包过程中被修改: {payload}")
+                    remaining -= len(chunk)
+                    yield chunk
@@ -6,6 +6,10 @@
 const API_BASE = window.location.protocol + '//' + window.location.hostname +
     (window.location.port !== '80' && window.location.port !== '' ? ':' + window.location.port : '') + '/api';
 
+// 超过该大小的文件使用分块上传(可断点续传)
+const CHUNKED_UPLOAD_THRESHOLD = 5 * 1024 * 1024;
+const CHUNK_MAX_RETRIES = 5;
+
 class API {
     /**
      * 通用请求方法
@@ -43,9 +47,73 @@ class API {
     }
 
     /**
-     * 上传PDF文件
+     * 计算文件SHA-256(仅安全上下文可用, 不可用时返回null)
      */
-    static async uploadFile(file) {
+    static async hashFile(file) {
+        if (!window.crypto || !window.crypto.subtle) {
+            return null;
+        }
+        const digest = await window.crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+        return Array.from(new Uint8Array(digest))
+            .map(b => b.toString(16).padStart(2, '0'))
+            .join('');
+    }
+
+    /**
+     * 按哈希查询服务器是否已有该文件, 有则按挑战提交持有证明, 未命中或校验失败时返回null
+     */
+    static async checkFile(file, sha256) {
+        const response = await fetch(API_BASE + '/files/' + sha256);
+        if (!response.ok) {
+            return null;
+        }
+        const { challenge } = await response.json();
+
+        // 证明 = SHA-256(nonce + 各字节区间内容)
+        const parts = [new TextEncoder().encode(challenge.nonce)];
+        for (const [start, end] of challenge.ranges) {
+            parts.push(new Uint8Array(await file.slice(start, end).arrayBuffer()));
+        }
+        const buffer = new Uint8Array(parts.reduce((total, part) => total + part.length, 0));
+        let offset = 0;
+        for (const part of parts) {
+            buffer.set(part, offset);
+            offset += part.length;
+        }
+        const digest = await window.crypto.subtle.digest('SHA-256', buffer);
+        const proof = Array.from(new Uint8Array(digest))
+            .map(b => b.toString(16).padStart(2, '0'))
+            .join('');
+
+        const claim = await fetch(API_BASE + '/files/' + sha256 + '/claim', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ nonce: challenge.nonce, proof })
+        });
+        if (!claim.ok) {
+            return null;
+        }
+        return await claim.json();
+    }
+
+    /**
+     * 上传PDF文件(服务器已有相同内容时跳过上传, 大文件分块上传)
+     */
+    static async uploadFile(file, onProgress = null) {
+        try {
+            const sha256 = await this.hashFile(file);
+            const existing = sha256 ? await this.checkFile(file, sha256) : null;
+            if (existing) {
+                return { ...existing, filename: file.name, deduplicated: true };
+            }
+        } catch (error) {
+            console.warn('文件哈希检查失败, 直接上传:', error);
+        }
+
+        if (file.size > CHUNKED_UPLOAD_THRESHOLD) {
+            return await this.uploadFileChunked(file, onProgress);
+        }
+
         const formData = new FormData();
         formData.append('file', file);
 
@@ -62,6 +130,59 @@ class API {
         return await response.json();
     }
 
+    /**
+     * 分块上传, 单个分块失败时查询服务器已确认的偏移量后续传
+     */
+    static async uploadFileChunked(file, onProgress = null) {
+        const session = await this.request('/uploads', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ filename: file.name, size: file.size })
+        });
+
+        const uploadId = session.upload_id;
+        let offset = session.offset;
+        let retries = 0;
+
+        while (offset < file.size) {
+            const chunk = file.slice(offset, offset + session.chunk_size);
+            try {
+                const response = await fetch(`${API_BASE}/uploads/${uploadId}?offset=${offset}`, {
+                    method: 'PUT',
+                    headers: { 'Content-Type': 'application/octet-stream' },
+                    body: chunk
+                });
+                const data = await response.json();
+
+                if (response.ok) {
+                    offset = data.offset;
+                    retries = 0;
+                } else if (response.status === 409 && data.offset !== undefined) {
+                    offset = data.offset;
+                } else {
+                    throw new Error(data.error || `HTTP ${response.status}`);
+                }
+            } catch (error) {
+                if (++retries > CHUNK_MAX_RETRIES) {
+                    throw new Error(`上传失败: ${error.message}`);
+                }
+                await new Promise(resolve => setTimeout(resolve, 1000 * retries));
+                // 网络中断后以服务器已确认的偏移量为准
+                try {
+                    offset = (await this.request(`/uploads/${uploadId}`)).offset;
+                } catch (statusError) {
+                    // 状态查询也失败时保持原偏移量重试
+                }
+            }
+
+            if (onProgress) {
+                onProgress(Math.round(offset / file.size * 100));
+            }
+        }
+
+        return await this.request(`/uploads/${uploadId}/finalize`, { method: 'POST' });
+    }
+
     /**
      * 获取PDF页面预览
      */
@@ -69,6 +190,34 @@ class API {
         return `${API_BASE}/preview/${fileId}?page=${page}`;
     }
 
+    /**
+     * 获取全部页面缩略图的雪碧图索引(含sprite_url和每页位置)
+     */
+    static async getThumbnailSprite(fileId, width = 120) {
+        return await this.request(`/thumbnails/${fileId}/index?width=${width}`);
+    }
+
+    /**
+     * 获取上传后预热状态, 完成后含逐页探测结果(has_text/image_count等)
+     */
+    static async getPrewarmStatus(fileId) {
+        return await this.request(`/prewarm/${fileId}`);
+    }
+
+    /**
+     * 获取页面瓦片金字塔信息
+     */
+    static async getTileInfo(fileId, page) {
+        return await this.request(`/tiles/${fileId}/${page}/info`);
+    }
+
+    /**
+     * 获取页面瓦片(深度缩放查看器按视口请求)
+     */
+    static getTileUrl(fileId, page, level, x, y, format = 'jpeg', quality = 80) {
+        return `${API_BASE}/tiles/${fileId}/${page}/${level}/${x}_${y}?format=${format}&quality=${quality}`;
+    }
+
     /**
      * 提取文字
      */
@@ -134,11 +283,44 @@ class API {
 
     /**
      * 查询任务状态
+     * wait > 0 时为长轮询: 服务端在状态版本超过version或超时后返回
      */
-    static async getTaskStatus(taskId) {
+    static async getTaskStatus(taskId, wait = 0, version = 0) {
+        if (wait > 0) {
+            return await this.request(`/task-status/${taskId}?wait=${wait}&version=${version}`);
+        }
         return await this.request(`/task-status/${taskId}`);
     }
 
+    /**
+     * 创建虚拟文档(编辑操作只记录日志, 下载时才生成PDF)
+     */
+    static async createVirtualDoc(fileIds) {
+        return await this.request('/virtual-docs', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ file_ids: fileIds })
+        });
+    }
+
+    /**
+     * 对虚拟文档追加编辑操作, 例如 {op: 'rotate', rotations: {1: 90}}
+     */
+    static async applyVirtualDocOps(vdocId, ops) {
+        return await this.request(`/virtual-docs/${vdocId}/ops`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ ops })
+        });
+    }
+
+    /**
+     * 任务全部输出的ZIP下载地址
+     */
+    static getTaskArchiveUrl(taskId, thumbnails = false) {
+        return `${API_BASE}/task-archive/${taskId}?thumbnails=${thumbnails ? 1 : 0}`;
+    }
+
     /**
      * 下载文件
      */
@@ -147,30 +329,85 @@ class API {
     }
 
     /**
-     * 轮询任务状态直到完成
+     * 等待任务完成
+     * 优先使用SSE推送, 不可用时回退到长轮询
      */
     static async pollTaskStatus(taskId, onProgress = null) {
+        if (window.EventSource) {
+            try {
+                return await this.watchTaskEvents(taskId, onProgress);
+            } catch (error) {
+                if (!error.fallback) {
+                    throw error;
+                }
+                console.warn('SSE连接中断, 改用长轮询', error);
+            }
+        }
+        return await this.longPollTaskStatus(taskId, onProgress);
+    }
+
+    /**
+     * 通过SSE接收任务状态
+     */
+    static watchTaskEvents(taskId, onProgress = null) {
         return new Promise((resolve, reject) => {
-            const interval = setInterval(async () => {
-                try {
-                    const status = await this.getTaskStatus(taskId);
-
-                    if (onProgress) {
-                        onProgress(status);
-                    }
-
-                    if (status.status === 'COMPLETED') {
-                        clearInterval(interval);
-                        resolve(status.result);
-                    } else if (status.status === 'FAILED') {
-                        clearInterval(interval);
-                        reject(new Error(status.error || '任务失败'));
-                    }
-                } catch (error) {
-                    clearInterval(interval);
-                    reject(error);
+            const source = new EventSource(`${API_BASE}/task-events/${taskId}`);
+            let settled = false;
+
+            source.addEventListener('status', (event) => {
+                const status = JSON.parse(event.data);
+
+                if (onProgress) {
+                    onProgress(status);
                 }
-            }, 300); // 每300ms轮询一次
+
+                if (status.status === 'COMPLETED') {
+                    settled = true;
+                    source.close();
+                    resolve(status.result);
+                } else if (status.status === 'FAILED') {
+                    settled = true;
+                    source.close();
+                    reject(new Error(status.error || '任务失败'));
+                }
+            });
+
+            source.onerror = () => {
+                if (settled) return;
+                settled = true;
+                source.close();
+                const error = new Error('SSE连接失败');
+                error.fallback = true;
+                reject(error);
+            };
         });
     }
+
+    /**
+     * 长轮询任务状态直到完成
+     */
+    static async longPollTaskStatus(taskId, onProgress = null) {
+        let version = 0;
+
+        while (true) {
+            const status = await this.getTaskStatus(taskId, 25, version);
+
+            if (onProgress) {
+                onProgress(status);
+            }
+
+            if (status.status === 'COMPLETED') {
+                return status.result;
+            } else if (status.status === 'FAILED') {
+                throw new Error(status.error || '任务失败');
+            }
+
+            if (status.version) {
+                version = status.version;
+            } else {
+                // 服务端不支持长轮询时退化为300ms间隔轮询
+                await new Promise(resolve => setTimeout(resolve, 300));
+            }
+        }
+    }
 }
@@ -124,15 +124,17 @@ async function handleFileSelect(event) {
         return;
     }
 
-    if (file.size > 20 * 1024 * 1024) {
-        showToast('文件大小超过20MB限制', 'error');
+    if (file.size > 200 * 1024 * 1024) {
+        showToast('文件大小超过200MB限制', 'error');
         return;
     }
 
     showProgress('上传中...');
 
     try {
-        const result = await API.uploadFile(file);
+        const result = await API.uploadFile(file, progress => {
+            showProgress(`上传中... ${progress}%`, progress);
+        });
 
         state.currentFile = result;
         state.totalPages = result.pages;
@@ -436,14 +438,18 @@ async function extractTextEnhanced() {
     }
 }
 
-async function extractTables() {
+async function extractTables(forceDetection = false) {
     showProgress('提取表格中...');
 
     try {
         const response = await fetch(`${API.API_BASE || window.location.origin + '/api'}/extract-tables`, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ file_id: state.currentFile.file_id, pages: [] })
+            body: JSON.stringify({
+                file_id: state.currentFile.file_id,
+                pages: [],
+                force_table_detection: forceDetection
+            })
         });
 
         const data = await response.json();
@@ -456,6 +462,13 @@ async function extractTables() {
         // 生成表格HTML
         let html = `<div style="padding: 20px;"><h3>共提取 ${result.total_tables} 个表格:</h3>`;
 
+        // 预筛判定无表格框线而跳过的页面, 可要求完整检测
+        const skipped = result.table_skipped_pages || [];
+        if (skipped.length > 0) {
+            html += `<p style="font-size: 12px; color: #666;">${skipped.length} 页未发现表格框线, 已跳过检测 ` +
+                `<a href="#" onclick="extractTables(true); return false;">完整检测全部页面</a></p>`;
+        }
+
         for (const [pageNum, tables] of Object.entries(result.tables)) {
             if (tables.length > 0) {
                 html += `<h4 style="margin-top: 20px; border-bottom: 1px solid #eee; padding-bottom: 10px;">第 ${pageNum} 页</h4>`;
@@ -547,13 +560,16 @@ async function confirmImageExport() {
         }
 
         if (result.images && result.images.length > 0) {
+            html += `<p style="margin-bottom: 15px;">
+                <a href="${API.getTaskArchiveUrl(response.task_id)}" class="btn btn-primary" download>打包下载全部图片(ZIP)</a>
+            </p>`;
             html += `<div style="display: grid; grid-template-columns: repeat(auto-fill, minmax(200px, 1fr)); gap: 20px;">`;
             result.images.forEach(img => {
                 html += `
                 <div style="border: 1px solid #eee; border-radius: 8px; padding: 10px; text-align: center; background: #f9fafb;">
                     <div style="height: 120px; display: flex; align-items: center; justify-content: center; background: #e5e7eb; border-radius: 4px; margin-bottom: 10px; overflow: hidden;">
                         ${img.thumbnail
-                        ? `<img src="/api/images/${img.thumbnail}" style="max-width: 100%; max-height: 100%; object-fit: contain;" alt="${img.filename}">`
+                        ? `<img src="${img.thumbnail_url || '/api/images/' + img.thumbnail}" style="max-width: 100%; max-height: 100%; object-fit: contain;" alt="${img.filename}">`
                         : `<span style="color: #6b7280;">${img.format.toUpperCase()}</span>`
                     }
                     </div>
@@ -737,6 +753,7 @@ async function openSettings() {
     const settingsModal = document.getElementById('settingsModal');
     const enableLayoutCheckbox = document.getElementById('enableLayout');
     const enableOCRCheckbox = document.getElementById('enableOCR');
+    const extractionBackendSelect = document.getElementById('extractionBackend');
     const exportPathInput = document.getElementById('exportPath');
 
     // 密码验证
@@ -753,6 +770,7 @@ async function openSettings() {
 
         if (enableLayoutCheckbox) enableLayoutCheckbox.checked = settings.enable_layout_preservation;
         if (enableOCRCheckbox) enableOCRCheckbox.checked = settings.enable_ocr;
+        if (extractionBackendSelect) extractionBackendSelect.value = settings.extraction_backend || 'pdfplumber';
         if (exportPathInput) exportPathInput.value = settings.export_path || '';
 
         if (settingsModal) settingsModal.style.display = 'flex';
@@ -769,11 +787,13 @@ function closeSettings() {
 async function saveSettings() {
     const enableLayoutCheckbox = document.getElementById('enableLayout');
     const enableOCRCheckbox = document.getElementById('enableOCR');
+    const extractionBackendSelect = document.getElementById('extractionBackend');
     const exportPathInput = document.getElementById('exportPath');
 
     const newSettings = {
         enable_layout_preservation: enableLayoutCheckbox ? enableLayoutCheckbox.checked : false,
         enable_ocr: enableOCRCheckbox ? enableOCRCheckbox.checked : false,
+        extraction_backend: extractionBackendSelect ? extractionBackendSelect.value : 'pdfplumber',
         export_path: exportPathInput ? exportPathInput.value.trim() : ''
     };
 